@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import json
 import os
-import pandas as pd
 from flask import jsonify, request
-from dbpy.database import get_db_connection
+from dbpy.channels import load_channels
+from dbpy.database import db_connection
+from dbpy.order_schema import pay_date_key
+from dbpy.sales_prefix import sales_range_totals
 from utils.auth import token_required
 from utils.error_handler import handle_api_error
 
@@ -29,11 +31,17 @@ def register_analyse_routes(app):
 
             print(f'筛选参数: 开始日期={start_date}, 结束日期={end_date}')
 
+            # 日期条件使用 pay_date 整数键（每日销售汇总表的主键前缀）
+            try:
+                start_key = pay_date_key(start_date) if start_date else None
+                end_key = pay_date_key(end_date) if end_date else None
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
             # 从数据库读取数据
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with db_connection(read_only=True) as conn:
+                cursor = conn.cursor()
 
-            try:
                 # 读取 CategoryInfo 表（作为 tab）
                 cursor.execute('SELECT id, name FROM CategoryInfo ORDER BY id')
                 categories = cursor.fetchall()
@@ -44,45 +52,7 @@ def register_analyse_routes(app):
                 product_mapping = {row['name']: row['mapped_title'] for row in cursor.fetchall()}
                 print(f'读取到 {len(product_mapping)} 条商品映射规则')
 
-                # 构建SQL查询 - 只选择必要字段，在数据库端过滤退款订单
-                sql = '''
-                    SELECT 
-                        商品名称,
-                        付款时间,
-                        订购数,
-                        让利后金额,
-                        店铺类型,
-                        是否退款
-                    FROM OrderDetails 
-                    WHERE 付款时间 IS NOT NULL AND 付款时间 != "NaT"
-                      AND ((是否退款 != '退款成功' AND 是否退款 != '退款中') OR 是否退款 IS NULL)
-                '''
-                params = []
-
-                if start_date:
-                    sql += ' AND 付款时间 >= ?'
-                    params.append(start_date)
-
-                if end_date:
-                    sql += ' AND 付款时间 <= ?'
-                    params.append(f'{end_date} 23:59:59')
-
-                sql += ' ORDER BY 付款时间'
-
-                cursor.execute(sql, params)
-                columns = [description[0] for description in cursor.description]
-                rows = cursor.fetchall()
-
-                # 转换为DataFrame
-                df_filtered = pd.DataFrame(rows, columns=columns)
-
-                print(f'从数据库读取到 {len(df_filtered)} 条有效记录（已过滤退款）')
-
-                # 记录未匹配的商品名称
-                unmatched_products = set()
-
-                # 为每个 category 生成数据
-                # 先读取ProductInfo的category映射
+                # 读取ProductInfo的category映射
                 cursor.execute('SELECT name, mapped_title, category FROM ProductInfo WHERE mapped_title IS NOT NULL AND mapped_title != ""')
                 product_full_mapping = {}
                 for row in cursor.fetchall():
@@ -91,145 +61,69 @@ def register_analyse_routes(app):
                         'category': row['category']
                     }
 
-                # 使用SQL GROUP BY进行聚合统计，提升性能
-                print("开始SQL聚合统计...")
-                
-                # 构建SQL聚合查询
-                aggregation_sql = '''
-                    SELECT 
-                        p.mapped_title,
-                        p.category,
-                        COALESCE(SUM(o.订购数), 0) as valid_orders,
-                        COALESCE(SUM(o.让利后金额), 0) as discount_amount,
-                        -- 抖音渠道统计
-                        COALESCE(SUM(CASE 
-                            WHEN (o.店铺类型 LIKE '%抖音%' OR o.店铺类型 LIKE '%今日头条%' OR o.店铺类型 LIKE '%鲁班%')
-                            THEN o.订购数 ELSE 0 
-                        END), 0) as douyin_orders,
-                        COALESCE(SUM(CASE 
-                            WHEN (o.店铺类型 LIKE '%抖音%' OR o.店铺类型 LIKE '%今日头条%' OR o.店铺类型 LIKE '%鲁班%')
-                            THEN o.让利后金额 ELSE 0 
-                        END), 0) as douyin_amount,
-                        -- 天猫渠道统计
-                        COALESCE(SUM(CASE 
-                            WHEN o.店铺类型 LIKE '%天猫%'
-                            THEN o.订购数 ELSE 0 
-                        END), 0) as tmall_orders,
-                        COALESCE(SUM(CASE 
-                            WHEN o.店铺类型 LIKE '%天猫%'
-                            THEN o.让利后金额 ELSE 0 
-                        END), 0) as tmall_amount,
-                        -- 有赞渠道统计
-                        COALESCE(SUM(CASE 
-                            WHEN o.店铺类型 LIKE '%有赞%'
-                            THEN o.订购数 ELSE 0 
-                        END), 0) as youzan_orders,
-                        COALESCE(SUM(CASE 
-                            WHEN o.店铺类型 LIKE '%有赞%'
-                            THEN o.让利后金额 ELSE 0 
-                        END), 0) as youzan_amount,
-                        -- 京东渠道统计
-                        COALESCE(SUM(CASE 
-                            WHEN o.店铺类型 LIKE '%京东%'
-                            THEN o.订购数 ELSE 0 
-                        END), 0) as jd_orders,
-                        COALESCE(SUM(CASE 
-                            WHEN o.店铺类型 LIKE '%京东%'
-                            THEN o.让利后金额 ELSE 0 
-                        END), 0) as jd_amount
-                    FROM OrderDetails o
-                    LEFT JOIN ProductInfo p ON o.商品名称 = p.name
-                    WHERE o.付款时间 IS NOT NULL AND o.付款时间 != "NaT"
-                      AND ((o.是否退款 != '退款成功' AND o.是否退款 != '退款中') OR o.是否退款 IS NULL)
-                '''
-                
-                # 为聚合查询创建独立的参数列表
-                aggregation_params = []
-                
-                # 添加日期范围条件
-                if start_date:
-                    aggregation_sql += ' AND o.付款时间 >= ?'
-                    aggregation_params.append(start_date)
-                
-                if end_date:
-                    aggregation_sql += ' AND o.付款时间 <= ?'
-                    aggregation_params.append(f'{end_date} 23:59:59')
-                
-                aggregation_sql += '''
-                    GROUP BY p.mapped_title, p.category
-                    HAVING p.mapped_title IS NOT NULL AND p.mapped_title != ""
-                    ORDER BY p.category, p.mapped_title
-                '''
-                
-                # 执行聚合查询
-                cursor.execute(aggregation_sql, aggregation_params)
-                aggregation_results = cursor.fetchall()
+                # 日期范围内各商品类型 × 渠道的有效订单合计（前缀和两列相减，耗时与日期范围和历史长度无关）
+                print("开始前缀和统计...")
+                totals = sales_range_totals(conn, start_key, end_key)
+
+                # 渠道统计字段（如 douyin_orders、douyin_amount），由 ChannelInfo 决定
+                channels = load_channels(conn)
+                channel_codes = {channel['id']: channel['code'] for channel in channels}
+
+                def empty_stats():
+                    stats = {'valid_orders': 0, 'discount_amount': 0.0}
+                    for channel in channels:
+                        stats[f"{channel['code']}_orders"] = 0
+                        stats[f"{channel['code']}_amount"] = 0.0
+                    return stats
                 
-                # 构建mapped_title_stats字典（与原有结构兼容）
+                # 构建mapped_title_stats字典（与原有结构兼容），每个渠道一行累加到对应的统计字段，
+                # 范围内没有有效订单的商品类型不计入
                 mapped_title_stats = {}
-                for row in aggregation_results:
-                    mapped_title = row['mapped_title']
-                    category_id = row['category']
-                    
-                    mapped_title_stats[mapped_title] = {
-                        'category': category_id,
-                        'valid_orders': row['valid_orders'],
-                        'discount_amount': row['discount_amount'],
-                        'douyin_orders': row['douyin_orders'],
-                        'douyin_amount': row['douyin_amount'],
-                        'tmall_orders': row['tmall_orders'],
-                        'tmall_amount': row['tmall_amount'],
-                        'youzan_orders': row['youzan_orders'],
-                        'youzan_amount': row['youzan_amount'],
-                        'jd_orders': row['jd_orders'],
-                        'jd_amount': row['jd_amount']
-                    }
+                for (mapped_title, channel_id), orders, amount, line_count in zip(
+                        totals['keys'], totals['quantity'], totals['amount'], totals['line_count']):
+                    if line_count == 0:
+                        continue
+                    stats = mapped_title_stats.get(mapped_title)
+                    if stats is None:
+                        stats = mapped_title_stats[mapped_title] = empty_stats()
+                    stats['valid_orders'] += orders
+                    stats['discount_amount'] += amount
+                    code = channel_codes.get(channel_id)
+                    if code:
+                        stats[f'{code}_orders'] += orders
+                        stats[f'{code}_amount'] += amount
                 
                 # 计算每个 mapped_title 的库存总量
                 print("开始计算库存总量...")
                 inventory_stats = {}
                 
-                # 获取所有 mapped_title
-                all_mapped_titles = set(mapped_title_stats.keys())
-                
-                # 对于每个 mapped_title，查询对应的商品名称
-                for mapped_title in all_mapped_titles:
-                    # 查询映射到该 mapped_title 的所有商品名称
-                    cursor.execute('SELECT name FROM ProductInfo WHERE mapped_title = ?', (mapped_title,))
-                    product_names = [row['name'] for row in cursor.fetchall()]
-                    
-                    if product_names:
-                        # 构建 IN 查询，计算库存总量
-                        placeholders = ','.join(['?'] * len(product_names))
-                        inventory_sql = f'''
-                            SELECT COALESCE(SUM(数量), 0) as total_inventory 
-                            FROM Inventory 
-                            WHERE 商品名称 IN ({placeholders})
-                        '''
-                        cursor.execute(inventory_sql, product_names)
-                        result = cursor.fetchone()
-                        total_inventory = result['total_inventory'] if result else 0
-                    else:
-                        total_inventory = 0
-                    
-                    inventory_stats[mapped_title] = total_inventory
-                    print(f"  {mapped_title}: {len(product_names)} 个商品，库存总量 = {total_inventory}")
+                # 一次查询各 mapped_title 下所有商品的库存总量（库存按商品名称保存，按 Inventory 的 商品名称+仓库 唯一索引连接）
+                # 旧数据库的 ProductInfo 中可能有同名的多行，先按 (商品名称, mapped_title) 去重，避免库存重复累加
+                cursor.execute('''
+                    SELECT
+                        p.mapped_title,
+                        COUNT(DISTINCT p.name) as product_count,
+                        COALESCE(SUM(i.数量), 0) as total_inventory
+                    FROM (SELECT DISTINCT name, mapped_title FROM ProductInfo) p
+                    LEFT JOIN Inventory i ON i.商品名称 = p.name
+                    WHERE p.mapped_title IS NOT NULL AND p.mapped_title != ""
+                    GROUP BY p.mapped_title
+                ''')
+                for row in cursor.fetchall():
+                    mapped_title = row['mapped_title']
+                    if mapped_title not in mapped_title_stats:
+                        continue
+                    inventory_stats[mapped_title] = row['total_inventory']
+                    print(f"  {mapped_title}: {row['product_count']} 个商品，库存总量 = {row['total_inventory']}")
                 
                 print(f"库存计算完成，共统计 {len(inventory_stats)} 个商品类型")
                 
-                # 统计未匹配的商品名称（通过对比原始数据）
-                # 获取所有有映射的商品名称
-                mapped_product_names = set(product_full_mapping.keys())
-                
-                # 检查df_filtered中的商品名称哪些没有映射
-                for idx, row in df_filtered.iterrows():
-                    product_name = row['商品名称']
-                    if product_name not in mapped_product_names:
-                        if idx < 30:  # 只打印前30条未匹配的
-                            print(f"未找到映射: {product_name}")
-                        unmatched_products.add(product_name)
+                # 范围内有有效订单、但没有映射的商品名称
+                unmatched_products = totals['unmatched_names']
+                for product_name in unmatched_products[:30]:  # 只打印前30条未匹配的
+                    print(f"未找到映射: {product_name}")
                 
-                print(f"SQL聚合完成，统计到 {len(mapped_title_stats)} 个商品类型")
+                print(f"前缀和统计完成，统计到 {len(mapped_title_stats)} 个商品类型")
 
                 # 按category分组组织数据
                 tabs_data = []
@@ -249,33 +143,10 @@ def register_analyse_routes(app):
                     type_stats = {}
                     for mapped_title in category_mapped_titles.keys():
                         if mapped_title in mapped_title_stats:
-                            stats = mapped_title_stats[mapped_title]
-                            type_stats[mapped_title] = {
-                                'valid_orders': stats['valid_orders'],
-                                'discount_amount': stats['discount_amount'],
-                                'douyin_orders': stats['douyin_orders'],
-                                'douyin_amount': stats['douyin_amount'],
-                                'tmall_orders': stats['tmall_orders'],
-                                'tmall_amount': stats['tmall_amount'],
-                                'youzan_orders': stats['youzan_orders'],
-                                'youzan_amount': stats['youzan_amount'],
-                                'jd_orders': stats['jd_orders'],
-                                'jd_amount': stats['jd_amount']
-                            }
+                            type_stats[mapped_title] = mapped_title_stats[mapped_title]
                         else:
                             # 没有数据，设置为0
-                            type_stats[mapped_title] = {
-                                'valid_orders': 0,
-                                'discount_amount': 0.0,
-                                'douyin_orders': 0,
-                                'douyin_amount': 0.0,
-                                'tmall_orders': 0,
-                                'tmall_amount': 0.0,
-                                'youzan_orders': 0,
-                                'youzan_amount': 0.0,
-                                'jd_orders': 0,
-                                'jd_amount': 0.0
-                            }
+                            type_stats[mapped_title] = empty_stats()
 
                     # 转换为列表格式
                     tab_data = {
@@ -283,16 +154,10 @@ def register_analyse_routes(app):
                         'data': [
                             {
                                 'product_type': product_type,
-                                'valid_orders': int(stats.get('valid_orders', 0)),
-                                'discount_amount': float(stats.get('discount_amount', 0)),
-                                'douyin_orders': int(stats.get('douyin_orders', 0)),
-                                'douyin_amount': float(stats.get('douyin_amount', 0)),
-                                'tmall_orders': int(stats.get('tmall_orders', 0)),
-                                'tmall_amount': float(stats.get('tmall_amount', 0)),
-                                'youzan_orders': int(stats.get('youzan_orders', 0)),
-                                'youzan_amount': float(stats.get('youzan_amount', 0)),
-                                'jd_orders': int(stats.get('jd_orders', 0)),
-                                'jd_amount': float(stats.get('jd_amount', 0)),
+                                **{
+                                    key: int(value) if key.endswith('_orders') else float(value)
+                                    for key, value in stats.items()
+                                },
                                 'inventory': int(inventory_stats.get(product_type, 0))  # 添加库存字段
                             }
                             for product_type, stats in type_stats.items()
@@ -310,18 +175,16 @@ def register_analyse_routes(app):
                     # 调试信息：打印统计结果
                     print(f'分类 {category_name} 统计结果:')
                     for item in tab_data['data']:
-                        print(f"  {item['product_type']}: 总数={item['valid_orders']}, 抖音={item['douyin_orders']}, 天猫={item['tmall_orders']}, 有赞={item['youzan_orders']}")
+                        channel_summary = ', '.join(f"{channel['name']}={item[channel['code'] + '_orders']}" for channel in channels)
+                        print(f"  {item['product_type']}: 总数={item['valid_orders']}, {channel_summary}")
 
                     tabs_data.append(tab_data)
 
                 return jsonify({
                     'tabs': tabs_data,
-                    'unmatched_products': list(unmatched_products)
+                    'unmatched_products': unmatched_products
                 })
 
-            finally:
-                conn.close()
-
         except Exception as e:
             print(f'处理数据时出错: {str(e)}')
             import traceback
@@ -7,7 +7,9 @@
 import sqlite3
 import pandas as pd
 from flask import jsonify, request
+from dbpy.channels import load_channels
 from dbpy.database import get_db_connection
+from dbpy.order_schema import format_pay_date, pay_date_key
 from utils.auth import token_required
 
 
@@ -35,6 +37,11 @@ def register_analyse_by_product_routes(app):
 
             # 计算聚合级别
             import datetime
+            try:
+                start_key = pay_date_key(start_date)
+                end_key = pay_date_key(end_date)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             start_dt = datetime.datetime.strptime(start_date, '%Y-%m-%d')
             end_dt = datetime.datetime.strptime(end_date, '%Y-%m-%d')
             days_diff = (end_dt - start_dt).days
@@ -56,16 +63,16 @@ def register_analyse_by_product_routes(app):
             print(f'日期范围: {days_diff}天, 聚合级别: {aggregation_level}')
 
             # 连接数据库
-            conn = get_db_connection()
+            conn = get_db_connection(read_only=True)
             cursor = conn.cursor()
 
-            # 先查询 ProductInfo 表，获取所有映射到该 mapped_title 的商品名称
-            cursor.execute('SELECT name FROM ProductInfo WHERE mapped_title = ?', (product_type,))
-            product_names = [row['name'] for row in cursor.fetchall()]
+            # 渠道列表（ChannelInfo），未匹配任何渠道的订单只计入整体数据
+            channels = load_channels(conn)
+            channel_names = [channel['name'] for channel in channels]
+            channel_name_by_id = {channel['id']: channel['name'] for channel in channels}
 
-            if not product_names:
-                conn.close()
-                return jsonify({
+            def empty_response():
+                return {
                     'success': True,
                     'product_type': product_type,
                     'aggregation_level': aggregation_level,
@@ -73,40 +80,43 @@ def register_analyse_by_product_routes(app):
                         'dates': [],
                         'overall': {'quantities': [], 'amounts': [], 'average_prices': []},
                         'channels': {
-                            '抖音': {'quantities': [], 'amounts': [], 'average_prices': []},
-                            '天猫': {'quantities': [], 'amounts': [], 'average_prices': []},
-                            '有赞': {'quantities': [], 'amounts': [], 'average_prices': []},
-                            '京东': {'quantities': [], 'amounts': [], 'average_prices': []}
+                            name: {'quantities': [], 'amounts': [], 'average_prices': []} for name in channel_names
                         }
                     },
                     'average_order_value': 0,
-                    'channel_sales': {'抖音': 0, '天猫': 0, '有赞': 0, '京东': 0}
-                })
+                    'channel_sales': {name: 0 for name in channel_names}
+                }
+
+            # 先查询 ProductInfo 表，获取所有映射到该 mapped_title 的商品
+            cursor.execute('SELECT id, name FROM ProductInfo WHERE mapped_title = ?', (product_type,))
+            products = cursor.fetchall()
+            product_ids = [row['id'] for row in products]
 
-            print(f'找到 {len(product_names)} 个商品名称映射到 {product_type}: {product_names}')
+            if not product_ids:
+                conn.close()
+                return jsonify(empty_response())
+
+            print(f'找到 {len(product_ids)} 个商品名称映射到 {product_type}: {[row["name"] for row in products]}')
 
-            # 查询该商品在指定日期范围内的数据
-            # 使用 IN 子句查询所有映射的商品名称
-            placeholders = ','.join(['?' for _ in product_names])
+            # 从每日销售汇总表查询该商品在指定日期范围内每天各渠道的数据
+            # 使用 IN 子句查询所有映射的 product_id
+            # 订购数只排除退款成功的订单，金额包含所有订单（与逐条统计订单时的口径一致）
+            placeholders = ','.join(['?' for _ in product_ids])
             query = f'''
                 SELECT
-                    付款时间,
-                    订购数,
-                    是否退款,
-                    让利后金额,
-                    店铺类型
-                FROM OrderDetails
-                WHERE 商品名称 IN ({placeholders})
-                  AND 付款时间 >= ?
-                  AND 付款时间 <= ?
-                ORDER BY 付款时间
+                    pay_date,
+                    channel_id,
+                    SUM(quantity + refunding_quantity) as valid_quantity,
+                    SUM(amount + refunding_amount + refunded_amount) as valid_amount
+                FROM DailySales
+                WHERE product_id IN ({placeholders})
+                  AND pay_date >= ?
+                  AND pay_date <= ?
+                GROUP BY pay_date, channel_id
+                ORDER BY pay_date, channel_id
             '''
 
-            # 构建日期范围（包含完整的日期时间）
-            start_datetime = f'{start_date} 00:00:00'
-            end_datetime = f'{end_date} 23:59:59'
-
-            cursor.execute(query, product_names + [start_datetime, end_datetime])
+            cursor.execute(query, product_ids + [start_key, end_key])
             rows = cursor.fetchall()
 
             conn.close()
@@ -115,52 +125,14 @@ def register_analyse_by_product_routes(app):
             df = pd.DataFrame([dict(row) for row in rows])
 
             if len(df) == 0:
-                return jsonify({
-                    'success': True,
-                    'product_type': product_type,
-                    'aggregation_level': aggregation_level,
-                    'sales_curve': {
-                        'dates': [],
-                        'overall': {'quantities': [], 'amounts': [], 'average_prices': []},
-                        'channels': {
-                            '抖音': {'quantities': [], 'amounts': [], 'average_prices': []},
-                            '天猫': {'quantities': [], 'amounts': [], 'average_prices': []},
-                            '有赞': {'quantities': [], 'amounts': [], 'average_prices': []},
-                            '京东': {'quantities': [], 'amounts': [], 'average_prices': []}
-                        }
-                    },
-                    'average_order_value': 0,
-                    'channel_sales': {'抖音': 0, '天猫': 0, '有赞': 0, '京东': 0}
-                })
+                return jsonify(empty_response())
 
             # 1. 计算销售曲线数据（按天汇总）
             # 提取日期部分
-            df['date'] = df['付款时间'].apply(lambda x: x.split(' ')[0] if x else '')
-            
-            # 计算有效订购数（排除退款成功的）
-            df['valid_quantity'] = df.apply(
-                lambda row: 0 if row['是否退款'] == '退款成功' else row['订购数'], 
-                axis=1
-            )
+            df['date'] = df['pay_date'].map(format_pay_date)
             
-            # 处理让利后金额
-            df['valid_amount'] = pd.to_numeric(df['让利后金额'], errors='coerce').fillna(0)
-            
-            # 识别渠道
-            def identify_channel(shop_type):
-                shop_type_str = str(shop_type) if pd.notna(shop_type) else ''
-                if '抖音' in shop_type_str or '今日头条' in shop_type_str or '鲁班' in shop_type_str:
-                    return '抖音'
-                elif '天猫' in shop_type_str:
-                    return '天猫'
-                elif '有赞' in shop_type_str:
-                    return '有赞'
-                elif '京东' in shop_type_str:
-                    return '京东'
-                else:
-                    return '其他'
-            
-            df['channel'] = df['店铺类型'].apply(identify_channel)
+            # 渠道名称（入库时已按店铺类型计算 channel_id，0 为未匹配任何渠道）
+            df['channel'] = df['channel_id'].map(channel_name_by_id).fillna('其他')
 
             # 根据聚合级别生成日期标签和映射函数
             def get_aggregation_functions(level):
@@ -271,10 +243,8 @@ def register_analyse_by_product_routes(app):
                     'average_prices': [0] * len(aggregation_labels)
                 },
                 'channels': {
-                    '抖音': {'quantities': [0] * len(aggregation_labels), 'amounts': [0.0] * len(aggregation_labels), 'average_prices': [0] * len(aggregation_labels)},
-                    '天猫': {'quantities': [0] * len(aggregation_labels), 'amounts': [0.0] * len(aggregation_labels), 'average_prices': [0] * len(aggregation_labels)},
-                    '有赞': {'quantities': [0] * len(aggregation_labels), 'amounts': [0.0] * len(aggregation_labels), 'average_prices': [0] * len(aggregation_labels)},
-                    '京东': {'quantities': [0] * len(aggregation_labels), 'amounts': [0.0] * len(aggregation_labels), 'average_prices': [0] * len(aggregation_labels)}
+                    name: {'quantities': [0] * len(aggregation_labels), 'amounts': [0.0] * len(aggregation_labels), 'average_prices': [0] * len(aggregation_labels)}
+                    for name in channel_names
                 }
             }
             
@@ -301,7 +271,7 @@ def register_analyse_by_product_routes(app):
                     sales_curve_data['overall']['amounts'][idx] += amount
                     
                     # 渠道数据累加
-                    if channel in ['抖音', '天猫', '有赞', '京东']:
+                    if channel in sales_curve_data['channels']:
                         sales_curve_data['channels'][channel]['quantities'][idx] += quantity
                         sales_curve_data['channels'][channel]['amounts'][idx] += amount
             
@@ -316,7 +286,7 @@ def register_analyse_by_product_routes(app):
                     sales_curve_data['overall']['average_prices'][idx] = 0
                 
                 # 各渠道客单价
-                for channel in ['抖音', '天猫', '有赞', '京东']:
+                for channel in channel_names:
                     channel_quantity = sales_curve_data['channels'][channel]['quantities'][idx]
                     channel_amount = sales_curve_data['channels'][channel]['amounts'][idx]
                     if channel_quantity > 0:
@@ -330,20 +300,11 @@ def register_analyse_by_product_routes(app):
             average_order_value = total_amount / total_quantity if total_quantity > 0 else 0
 
             # 3. 计算渠道销售分布
-            channel_sales = {'抖音': 0, '天猫': 0, '有赞': 0, '京东': 0}
+            channel_sales = {name: 0 for name in channel_names}
             
             for _, row in df.iterrows():
-                shop_type = str(row['店铺类型']) if pd.notna(row['店铺类型']) else ''
-                quantity = row['valid_quantity']
-                
-                if '抖音' in shop_type or '今日头条' in shop_type or '鲁班' in shop_type:
-                    channel_sales['抖音'] += quantity
-                elif '天猫' in shop_type:
-                    channel_sales['天猫'] += quantity
-                elif '有赞' in shop_type:
-                    channel_sales['有赞'] += quantity
-                elif '京东' in shop_type:
-                    channel_sales['京东'] += quantity
+                if row['channel'] in channel_sales:
+                    channel_sales[row['channel']] += row['valid_quantity']
 
             return jsonify({
                 'success': True,
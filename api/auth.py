@@ -3,7 +3,7 @@ from flask import jsonify, request, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import bcrypt
-from dbpy.database import get_db_connection
+from dbpy.database import db_connection
 from utils.auth import generate_token, verify_token, token_required
 from utils.operation_logger import log_operation
 from utils.error_handler import handle_api_error
@@ -44,10 +44,9 @@ def register_auth_routes(app):
             if not username or not password:
                 return jsonify({'error': '用户名和密码不能为空'}), 400
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with db_connection() as conn:
+                cursor = conn.cursor()
 
-            try:
                 # 查询用户
                 cursor.execute('SELECT id, username, password_hash, role FROM users WHERE username = ?', (username,))
                 user = cursor.fetchone()
@@ -81,9 +80,6 @@ def register_auth_routes(app):
                     }
                 })
 
-            finally:
-                conn.close()
-
         except Exception as e:
             return handle_api_error(e, "登录")
 
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+可续传的分块上传 API
+    POST   /api/uploads                       登记上传（文件名、大小、目标），返回上传ID和块大小
+    GET    /api/uploads/<upload_id>           查询已收到的块数（中断后续传）
+    PUT    /api/uploads/<upload_id>/chunks/<n> 上传第 n 块（请求体为原始字节）
+    POST   /api/uploads/<upload_id>/complete  全部上传后登记后台任务，返回值与普通上传接口相同
+    DELETE /api/uploads/<upload_id>           取消上传
+"""
+
+from flask import jsonify, request, g
+from api.upload import MAX_UPLOAD_SIZE_MB, UPLOAD_TARGETS, enqueue_saved_upload
+from utils.auth import token_required
+from utils.file_validator import FileValidator
+from utils.ingest_jobs import job_file_path
+from utils.ingest_telemetry import IngestTelemetry
+from utils.upload_sessions import (
+    UploadSessionError, complete_session, create_session, discard_session, get_session, session_status, write_chunk
+)
+
+
+def _owned_session(upload_id):
+    """读取当前用户自己的上传，不存在或属于其他用户时返回 (None, 错误响应)"""
+    session = get_session(upload_id)
+    if session is None:
+        return None, (jsonify({'error': '上传不存在或已过期'}), 404)
+    if session['username'] != g.current_user['username']:
+        return None, (jsonify({'error': '权限不足', 'code': 'INSUFFICIENT_PERMISSIONS'}), 403)
+    return session, None
+
+
+def register_chunked_upload_routes(app):
+    """注册分块上传相关 API 路由"""
+
+    @app.route('/api/uploads', methods=['POST'])
+    @token_required
+    def init_chunked_upload():
+        """
+        登记分块上传
+
+        Request body:
+            {
+                "filename": "文件名",
+                "size": 文件字节数,
+                "target": "analyse" | "database" | "inventory",
+                "dry_run": false,  // 可选，仅 database
+                "force": false     // 可选，相同文件已导入过时仍重新处理
+            }
+        """
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename') or ''
+        target = data.get('target')
+        size = data.get('size')
+
+        if target not in UPLOAD_TARGETS:
+            return jsonify({'error': f'未知的上传目标: {target}'}), 400
+        if not filename:
+            return jsonify({'error': '未选择文件'}), 400
+        if not isinstance(size, int) or size <= 0:
+            return jsonify({'error': '文件大小无效'}), 400
+        if size > MAX_UPLOAD_SIZE_MB * 1024 * 1024:
+            return jsonify({'error': f'文件大小错误: 文件大小超过限制（最大{MAX_UPLOAD_SIZE_MB}MB）'}), 400
+
+        _, allowed_extensions, extension_error, _ = UPLOAD_TARGETS[target]
+        is_valid, _ = FileValidator.validate_file_extension(filename, allowed_extensions)
+        if not is_valid:
+            return jsonify({'error': f'文件格式错误: {extension_error}'}), 400
+
+        options = {
+            'dry_run': bool(data.get('dry_run')) and target == 'database',
+            'force': bool(data.get('force')),
+        }
+        session = create_session(filename, size, target, g.current_user['username'], options)
+        return jsonify(session_status(session)), 201
+
+    @app.route('/api/uploads/<upload_id>', methods=['GET'])
+    @token_required
+    def get_chunked_upload(upload_id):
+        """查询上传进度，前端据此从下一块继续上传"""
+        session, error = _owned_session(upload_id)
+        if error:
+            return error
+        return jsonify(session_status(session))
+
+    @app.route('/api/uploads/<upload_id>/chunks/<int:chunk_no>', methods=['PUT'])
+    @app.limiter.limit("20 per second")  # 逐块连续上传，不受默认的每秒1次限制
+    @token_required
+    def put_upload_chunk(upload_id, chunk_no):
+        """上传一块数据（请求体直接写入暂存文件）"""
+        _, error = _owned_session(upload_id)
+        if error:
+            return error
+        try:
+            session = write_chunk(upload_id, chunk_no, request.stream)
+        except UploadSessionError as e:
+            return jsonify({'error': str(e)}), e.status_code
+        return jsonify(session_status(session))
+
+    @app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+    @token_required
+    def complete_chunked_upload(upload_id):
+        """所有块上传完成：把文件交给后台上传任务（返回 202 和任务ID，相同文件已导入过时返回 200）"""
+        session, error = _owned_session(upload_id)
+        if error:
+            return error
+
+        job_type, _, _, payload = UPLOAD_TARGETS[session['target']]
+        with IngestTelemetry(payload.get('log_prefix', job_type)) as telemetry:
+            logger = telemetry.logger
+            logger.info(f'分块上传完成: {session["filename"]}（{session["size"]} 字节，{session["total_chunks"]} 块）')
+            try:
+                file_path = job_file_path(session['filename'])
+                session, fingerprint = complete_session(upload_id, file_path)
+            except UploadSessionError as e:
+                logger.error(f'分块上传未完成: {e}')
+                return jsonify({'error': str(e)}), e.status_code
+
+            options = session['options']
+            payload = dict(payload)
+            if session['target'] == 'database':
+                payload['dry_run'] = options.get('dry_run', False)
+            return enqueue_saved_upload(
+                job_type, file_path, session['filename'], fingerprint, session['size'], logger, g.current_user,
+                reuse_identical=not (options.get('dry_run') or options.get('force')), **payload
+            )
+
+    @app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+    @token_required
+    def cancel_chunked_upload(upload_id):
+        """取消上传并删除已收到的数据"""
+        _, error = _owned_session(upload_id)
+        if error:
+            return error
+        discard_session(upload_id)
+        return jsonify({'success': True})
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from flask import jsonify
-from dbpy.database import get_db_connection
+from dbpy.database import db_connection
+from dbpy.order_schema import format_pay_date
 from utils.auth import token_required
 
 
@@ -14,29 +15,12 @@ def register_dates_routes(app):
         print('收到获取可用日期请求')
 
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with db_connection(read_only=True) as conn:
+                cursor = conn.cursor()
 
-            try:
-                # 获取所有付款时间不为空的记录
-                cursor.execute('SELECT DISTINCT 付款时间 FROM OrderDetails WHERE 付款时间 IS NOT NULL AND 付款时间 != "" ORDER BY 付款时间')
-                rows = cursor.fetchall()
-
-                # 提取日期部分（YYYY-MM-DD）
-                dates = set()
-                for row in rows:
-                    if row['付款时间']:
-                        try:
-                            # 处理日期字符串，提取日期部分
-                            date_str = str(row['付款时间'])
-                            if ' ' in date_str:
-                                date_part = date_str.split(' ')[0]  # 提取日期部分
-                                dates.add(date_part)
-                        except:
-                            continue
-
-                # 转换为排序后的列表
-                sorted_dates = sorted(list(dates))
+                # pay_date 为付款日期的整数键（YYYYMMDD），DISTINCT 直接按 idx_pay_date 索引读取
+                cursor.execute('SELECT DISTINCT pay_date FROM OrderDetails WHERE pay_date IS NOT NULL ORDER BY pay_date')
+                sorted_dates = [format_pay_date(row['pay_date']) for row in cursor.fetchall()]
 
                 return jsonify({
                     'success': True,
@@ -44,9 +28,6 @@ def register_dates_routes(app):
                     'count': len(sorted_dates)
                 })
 
-            finally:
-                conn.close()
-
         except Exception as e:
             print(f'获取可用日期时出错: {str(e)}')
             import traceback
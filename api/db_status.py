@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+数据库状态 API
+查看连接池的使用情况（取用、复用、新建、等待、超时次数）
+"""
+
+from flask import jsonify
+from dbpy.database import get_pool_stats
+from utils.auth import token_required, role_required
+
+
+def register_db_status_routes(app):
+    """注册数据库状态相关 API 路由"""
+
+    @app.route('/api/db/pool', methods=['GET'])
+    @token_required
+    @role_required('admin')
+    def get_db_pool_stats():
+        """获取连接池统计（复用率 = reuses / checkouts）"""
+        return jsonify(get_pool_stats())
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+后台上传任务 API
+查询上传任务的阶段、进度和最终结果
+"""
+
+from flask import jsonify, g
+from utils.auth import token_required
+from utils.ingest_jobs import get_job
+
+
+def register_jobs_routes(app):
+    """注册后台任务相关 API 路由"""
+
+    @app.route('/api/jobs/<job_id>', methods=['GET'])
+    @token_required
+    def get_job_status(job_id):
+        """获取上传任务状态（阶段、已处理行数、每秒行数，完成后附带上传结果）"""
+        try:
+            job = get_job(job_id)
+            if job is None:
+                return jsonify({'error': '任务不存在'}), 404
+
+            # 普通用户只能查看自己提交的任务
+            if g.current_user['role'] != 'admin' and job['username'] != g.current_user['username']:
+                return jsonify({'error': '权限不足', 'code': 'INSUFFICIENT_PERMISSIONS'}), 403
+
+            return jsonify(job)
+        except Exception as e:
+            print(f'查询任务状态失败: {e}')
+            return jsonify({'error': str(e)}), 500
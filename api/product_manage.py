@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from flask import jsonify, request, g
-from dbpy.database import get_db_connection
+from dbpy.daily_sales import bump_daily_sales_version
+from dbpy.database import db_connection, writer_connection
 from utils.auth import token_required, role_required
 from utils.operation_logger import log_operation
 
@@ -35,10 +36,9 @@ def register_product_manage_routes(app):
             # 计算偏移量
             offset = (page - 1) * page_size
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with db_connection(read_only=True) as conn:
+                cursor = conn.cursor()
 
-            try:
                 # 构建查询条件
                 where_clauses = []
                 params = []
@@ -147,9 +147,6 @@ def register_product_manage_routes(app):
                     'pageSize': page_size
                 })
 
-            finally:
-                conn.close()
-
         except Exception as e:
             print(f'搜索商品失败: {str(e)}')
             import traceback
@@ -162,10 +159,9 @@ def register_product_manage_routes(app):
     def get_categories():
         """获取所有分类列表"""
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with db_connection(read_only=True) as conn:
+                cursor = conn.cursor()
 
-            try:
                 # 查询所有分类
                 cursor.execute('SELECT id, name FROM CategoryInfo ORDER BY id')
                 categories = cursor.fetchall()
@@ -182,9 +178,6 @@ def register_product_manage_routes(app):
                     'categories': category_list
                 })
 
-            finally:
-                conn.close()
-
         except Exception as e:
             print(f'获取分类列表失败: {str(e)}')
             import traceback
@@ -205,10 +198,9 @@ def register_product_manage_routes(app):
             if not product_id or not field:
                 return jsonify({'error': '缺少必要参数'}), 400
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with writer_connection() as conn:
+                cursor = conn.cursor()
 
-            try:
                 # 获取旧值用于日志记录
                 cursor.execute('SELECT name, alias, category, mapped_title FROM ProductInfo WHERE id = ?', (product_id,))
                 product = cursor.fetchone()
@@ -234,6 +226,8 @@ def register_product_manage_routes(app):
                     # 如果值为空，设置为 NULL
                     update_value = value if value else None
                     cursor.execute('UPDATE ProductInfo SET mapped_title = ? WHERE id = ?', (update_value, product_id))
+                    # 数据分析的前缀和缓存按商品映射汇总，映射变化后需要重新读取
+                    bump_daily_sales_version(conn)
                 elif field == 'category':
                     # value 是 category_id
                     if value and value != '':
@@ -272,9 +266,6 @@ def register_product_manage_routes(app):
                     'message': '更新成功'
                 })
 
-            finally:
-                conn.close()
-
         except Exception as e:
             print(f'更新商品信息失败: {str(e)}')
             import traceback
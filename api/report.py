@@ -3,7 +3,8 @@ import json
 import pandas as pd
 from datetime import datetime, timedelta
 from flask import jsonify, request, g
-from dbpy.database import get_db_connection
+from dbpy.database import db_connection
+from dbpy.order_schema import pay_date_key
 from utils.auth import token_required
 from utils.operation_logger import log_operation
 
@@ -22,41 +23,46 @@ def register_report_routes(app):
             if not start_date or not end_date:
                 return jsonify({'error': '缺少日期参数'}), 400
 
+            try:
+                start_key = pay_date_key(start_date)
+                end_key = pay_date_key(end_date)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
             print(f'生成报表: {start_date} 到 {end_date}')
 
             # 获取数据
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with db_connection(read_only=True) as conn:
+                cursor = conn.cursor()
 
-            try:
                 # 读取CategoryInfo表（作为tab）
                 cursor.execute('SELECT id, name FROM CategoryInfo ORDER BY id')
                 categories = cursor.fetchall()
 
-                # 读取ProductInfo表（用于商品映射）
-                cursor.execute('SELECT name, mapped_title, category FROM ProductInfo WHERE mapped_title IS NOT NULL AND mapped_title != ""')
+                # 读取ProductInfo表（用于商品映射，按 product_id 查找）
+                cursor.execute('SELECT id, mapped_title, category FROM ProductInfo WHERE mapped_title IS NOT NULL AND mapped_title != ""')
                 product_full_mapping = {}
                 for row in cursor.fetchall():
-                    product_full_mapping[row['name']] = {
+                    product_full_mapping[row['id']] = {
                         'mapped_title': row['mapped_title'],
                         'category': row['category']
                     }
 
-                # 查询指定日期范围内的数据
+                # 从每日销售汇总表查询指定日期范围内每天各商品的有效订单（已过滤退款），
+                # 按当天最早的付款时间排序，商品类型的出现顺序与逐条读取订单时一致
                 sql = '''
                     SELECT
-                        商品名称,
-                        付款时间,
-                        订购数 as 支付数量,
-                        让利后金额 as 金额
-                    FROM OrderDetails
-                    WHERE 付款时间 >= ? AND 付款时间 <= ?
-                    AND (是否退款 != "退款成功" AND 是否退款 != "退款中" OR 是否退款 IS NULL)
-                    ORDER BY 付款时间
+                        product_id,
+                        pay_date,
+                        SUM(quantity) as 支付数量,
+                        SUM(amount) as 金额
+                    FROM DailySales
+                    WHERE pay_date >= ? AND pay_date <= ?
+                    AND line_count > 0
+                    GROUP BY pay_date, product_id
+                    ORDER BY MIN(first_pay_ts)
                 '''
-                # 将结束日期加上时间部分，以包含当天的所有数据
-                end_date_with_time = f"{end_date} 23:59:59"
-                cursor.execute(sql, (start_date, end_date_with_time))
+                cursor.execute(sql, (start_key, end_key))
                 rows = cursor.fetchall()
 
                 if not rows:
@@ -66,7 +72,7 @@ def register_report_routes(app):
                 df = pd.DataFrame([dict(row) for row in rows])
 
                 # 提取日期部分
-                df['日期'] = pd.to_datetime(df['付款时间']).dt.strftime('%m月%d日')
+                df['日期'] = pd.to_datetime(df['pay_date'].astype(str), format='%Y%m%d').dt.strftime('%m月%d日')
 
                 # 生成日期列表
                 start_dt = datetime.strptime(start_date, '%Y-%m-%d')
@@ -97,16 +103,16 @@ def register_report_routes(app):
                 for date_str in date_list:
                     daily_has_data[date_str] = False
 
-                # 遍历每条订单记录
+                # 遍历每天每个商品的汇总记录
                 for idx, row in df.iterrows():
-                    product_name = row['商品名称']
+                    product_id = row['product_id']
                     date_str = row['日期']
 
                     # 标记这一天有数据
                     daily_has_data[date_str] = True
 
                     # 查找商品映射
-                    product_info = product_full_mapping.get(product_name)
+                    product_info = product_full_mapping.get(product_id)
 
                     if product_info is None or product_info['mapped_title'] is None:
                         continue
@@ -247,9 +253,6 @@ def register_report_routes(app):
                     'data': web_data
                 })
 
-            finally:
-                conn.close()
-
         except Exception as e:
             print(f'生成报表失败: {str(e)}')
             import traceback
@@ -1,116 +1,162 @@
 # -*- coding: utf-8 -*-
-import pandas as pd
-import re
-import sqlite3
-import logging
+import hashlib
+import numpy as np
 import os
+import pandas as pd
 import tempfile
 from datetime import datetime
 from flask import jsonify, request, g
-from dbpy.database import get_db_connection, release_db_connection, calculate_record_hash
+from dbpy.database import (
+    calculate_record_hashes, get_db_connection, get_writer_connection, release_db_connection, writer_connection
+)
+from dbpy.order_ingest import RecordHashFilter, UploadHashStaging, normalize_order_chunk, write_order_details
+from dbpy.inventory_ingest import count_inventory_inserted_since, get_inventory_max_id, upsert_inventory_chunk
+from dbpy.upload_history import find_upload_history, record_upload_history
 from utils.auth import token_required
 from utils.operation_logger import log_operation
 from utils.file_validator import FileValidator
+from utils.streaming_reader import CSV_COLUMN_TYPES, ExcelChunkReader, iter_csv_chunks
+from utils.chunk_pipeline import pipelined
+from utils.product_name import normalize_series
+from utils.ingest_jobs import IngestJobError, QueueFullError, job_file_path, register_job_handler, submit_job
+from utils.ingest_telemetry import IngestTelemetry
 
+# 上传文件大小上限（MB）
+MAX_UPLOAD_SIZE_MB = 350
 
-def create_upload_logger(log_prefix="upload"):
-    """
-    为上传操作创建专用的调试日志记录器
-    
-    Args:
-        log_prefix: 日志文件名的前缀
-        
-    Returns:
-        logger: 配置好的日志记录器
-        log_filename: 生成的日志文件路径
-    """
-    try:
-        # 确保logs目录存在
-        os.makedirs('logs', exist_ok=True)
-        
-        # 生成日志文件名
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        log_filename = f"logs/{log_prefix}_debug_{timestamp}.log"
-        
-        # 创建独立的日志记录器
-        logger_name = f"{log_prefix}_{timestamp}"
-        logger = logging.getLogger(logger_name)
-        logger.setLevel(logging.DEBUG)
-        
-        # 清除可能存在的旧处理器
-        logger.handlers.clear()
-        
-        # 创建文件处理器
-        file_handler = logging.FileHandler(log_filename, encoding='utf-8')
-        file_handler.setLevel(logging.DEBUG)
-        
-        # 创建控制台处理器（输出到stdout）
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        
-        # 设置详细的日志格式
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        console_handler.setFormatter(formatter)
-        
-        # 添加处理器到记录器
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
-        
-        # 记录创建日志记录器的信息
-        logger.info(f'创建上传调试日志记录器: {logger_name}')
-        logger.info(f'日志文件: {log_filename}')
-        
-        return logger, log_filename
-    except Exception as e:
-        # 如果日志记录器创建失败，创建一个基本的记录器作为后备
-        print(f"警告: 创建上传调试日志记录器失败: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        
-        # 创建基本的记录器
-        logger = logging.getLogger(f"{log_prefix}_fallback")
-        logger.setLevel(logging.DEBUG)
-        if not logger.handlers:
-            console_handler = logging.StreamHandler()
-            console_handler.setLevel(logging.INFO)
-            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
-            console_handler.setFormatter(formatter)
-            logger.addHandler(console_handler)
-        
-        return logger, f"logs/{log_prefix}_fallback.log"
+# 订单数据请求体的 Content-Type（浏览器转换好的文本格式，可 gzip 压缩）
+BODY_UPLOAD_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+}
+
+# 快速销量分析（/api/upload）只读取的列；商品名称、是否退款按文本读取，订购数校验后转为数值
+QUICK_ANALYSIS_COLUMNS = ['商品名称', '订购数', '是否退款']
+QUICK_ANALYSIS_DTYPES = {'商品名称': object, '是否退款': object}
 
+# 分块上传完成后交给的后台任务：目标 -> (任务类型, 允许的扩展名, 扩展名错误信息, 任务参数)
+UPLOAD_TARGETS = {
+    'analyse': ('order_upload', ['.xlsx', '.xls'], '文件格式不正确，请上传Excel文件(.xlsx或.xls)',
+                {'operation_type': 'upload_excel_analyse', 'log_prefix': 'analyse_upload'}),
+    'database': ('order_upload', ['.xlsx', '.xls'], '文件格式不正确，请上传Excel文件(.xlsx或.xls)',
+                 {'operation_type': 'upload_excel', 'log_prefix': 'upload_to_database'}),
+    'inventory': ('inventory_upload', ['.csv'], '文件格式不正确，请上传CSV文件(.csv)', {}),
+}
 
-def log_upload_step(logger, step, message, level='info'):
+
+class UploadPipeline:
     """
-    记录上传过程的步骤日志
-    
-    Args:
-        logger: 日志记录器
-        step: 步骤名称
-        message: 日志消息
-        level: 日志级别 (debug, info, warning, error)
+    Excel上传处理流水线
+
+    文件按块流式读取（ExcelChunkReader）：解析阶段逐块校验并统计列类型，
+    入库/分析阶段再逐块消费，峰值内存由块大小决定，而不是文件大小。
+    每个阶段的耗时、行数、字节数和常驻内存变化记录在 telemetry 中，通过 stage_report() 附加到上传结果中。
+    在后台任务中执行时，阶段和逐块进度同时汇报给任务（job）。
     """
-    full_message = f"[{step}] {message}"
-    if level == 'debug':
-        logger.debug(full_message)
-    elif level == 'warning':
-        logger.warning(full_message)
-    elif level == 'error':
-        logger.error(full_message)
-    else:  # info
-        logger.info(full_message)
+
+    def __init__(self, original_filename, telemetry, job=None, file_path=None):
+        self.original_filename = original_filename
+        self.telemetry = telemetry
+        self.logger = telemetry.logger
+        self.job = job
+        self.file_path = file_path
+        self.file_size = os.path.getsize(file_path) if file_path and os.path.exists(file_path) else None
+        self.reader = None
+        self.row_count = 0
+
+    def _log(self, message, level='info'):
+        getattr(self.logger, level)(f'[pipeline] {message}')
+
+    def run_stage(self, name, func, *args, **kwargs):
+        """执行一个阶段，记录耗时、行数、文件字节数和内存"""
+        if self.job:
+            self.job.set_stage(name, rows_total=self.row_count or None)
+        with self.telemetry.stage(name, bytes=self.file_size) as record:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record['rows'] += self.row_count
+
+    def save(self, file):
+        """保存上传文件到临时目录"""
+        def _save():
+            suffix = os.path.splitext(self.original_filename)[1]
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+                self.file_path = tmp_file.name
+            file.save(self.file_path)
+            self.file_size = os.path.getsize(self.file_path)
+            self._log(f'文件已保存到临时位置: {self.file_path}, 大小: {self.file_size} 字节')
+        self.run_stage('save', _save)
+
+    def validate_size(self, max_size_mb=MAX_UPLOAD_SIZE_MB):
+        """验证文件大小，返回 (是否有效, 信息)"""
+        return self.run_stage('validate_size', FileValidator.validate_file_size, self.file_path, max_size_mb=max_size_mb)
+
+    def parse(self, required_columns=None, fmt=None, column_types=None):
+        """
+        流式读取Excel文件并逐块验证格式（整个流水线只解析这一次），返回 (是否有效, 信息)
+
+        fmt 为 'csv'、'ndjson' 时读取浏览器转换好的文本格式（不检查扩展名），解析和校验流程与 Excel 相同；
+        column_types 为 CSV 中日期时间、布尔列的声明（见 iter_text_rows）
+        """
+        def _parse():
+            if fmt is None:
+                is_valid, msg = FileValidator.validate_file_extension(self.file_path, ['.xlsx', '.xls'])
+                if not is_valid:
+                    return False, "文件格式不正确，请上传Excel文件(.xlsx或.xls)"
+            self.reader = ExcelChunkReader(self.file_path, progress=self.job.set_progress if self.job else None,
+                                           fmt=fmt, column_types=column_types)
+            is_valid, msg = FileValidator.validate_excel_stream(self.reader, required_columns)
+            self.row_count = self.reader.total_rows
+            return is_valid, msg
+        return self.run_stage('parse', _parse)
+
+    def read_columns(self, columns, dtype=None):
+        """
+        只读取并验证需要的几列（单遍读取，不暂存原始行、不解析其他列），返回 (是否有效, 信息, 数据框)
+        """
+        def _read():
+            is_valid, msg = FileValidator.validate_file_extension(self.file_path, ['.xlsx', '.xls'])
+            if not is_valid:
+                return False, "文件格式不正确，请上传Excel文件(.xlsx或.xls)", None
+            is_valid, msg, df = FileValidator.read_excel_columns(self.file_path, columns, dtype)
+            self.row_count = len(df) if df is not None else 0
+            return is_valid, msg, df
+        return self.run_stage('read', _read)
+
+    def iter_chunks(self):
+        """按块返回已校验的数据（列类型与整表读取一致）"""
+        return self.reader.iter_chunks()
+
+    def stage_report(self):
+        """各阶段的耗时与内存统计"""
+        return self.telemetry.report()
+
+    def cleanup(self):
+        """删除临时文件和分块暂存文件"""
+        if self.reader is not None:
+            self.reader.close()
+        if self.file_path and os.path.exists(self.file_path):
+            os.unlink(self.file_path)
+            self._log('已删除临时文件')
 
 
 def register_upload_routes(app):
     """注册上传相关 API 路由"""
+    register_job_handler('order_upload', run_order_upload_job)
+    register_job_handler('inventory_upload', run_inventory_upload_job)
 
     @app.route('/api/analyse/upload', methods=['POST'])
     @token_required
     def analyse_upload():
-        """处理 Excel 文件上传并上传到数据库"""
+        """
+        处理 Excel 文件上传：保存文件并登记后台入库任务，返回 202 和任务ID
+
+        也接受 text/csv、application/x-ndjson 请求体（可 gzip 压缩），见 /api/db/upload
+        """
         # 创建调试日志记录器
-        logger, log_filename = create_upload_logger("analyse_upload")
+        telemetry = IngestTelemetry("analyse_upload")
+        logger = telemetry.logger
         logger.info('收到 analyse 文件上传请求')
         
         try:
@@ -119,6 +165,14 @@ def register_upload_routes(app):
             if current_user:
                 logger.info(f'当前用户: {current_user.get("username", "未知")}, 角色: {current_user.get("role", "未知")}')
             
+            # 浏览器转换好的 CSV / JSON Lines 请求体（可 gzip 压缩），服务端不需要解析 Excel
+            body_format = request_body_format()
+            if body_format:
+                return enqueue_body_upload(
+                    'order_upload', body_format, logger, current_user, reuse_identical=not request_flag('force'),
+                    operation_type='upload_excel_analyse', log_prefix='analyse_upload'
+                )
+
             if 'file' not in request.files:
                 error_msg = '错误：请求中没有文件'
                 logger.error(error_msg)
@@ -131,55 +185,16 @@ def register_upload_routes(app):
                 return jsonify({'error': '未选择文件'}), 400
 
             logger.info(f'开始处理文件: {file.filename}')
-            logger.info(f'文件大小: {len(file.read())} 字节')
-            file.seek(0)  # 重置文件指针
-            
-            # 保存文件到临时目录进行验证
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_file:
-                file.save(tmp_file.name)
-                logger.info(f'文件已保存到临时位置: {tmp_file.name}')
-                
-                # 验证文件大小
-                logger.info('开始验证文件大小...')
-                is_size_valid, size_msg = FileValidator.validate_file_size(tmp_file.name, max_size_mb=350)
-                if not is_size_valid:
-                    os.unlink(tmp_file.name)  # 删除临时文件
-                    logger.error(f'文件大小验证失败: {size_msg}')
-                    return jsonify({'error': f'文件大小错误: {size_msg}'}), 400
-                
-                # 验证文件格式
-                logger.info('开始验证文件格式...')
-                is_valid, msg, df = FileValidator.validate_excel_format(tmp_file.name)
-                
-                if not is_valid:
-                    os.unlink(tmp_file.name)  # 删除临时文件
-                    logger.error(f'文件格式验证失败: {msg}')
-                    return jsonify({'error': f'文件格式错误: {msg}'}), 400
-                
-                # 验证通过，继续处理
-                tmp_file_path = tmp_file.name
-                logger.info('文件格式验证通过')
-            
-            # 继续上传处理
-            logger.info('开始上传处理...')
-            result = upload_to_database_internal_with_path(tmp_file_path, file.filename)
-            logger.info(f'上传处理完成，结果: {result}')
-            
-            # 记录操作日志
-            if result.get('success') and current_user:
-                log_operation(
-                    username=current_user.get('username', 'unknown'),
-                    role=current_user.get('role', 'user'),
-                    operation_type='upload_excel_analyse',
-                    detail={
-                        'filename': file.filename,
-                        'log_file': log_filename,
-                        **result
-                    },
-                    result='success'
-                )
-            
-            return result
+
+            # force=1 时即使相同文件已导入过也重新处理
+            force = request_flag('force')
+
+            # 保存文件并登记后台任务，解析和入库在后台执行
+            return enqueue_upload_job(
+                'order_upload', file, logger, current_user, ['.xlsx', '.xls'],
+                '文件格式不正确，请上传Excel文件(.xlsx或.xls)', reuse_identical=not force,
+                operation_type='upload_excel_analyse', log_prefix='analyse_upload'
+            )
         except Exception as e:
             error_msg = f'处理文件时出错: {str(e)}'
             logger.error(error_msg, exc_info=True)
@@ -199,13 +214,16 @@ def register_upload_routes(app):
                 )
             
             return jsonify({'error': str(e)}), 500
+        finally:
+            telemetry.close()
 
     @app.route('/api/upload', methods=['POST'])
     @token_required
     def upload_file():
         """处理Excel文件上传"""
         # 创建调试日志记录器
-        logger, log_filename = create_upload_logger("upload_file")
+        telemetry = IngestTelemetry("upload_file")
+        logger = telemetry.logger
         logger.info('收到文件上传请求')
         
         try:
@@ -226,55 +244,29 @@ def register_upload_routes(app):
                 return jsonify({'error': '未选择文件'}), 400
 
             logger.info(f'开始处理文件: {file.filename}')
-            logger.info(f'文件大小: {len(file.read())} 字节')
-            file.seek(0)  # 重置文件指针
             
-            # 保存文件到临时目录进行验证
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_file:
-                file.save(tmp_file.name)
-                logger.info(f'文件已保存到临时位置: {tmp_file.name}')
-                logger.info(f'临时文件大小: {os.path.getsize(tmp_file.name)} 字节')
-                
+            pipeline = UploadPipeline(file.filename, telemetry)
+            pipeline.save(file)
+            try:
                 # 验证文件大小
-                logger.info('开始验证文件大小...')
-                is_size_valid, size_msg = FileValidator.validate_file_size(tmp_file.name, max_size_mb=350)
+                is_size_valid, size_msg = pipeline.validate_size()
                 if not is_size_valid:
-                    os.unlink(tmp_file.name)  # 删除临时文件
                     logger.error(f'文件大小验证失败: {size_msg}')
                     return jsonify({'error': f'文件大小错误: {size_msg}'}), 400
-                
-                # 验证文件格式
-                logger.info('开始验证文件格式...')
-                is_valid, msg, df = FileValidator.validate_excel_format(tmp_file.name)
-                
+
+                # 销量统计只用到三列：只读取、校验这几列（单遍读取，其他列不解析）
+                is_valid, msg, df = pipeline.read_columns(QUICK_ANALYSIS_COLUMNS, QUICK_ANALYSIS_DTYPES)
                 if not is_valid:
-                    os.unlink(tmp_file.name)  # 删除临时文件
                     logger.error(f'文件格式验证失败: {msg}')
                     return jsonify({'error': f'文件格式错误: {msg}'}), 400
-                
-                # 验证通过，继续处理
-                tmp_file_path = tmp_file.name
-                logger.info('文件格式验证通过')
-                if df is not None:
-                    logger.info(f'验证时读取的数据框: {len(df)} 行, {len(df.columns)} 列')
-                    logger.info(f'列名: {df.columns.tolist()}')
-            
-            # 读取Excel文件
-            logger.info('开始读取Excel文件...')
-            df = pd.read_excel(tmp_file_path)
-            logger.info(f'成功读取Excel文件，共 {len(df)} 行数据，{len(df.columns)} 列')
-            logger.info(f'列名: {df.columns.tolist()}')
-            logger.info(f'前几行数据样本: {df.head(3).to_dict(orient="records") if not df.empty else "空数据"}')
-
-            # 删除临时文件
-            os.unlink(tmp_file_path)
-            logger.info('已删除临时文件')
+            finally:
+                pipeline.cleanup()
+            logger.info(f'文件格式验证通过，共 {pipeline.row_count} 行')
 
             # 处理数据
             logger.info('开始处理数据...')
-            result = process_data(df)
+            result = pipeline.run_stage('analysis', process_data, df)
             logger.info(f'数据处理完成，共 {len(result["products"])} 个商品')
-            logger.info(f'处理结果: {result}')
 
             # 记录操作日志
             if current_user:
@@ -284,13 +276,15 @@ def register_upload_routes(app):
                     operation_type='upload_excel_analysis',
                     detail={
                         'filename': file.filename,
-                        'log_file': log_filename,
+                        'log_file': telemetry.log_filename,
                         'product_count': len(result["products"]),
-                        'row_count': len(df)
+                        'row_count': pipeline.row_count
                     },
                     result='success'
                 )
             
+            # 附加各阶段耗时与内存统计
+            result['stages'] = pipeline.stage_report()
             return jsonify(result)
         except Exception as e:
             error_msg = f'处理文件时出错: {str(e)}'
@@ -311,6 +305,8 @@ def register_upload_routes(app):
                 )
             
             return jsonify({'error': str(e)}), 500
+        finally:
+            telemetry.close()
     
     # 注册库存上传路由
     register_inventory_upload_routes(app)
@@ -318,9 +314,16 @@ def register_upload_routes(app):
     @app.route('/api/db/upload', methods=['POST'])
     @token_required
     def upload_to_database():
-        """上传Excel数据到数据库"""
+        """
+        上传Excel数据到数据库：保存文件并登记后台入库任务，返回 202 和任务ID
+
+        也接受 Content-Type 为 text/csv 或 application/x-ndjson 的请求体（可 Content-Encoding: gzip），
+        文件名由查询参数 filename 指定；CSV 中 Excel 为日期时间、布尔单元格的列由查询参数
+        datetime_columns、bool_columns 声明（逗号分隔的列名），记录哈希值才与 Excel 上传一致
+        """
         # 创建调试日志记录器
-        logger, log_filename = create_upload_logger("upload_to_database")
+        telemetry = IngestTelemetry("upload_to_database")
+        logger = telemetry.logger
         logger.info('收到数据库上传请求')
         
         try:
@@ -329,6 +332,16 @@ def register_upload_routes(app):
             if current_user:
                 logger.info(f'当前用户: {current_user.get("username", "未知")}, 角色: {current_user.get("role", "未知")}')
             
+            # 浏览器转换好的 CSV / JSON Lines 请求体（可 gzip 压缩），服务端不需要解析 Excel
+            body_format = request_body_format()
+            if body_format:
+                dry_run = request_flag('dry_run')
+                return enqueue_body_upload(
+                    'order_upload', body_format, logger, current_user,
+                    reuse_identical=not (dry_run or request_flag('force')),
+                    operation_type='upload_excel', log_prefix='upload_to_database', dry_run=dry_run
+                )
+
             if 'file' not in request.files:
                 error_msg = '错误：请求中没有文件'
                 logger.error(error_msg)
@@ -341,68 +354,20 @@ def register_upload_routes(app):
                 return jsonify({'error': '未选择文件'}), 400
 
             logger.info(f'开始处理文件: {file.filename}')
-            logger.info(f'文件大小: {len(file.read())} 字节')
-            file.seek(0)  # 重置文件指针
-            
-            # 保存文件到临时目录进行验证
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_file:
-                file.save(tmp_file.name)
-                logger.info(f'文件已保存到临时位置: {tmp_file.name}')
-                logger.info(f'临时文件大小: {os.path.getsize(tmp_file.name)} 字节')
-                
-                # 验证文件大小
-                logger.info('开始验证文件大小...')
-                is_size_valid, size_msg = FileValidator.validate_file_size(tmp_file.name, max_size_mb=350)
-                if not is_size_valid:
-                    os.unlink(tmp_file.name)  # 删除临时文件
-                    logger.error(f'文件大小验证失败: {size_msg}')
-                    return jsonify({'error': f'文件大小错误: {size_msg}'}), 400
-                
-                # 验证文件格式
-                logger.info('开始验证文件格式...')
-                is_valid, msg, df = FileValidator.validate_excel_format(tmp_file.name)
-                
-                if not is_valid:
-                    os.unlink(tmp_file.name)  # 删除临时文件
-                    logger.error(f'文件格式验证失败: {msg}')
-                    return jsonify({'error': f'文件格式错误: {msg}'}), 400
-                
-                # 验证通过，继续处理
-                tmp_file_path = tmp_file.name
-                logger.info('文件格式验证通过')
-                if df is not None:
-                    logger.info(f'验证时读取的数据框: {len(df)} 行, {len(df.columns)} 列')
-                    logger.info(f'列名: {df.columns.tolist()}')
-            
-            logger.info('开始数据库上传处理...')
-            result = upload_to_database_internal_with_path(tmp_file_path, file.filename)
-            logger.info(f'数据库上传处理完成，结果: {result}')
             
-            # 记录上传日志
-            if result.get('success'):
-                detail = {
-                    'filename': file.filename,
-                    'log_file': log_filename,
-                    'total': result.get('total', 0),
-                    'success_count': result.get('success_count', 0),
-                    'duplicate_count': result.get('duplicate_count', 0),
-                    'error_count': result.get('error_count', 0),
-                    'filtered_count': result.get('filtered_count', 0)
-                }
-                
-                if current_user:
-                    log_operation(
-                        username=current_user.get('username', 'unknown'),
-                        role=current_user.get('role', 'user'),
-                        operation_type='upload_excel',
-                        detail=detail,
-                        result='success'
-                    )
-                
-                # 添加日志文件路径到返回结果
-                result['debug_log'] = log_filename
-            
-            return result
+            # dry_run=1 时只预分类新记录和重复记录，不写入数据库
+            dry_run = request_flag('dry_run')
+            if dry_run:
+                logger.info('试运行：只统计新记录和重复记录，不写入数据库')
+            # force=1 时即使相同文件已导入过也重新处理
+            force = request_flag('force')
+
+            # 保存文件并登记后台任务，解析和入库在后台执行
+            return enqueue_upload_job(
+                'order_upload', file, logger, current_user, ['.xlsx', '.xls'],
+                '文件格式不正确，请上传Excel文件(.xlsx或.xls)', reuse_identical=not (dry_run or force),
+                operation_type='upload_excel', log_prefix='upload_to_database', dry_run=dry_run
+            )
         except Exception as e:
             error_msg = f'处理文件时出错: {str(e)}'
             logger.error(error_msg, exc_info=True)
@@ -422,36 +387,25 @@ def register_upload_routes(app):
                 )
             
             return jsonify({'error': str(e)}), 500
+        finally:
+            telemetry.close()
 
 
 def process_data(df):
-    """处理Excel数据，生成商品销量统计"""
+    """
+    处理Excel数据，生成商品销量统计
+
+    按标准化名称分组，销量为退款成功的订单记为0后求和（等于订购数减去退款成功的订购数）。
+    """
     # 商品名称去重：移除颜色、尺码等后缀信息
-    def normalize_product_name(name):
-        # 移除常见的颜色、尺码后缀
-        # 例如：--蓝马甲, -58, 58CM, -XS, -61等
-        name = str(name)
-        # 移除 -- 后面的内容
-        name = re.sub(r'--.*', '', name)
-        # 移除 - 后面跟着数字或字母的内容（尺码）
-        name = re.sub(r'-\s*\d+[A-Za-z]*', '', name)
-        name = re.sub(r'-\s*[A-Za-z]+', '', name)
-        # 移除末尾的数字+单位（如 58CM）
-        name = re.sub(r'\d+CM$', '', name)
-        name = re.sub(r'\d+$', '', name)
-        return name.strip()
-
-    # 标准化商品名称
-    df['标准化商品名称'] = df['商品名称'].apply(normalize_product_name)
+    normalized_names = normalize_series(df['商品名称'])
 
     # 计算销量：订购数减去退款成功的订单
-    def calculate_sales(group):
-        total = group['订购数'].sum()
-        refunded = group[group['是否退款'] == '退款成功']['订购数'].sum()
-        return total - refunded
+    quantity = pd.to_numeric(df['订购数'])
+    sales = quantity.where(df['是否退款'] != '退款成功', 0)
 
     # 按标准化商品名称分组计算销量
-    sales_data = df.groupby('标准化商品名称').apply(calculate_sales).reset_index()
+    sales_data = sales.groupby(normalized_names).sum().reset_index()
     sales_data.columns = ['商品名称', '销量']
 
     # 按销量降序排序
@@ -481,337 +435,592 @@ def upload_to_database_internal(file):
 
 def upload_to_database_internal_with_path(file_path, original_filename):
     """内部函数：上传Excel数据到数据库（接收文件路径）"""
-    # 使用统一的日志系统创建记录器
-    logger, log_filename = create_upload_logger("upload_internal")
-    logger.info(f'开始处理文件: {original_filename}')
-    logger.info(f'文件路径: {file_path}')
-    
-    # 检查文件是否存在
-    import os
-    if not os.path.exists(file_path):
-        logger.error(f'文件不存在: {file_path}')
-        return {
-            'success': False,
-            'error': f'临时文件不存在: {file_path}'
-        }
-
-    # 读取Excel文件
-    df = pd.read_excel(file_path)
-    logger.info(f'成功读取Excel文件，共 {len(df)} 行数据')
-
-    # 删除临时文件
-    os.unlink(file_path)
-
-    # 将所有Timestamp类型转换为字符串
-    for col in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[col]):
-            df[col] = df[col].astype(str)
-        # 将NaT（Not a Time）转换为空字符串
-        df[col] = df[col].where(pd.notna(df[col]), '')
-
-    # 应用层去重：处理Excel文件内部的重复
-    df_deduped = df.drop_duplicates(keep='first')
-    logger.info(f'Excel内去重: {len(df)} -> {len(df_deduped)} 条记录')
-
-    # 过滤掉店铺名称为"金蝶对接"的记录
-    df_filtered = df_deduped[df_deduped['店铺名称'] != '金蝶对接'].copy()
-    logger.info(f'过滤金蝶对接记录: {len(df_deduped)} -> {len(df_filtered)} 条记录')
-
-    if len(df_filtered) == 0:
-        logger.info('过滤后没有数据可上传')
-        return {
-            'success': True,
-            'total': len(df_deduped),
-            'success_count': 0,
-            'duplicate_count': 0,
-            'error_count': 0,
-            'filtered_count': len(df_deduped)
-        }
-
-    # 插入数据库
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # 使用统一的日志系统创建记录器（处理结束时关闭）
+    with IngestTelemetry("upload_internal") as telemetry:
+        logger = telemetry.logger
+        logger.info(f'开始处理文件: {original_filename}')
+        logger.info(f'文件路径: {file_path}')
+        
+        # 检查文件是否存在
+        if not os.path.exists(file_path):
+            logger.error(f'文件不存在: {file_path}')
+            return {
+                'success': False,
+                'error': f'临时文件不存在: {file_path}'
+            }
 
-    success_count = 0
+        # 流式读取Excel文件
+        reader = ExcelChunkReader(file_path)
+        try:
+            with telemetry.stage('parse', bytes=os.path.getsize(file_path)) as record:
+                record['rows'] += reader.scan()
+            logger.info(f'成功读取Excel文件，共 {reader.total_rows} 行数据')
+            return upload_excel_to_database(reader, original_filename, telemetry)
+        finally:
+            reader.close()
+            # 删除临时文件
+            os.unlink(file_path)
+
+
+def upload_excel_to_database(reader, original_filename, telemetry=None, dry_run=False):
+    """
+    内部函数：对已扫描的Excel文件先做重复预分类，再只写入新记录
+
+    Args:
+        reader: 已完成 scan() 的 ExcelChunkReader
+        original_filename: 上传的文件名
+        telemetry: 可选的 IngestTelemetry；为 None 时新建，处理结束后关闭
+        dry_run: 为 True 时只返回预分类结果，不写入数据库
+
+    Returns:
+        上传结果字典
+    """
+    if telemetry is None:
+        with IngestTelemetry("upload_internal") as telemetry:
+            telemetry.logger.info(f'开始处理文件: {original_filename}')
+            return upload_excel_to_database(reader, original_filename, telemetry, dry_run)
+
+    plan = classify_order_upload(reader.iter_chunks(), telemetry, reader.datetime_resolutions)
+    if dry_run:
+        return build_order_upload_result(plan, dry_run=True)
+    return write_order_upload(reader.iter_chunks(plan['row_filter']), plan, telemetry, reader.datetime_resolutions)
+
+
+def classify_order_upload(chunks, telemetry, datetime_resolutions=None):
+    """
+    第一遍：把每行分类为新记录、文件内重复、金蝶对接记录或数据库中已存在的重复记录，不写入数据库
+
+    每块计算哈希并做文件内去重、过滤金蝶对接记录，其余行的哈希写入临时表，
+    最后与 OrderDetails 连接一次查出已存在的行。
+
+    Args:
+        chunks: 订单数据块的可迭代对象（ExcelChunkReader.iter_chunks()）
+        telemetry: IngestTelemetry
+        datetime_resolutions: 各日期时间列的整列精度，见 normalize_order_chunk
+
+    Returns:
+        预分类结果字典：各类行数，以及 row_filter(chunk_no)（返回该块中新记录的布尔数组），
+        供第二遍 ExcelChunkReader.iter_chunks(row_filter) 只读取需要写入的行
+    """
+    logger = telemetry.logger
+    hash_filter = RecordHashFilter()
+    masks = []
+    raw_count = 0
+    total_count = 0
+    filtered_count = 0
     duplicate_count = 0
-    error_count = 0
+    jindie_count = 0
 
-    # 处理每一行数据
-    from datetime import datetime
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    for idx, row in df_filtered.iterrows():
-        try:
-            # 计算记录哈希值用于去重
-            record_hash = calculate_record_hash(row)
-            logger.info(f'处理第 {idx} 行，计算的哈希值: {record_hash}')
-
-            # 插入数据到OrderDetails表（使用INSERT OR IGNORE来避免重复）
-            insert_sql = """
-                INSERT OR IGNORE INTO OrderDetails (
-                    record_hash, 店铺类型, 店铺名称, 分销商名称, 单据编号, 订单类型,
-                    拍单时间, 付款时间, 审核时间, 会员代码, 会员名称, 内部便签, 业务员,
-                    建议仓库, 建议快递, 到账, 商品图片, 品牌, 商品税率, 商品代码,
-                    商品名称, 商品简称, 规格代码, 规格名称, 商品备注, 代发订单, 订单标记,
-                    预计发货时间, 订购数, 总重量, 折扣, 标准进价, 标准单价, 标准金额,
-                    实际单价, 实际金额, 让利后金额, 让利金额, 物流费用, 成本总价,
-                    买家备注, 卖家备注, 制单人, 商品实际利润, 商品标准利润, 商品已发货数量,
-                    平台旗帜, 发货时间, 原产地, 平台商品名称, 平台规格名称, 供应商,
-                    赠品来源, 买家支付金额, 平台支付金额, 其他服务费, 发票种类,
-                    发票抬头类型, 发票类型, 开户行, 账号, 发票电话, 发票地址, 收货邮箱,
-                    周期购商品, 平台单号, 到账时间, 附加信息, 发票抬头, 发票内容,
-                    纳税人识别号, 收货人, 收货人手机, 邮编, 收货地址, 商品类别,
-                    二次备注, 商品单位, 币别, 会员邮箱, 订单标签, 平台交易状态,
-                    赠品, 是否退款, 地区信息, 确认收货时间, 作废, 创建时间
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """
-
-            # 准备数据
-            data = [
-                record_hash,
-                row.get('店铺类型', ''),
-                row.get('店铺名称', ''),
-                row.get('分销商名称', ''),
-                row.get('单据编号', ''),
-                row.get('订单类型', ''),
-                row.get('拍单时间', ''),
-                row.get('付款时间', ''),
-                row.get('审核时间', ''),
-                row.get('会员代码', ''),
-                row.get('会员名称', ''),
-                row.get('内部便签', ''),
-                row.get('业务员', ''),
-                row.get('建议仓库', ''),
-                row.get('建议快递', ''),
-                row.get('到账', ''),
-                row.get('商品图片', ''),
-                row.get('品牌', ''),
-                row.get('商品税率', ''),
-                row.get('商品代码', ''),
-                row.get('商品名称', ''),
-                row.get('商品简称', ''),
-                row.get('规格代码', ''),
-                row.get('规格名称', ''),
-                row.get('商品备注', ''),
-                row.get('代发订单', ''),
-                row.get('订单标记', ''),
-                row.get('预计发货时间', ''),
-                row.get('订购数', ''),
-                row.get('总重量', ''),
-                row.get('折扣', ''),
-                row.get('标准进价', ''),
-                row.get('标准单价', ''),
-                row.get('标准金额', ''),
-                row.get('实际单价', ''),
-                row.get('实际金额', ''),
-                row.get('让利后金额', ''),
-                row.get('让利金额', ''),
-                row.get('物流费用', ''),
-                row.get('成本总价', ''),
-                row.get('买家备注', ''),
-                row.get('卖家备注', ''),
-                row.get('制单人', ''),
-                row.get('商品实际利润', ''),
-                row.get('商品标准利润', ''),
-                row.get('商品已发货数量', ''),
-                row.get('平台旗帜', ''),
-                row.get('发货时间', ''),
-                row.get('原产地', ''),
-                row.get('平台商品名称', ''),
-                row.get('平台规格名称', ''),
-                row.get('供应商', ''),
-                row.get('赠品来源', ''),
-                row.get('买家支付金额', ''),
-                row.get('平台支付金额', ''),
-                row.get('其他服务费', ''),
-                row.get('发票种类', ''),
-                row.get('发票抬头类型', ''),
-                row.get('发票类型', ''),
-                row.get('开户行', ''),
-                row.get('账号', ''),
-                row.get('发票电话', ''),
-                row.get('发票地址', ''),
-                row.get('收货邮箱', ''),
-                row.get('周期购商品', ''),
-                row.get('平台单号', ''),
-                row.get('到账时间', ''),
-                row.get('附加信息', ''),
-                row.get('发票抬头', ''),
-                row.get('发票内容', ''),
-                row.get('纳税人识别号', ''),
-                row.get('收货人', ''),
-                row.get('收货人手机', ''),
-                row.get('邮编', ''),
-                row.get('收货地址', ''),
-                row.get('商品类别', ''),
-                row.get('二次备注', ''),
-                row.get('商品单位', ''),
-                row.get('币别', ''),
-                row.get('会员邮箱', ''),
-                row.get('订单标签', ''),
-                row.get('平台交易状态', ''),
-                row.get('赠品', ''),
-                row.get('是否退款', ''),
-                row.get('地区信息', ''),
-                row.get('确认收货时间', ''),
-                row.get('作废', ''),
-                current_time  # 添加创建时间
-            ]
-            data = tuple(data)  # 转换为元组
-
-            # 执行插入
-            cursor.execute(insert_sql, data)
-
-            # 记录rowcount用于调试
-            rowcount = cursor.rowcount
-            logger.info(f'第 {idx} 行插入结果: rowcount={rowcount}')
-            
-            if rowcount > 0:
-                success_count += 1
-                logger.info(f'第 {idx} 行: 成功插入')
-            else:
-                duplicate_count += 1
-                logger.info(f'第 {idx} 行: 重复记录（已存在）')
-
-        except sqlite3.IntegrityError as e:
-            # 处理数据库完整性错误（如唯一约束违反），计为重复
-            logger.error(f'第 {idx} 行发生完整性错误: {e}')
-            if "UNIQUE constraint failed" in str(e) or "PRIMARY KEY constraint failed" in str(e):
-                duplicate_count += 1
-                logger.info(f'第 {idx} 行: 检测到唯一约束违反，计为重复')
-            else:
-                logger.error(f'第 {idx} 行发生其他完整性错误: {e}')
-                error_count += 1
-            continue
-        except Exception as e:
-            logger.error(f'插入第 {idx} 行时出错: {e}')
-            import traceback
-            logger.error(f"详细错误追踪:\n{traceback.format_exc()}")
-            error_count += 1
-            continue
+    def hash_chunk(df):
+        # 在流水线的转换线程中执行：转换格式并计算记录哈希值（整块批量计算），用于文件内去重和数据库去重
+        with telemetry.stage('normalize', len(df)):
+            normalize_order_chunk(df, datetime_resolutions)
+        with telemetry.stage('hash', len(df)):
+            hashes = calculate_record_hashes(df)
+        return df, hashes
+
+    conn = get_db_connection()
+    staging = UploadHashStaging(conn)
+    try:
+        # 读取、哈希与写入临时表重叠执行；去重依赖块的顺序，在本线程中按顺序处理
+        for chunk_no, (df, hashes) in enumerate(pipelined(chunks, hash_chunk)):
+            raw_count += len(df)
+            with telemetry.stage('dedupe', len(df)):
+                # 应用层去重：处理Excel文件内部的重复（包括与前面块重复的行）
+                first_seen = hash_filter.first_seen_mask(hashes)
+                total_count += int(first_seen.sum())
+
+                # 过滤掉店铺名称为"金蝶对接"的记录
+                keep = first_seen & (df['店铺名称'] != '金蝶对接').to_numpy()
+                filtered_count += int(first_seen.sum() - keep.sum())
 
-    # 提交事务
-    conn.commit()
+            positions = np.flatnonzero(keep)
+            with telemetry.stage('stage_hashes', len(positions)):
+                staging.add(chunk_no, positions, hashes[positions])
+            masks.append(keep)
 
-    # 检查数据库中是否存在"金蝶对接"数据
-    cursor.execute("SELECT COUNT(*) FROM OrderDetails WHERE 店铺名称 = '金蝶对接'")
-    jindie_count = cursor.fetchone()[0]
+        # 一次连接查询找出数据库中已存在的记录
+        with telemetry.stage('lookup', total_count - filtered_count):
+            existing = staging.existing_rows()
+        for chunk_no, positions in existing.items():
+            masks[chunk_no][positions] = False
+            duplicate_count += len(positions)
 
-    conn.close()
+        logger.info(f'Excel内去重: {raw_count} -> {total_count} 条记录')
+        logger.info(f'过滤金蝶对接记录: {total_count} -> {total_count - filtered_count} 条记录')
 
-    filtered_count = len(df_deduped) - len(df_filtered)
+        if total_count == filtered_count:
+            logger.info('过滤后没有数据可上传')
+        else:
+            # 检查数据库中是否存在"金蝶对接"数据
+            jindie_count = conn.execute("SELECT COUNT(*) FROM OrderDetails WHERE 店铺名称 = '金蝶对接'").fetchone()[0]
+    finally:
+        staging.close()
+        conn.close()
+
+    new_count = total_count - filtered_count - duplicate_count
+    logger.info(f'重复预分类: 新记录={new_count}, 数据库中已存在={duplicate_count}, 过滤={filtered_count}')
 
-    print(f'上传完成: 成功={success_count}, 重复={duplicate_count}, 错误={error_count}, 过滤={filtered_count}')
-    print(f'数据库中"金蝶对接"记录数: {jindie_count}')
+    return {
+        'total': total_count,
+        'new_count': new_count,
+        'duplicate_count': duplicate_count,
+        'filtered_count': filtered_count,
+        'jindie_count': jindie_count,
+        'row_filter': lambda chunk_no: masks[chunk_no]
+    }
 
+
+def order_upload_summary(plan):
+    """预分类结果中可直接返回给前端的行数统计"""
+    return {key: plan[key] for key in ('total', 'new_count', 'duplicate_count', 'filtered_count')}
+
+
+def build_order_upload_result(plan, success_count=0, duplicate_count=0, error_count=0, dry_run=False):
+    """
+    由预分类结果和写入结果生成上传结果字典
+
+    Args:
+        plan: classify_order_upload() 的结果
+        success_count: 实际新增数
+        duplicate_count: 写入时才发现的重复数（预分类之后被其他上传写入的记录）
+        error_count: 写入失败数
+        dry_run: 是否为只预分类、不写入的试运行
+    """
     result = {
         'success': True,
-        'total': len(df_deduped),
+        'total': plan['total'],
+        'new_count': plan['new_count'],
         'success_count': success_count,
-        'duplicate_count': duplicate_count,
+        'duplicate_count': plan['duplicate_count'] + duplicate_count,
         'error_count': error_count,
-        'filtered_count': filtered_count
+        'filtered_count': plan['filtered_count']
     }
+    if dry_run:
+        result['dry_run'] = True
 
     # 如果数据库中存在"金蝶对接"数据，添加警告信息
-    if jindie_count > 0:
-        result['warning'] = f'数据库中存在 {jindie_count} 条"金蝶对接"记录，请联系管理员处理'
+    if plan['jindie_count'] > 0:
+        result['warning'] = f'数据库中存在 {plan["jindie_count"]} 条"金蝶对接"记录，请联系管理员处理'
 
     return result
 
 
+def write_order_upload(chunks, plan, telemetry, datetime_resolutions=None):
+    """
+    第二遍：只写入预分类得到的新记录
+
+    Args:
+        chunks: 只包含新记录的数据块（ExcelChunkReader.iter_chunks(plan['row_filter'])）
+        plan: classify_order_upload() 的结果
+        telemetry: IngestTelemetry
+        datetime_resolutions: 各日期时间列的整列精度，见 normalize_order_chunk
+
+    Returns:
+        上传结果字典
+    """
+    logger = telemetry.logger
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    success_count = 0
+    duplicate_count = 0
+    error_count = 0
+
+    def prepare_chunk(df):
+        # 在流水线的转换线程中执行
+        with telemetry.stage('prepare', len(df)):
+            normalize_order_chunk(df, datetime_resolutions)
+            df['record_hash'] = calculate_record_hashes(df)
+        return df
+
+    # 读取、转换与写入重叠执行；每块写入时取用唯一的写入连接，其他写入（如商品管理）可以在块之间执行
+    for df in pipelined(chunks, prepare_chunk):
+        with writer_connection() as conn:
+            # 插入数据库（分块 executemany，每块提交一次）；INSERT OR IGNORE 仍会跳过预分类之后被其他上传写入的记录
+            inserted, duplicates, errors = write_order_details(conn, df, current_time, telemetry=telemetry)
+            success_count += inserted
+            duplicate_count += duplicates
+            error_count += errors
+
+    result = build_order_upload_result(plan, success_count, duplicate_count, error_count)
+    logger.info(f'上传完成: 成功={result["success_count"]}, 重复={result["duplicate_count"]}, '
+                f'错误={error_count}, 过滤={result["filtered_count"]}')
+    logger.info(f'数据库中"金蝶对接"记录数: {plan["jindie_count"]}')
+    return result
+
+
 def register_inventory_upload_routes(app):
     """注册库存上传相关 API 路由"""
 
     @app.route('/api/upload/inventory', methods=['POST'])
     @token_required
     def upload_inventory():
-        """处理库存CSV文件上传"""
-        # 创建日志记录器
-        logger, log_filename = create_upload_logger("inventory_upload")
-        logger.info('收到库存文件上传请求')
-        logger.info(f'当前用户: {g.current_user["username"]}, 角色: {g.current_user["role"]}')
+        """处理库存CSV文件上传：保存文件并登记后台入库任务，返回 202 和任务ID"""
+        # 创建日志记录器（请求结束时关闭）
+        with IngestTelemetry("inventory_upload") as telemetry:
+            logger = telemetry.logger
+            logger.info('收到库存文件上传请求')
+            logger.info(f'当前用户: {g.current_user["username"]}, 角色: {g.current_user["role"]}')
+
+            if 'file' not in request.files:
+                logger.error('错误：请求中没有文件')
+                return jsonify({'error': '没有文件'}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                logger.error('错误：文件名为空')
+                return jsonify({'error': '未选择文件'}), 400
+
+            logger.info(f'开始处理库存文件: {file.filename}')
+            logger.info(f'文件大小: {file.content_length} 字节')
+
+            try:
+                return enqueue_upload_job(
+                    'inventory_upload', file, logger, g.current_user, ['.csv'],
+                    '文件格式不正确，请上传CSV文件(.csv)'
+                )
+            except Exception as e:
+                logger.error(f'处理库存文件时出错: {str(e)}')
+                import traceback
+                logger.error(f"详细错误追踪:\n{traceback.format_exc()}")
+                return jsonify({'error': str(e)}), 500
 
-        if 'file' not in request.files:
-            logger.error('错误：请求中没有文件')
-            return jsonify({'error': '没有文件'}), 400
 
-        file = request.files['file']
-        if file.filename == '':
-            logger.error('错误：文件名为空')
-            return jsonify({'error': '未选择文件'}), 400
+def request_flag(name):
+    """请求参数（表单或查询字符串）中的开关，'1'、'true'、'yes' 为开启"""
+    return request.values.get(name, '').lower() in ('1', 'true', 'yes')
 
-        logger.info(f'开始处理库存文件: {file.filename}')
-        logger.info(f'文件大小: {file.content_length} 字节')
 
+def save_upload_with_fingerprint(stream, file_path, block_size=1024 * 1024):
+    """
+    保存上传文件，同时计算文件内容的 SHA-256（边读边写，不把文件载入内存）
+
+    Args:
+        stream: 上传文件或请求体的输入流
+        file_path: 保存路径
+
+    Returns:
+        (十六进制指纹, 文件字节数)
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(file_path, 'wb') as out:
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                break
+            sha256.update(block)
+            out.write(block)
+            size += len(block)
+    return sha256.hexdigest(), size
+
+
+def enqueue_upload_job(job_type, file, logger, current_user, allowed_extensions, extension_error,
+                       reuse_identical=True, **payload):
+    """
+    保存上传文件并登记后台任务
+
+    请求线程只检查扩展名和文件大小，解析、校验和入库都在后台任务中执行。
+    保存时计算文件内容的指纹：内容相同的文件已成功导入过时直接返回上次的结果（200），
+    相同文件的任务正在排队或执行时返回该任务（202），不重复处理。
+
+    Args:
+        job_type: 任务类型（order_upload / inventory_upload）
+        file: 上传的文件对象
+        logger: 日志记录器
+        current_user: 当前用户信息字典
+        allowed_extensions: 允许的扩展名列表
+        extension_error: 扩展名不符时的错误信息
+        reuse_identical: 是否复用相同文件的导入结果或执行中的任务（试运行、强制重新导入时为 False）
+        **payload: 传给任务处理函数的其他参数
+
+    Returns:
+        (响应, 状态码)：成功时为 202 和任务ID，相同文件已导入过时为 200 和上次的结果
+    """
+    is_valid, msg = FileValidator.validate_file_extension(file.filename, allowed_extensions)
+    if not is_valid:
+        logger.error(f'文件格式验证失败: {msg}')
+        return jsonify({'error': f'文件格式错误: {extension_error}'}), 400
+
+    file_path = job_file_path(file.filename)
+    fingerprint, file_size = save_upload_with_fingerprint(file.stream, file_path)
+    logger.info(f'文件已保存到: {file_path}, 大小: {file_size} 字节, SHA-256: {fingerprint}')
+    return enqueue_saved_upload(job_type, file_path, file.filename, fingerprint, file_size, logger, current_user,
+                                reuse_identical, **payload)
+
+
+def request_body_format():
+    """请求体为 CSV 或 JSON Lines 订单数据时返回 'csv' / 'ndjson'，否则返回 None（表单上传文件）"""
+    return BODY_UPLOAD_FORMATS.get(request.mimetype)
+
+
+def request_csv_column_types():
+    """
+    查询参数 datetime_columns、bool_columns（逗号分隔的列名）声明的 CSV 列类型
+
+    Returns:
+        列名 -> 'datetime' 或 'bool'
+
+    Raises:
+        ValueError: 同一列声明了两种类型
+    """
+    column_types = {}
+    for column_type in CSV_COLUMN_TYPES:
+        for name in request.args.get(f'{column_type}_columns', '').split(','):
+            name = name.strip()
+            if not name:
+                continue
+            if column_types.get(name, column_type) != column_type:
+                raise ValueError(f'列「{name}」同时声明为{CSV_COLUMN_TYPES[column_types[name]]}和{CSV_COLUMN_TYPES[column_type]}')
+            column_types[name] = column_type
+    return column_types
+
+
+def enqueue_body_upload(job_type, fmt, logger, current_user, reuse_identical=True, **payload):
+    """
+    保存 CSV / JSON Lines 请求体并登记后台任务
+
+    请求体按原样保存（Content-Encoding: gzip 时保持压缩，读取时边读边解压），文件名由查询参数 filename 指定。
+    后台任务按与 Excel 相同的流程解析和校验，必需列相同，相同内容的记录哈希值与 Excel 上传一致
+    （CSV 需要声明日期时间、布尔列，见 request_csv_column_types）。
+
+    Args:
+        job_type: 任务类型
+        fmt: 'csv' 或 'ndjson'
+        logger: 日志记录器
+        current_user: 当前用户信息字典
+        reuse_identical: 是否复用相同文件的导入结果或执行中的任务
+        **payload: 传给任务处理函数的其他参数
+    """
+    encoding = request.headers.get('Content-Encoding', '').lower()
+    if encoding not in ('', 'identity', 'gzip'):
+        logger.error(f'不支持的 Content-Encoding: {encoding}')
+        return jsonify({'error': f'不支持的压缩格式: {encoding}，请使用 gzip'}), 415
+    if fmt == 'csv':
         try:
-            # 保存文件到临时目录进行大小验证
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
-                file.save(tmp_file.name)
-                logger.info(f'文件已保存到临时位置: {tmp_file.name}')
-                
-                # 验证文件大小
-                logger.info('开始验证文件大小...')
-                is_size_valid, size_msg = FileValidator.validate_file_size(tmp_file.name, max_size_mb=350)
-                if not is_size_valid:
-                    os.unlink(tmp_file.name)  # 删除临时文件
-                    logger.error(f'文件大小验证失败: {size_msg}')
-                    return jsonify({'error': f'文件大小错误: {size_msg}'}), 400
-                
-                # 重新打开文件对象供后续处理
-                tmp_file_path = tmp_file.name
-            
-            # 处理库存CSV文件，传递当前用户信息用于记录操作日志
-            result = process_inventory_csv(tmp_file_path, g.current_user)
-            logger.info('库存文件处理完成')
-            
-            # 删除临时文件
-            if os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
-            return result
-        except Exception as e:
-            logger.error(f'处理库存文件时出错: {str(e)}')
-            import traceback
-            logger.error(f"详细错误追踪:\n{traceback.format_exc()}")
-            return jsonify({'error': str(e)}), 500
+            payload['column_types'] = request_csv_column_types()
+        except ValueError as e:
+            logger.error(f'CSV 列类型声明错误: {e}')
+            return jsonify({'error': str(e)}), 400
+        logger.info(f'CSV 声明的列类型: {payload["column_types"]}')
+
+    filename = request.args.get('filename') or f'upload.{fmt}'
+    file_path = job_file_path(filename)
+    fingerprint, file_size = save_upload_with_fingerprint(request.stream, file_path)
+    logger.info(f'请求体已保存到: {file_path}, 格式: {fmt}, 压缩: {encoding or "无"}, 大小: {file_size} 字节')
+    if file_size == 0:
+        os.unlink(file_path)
+        return jsonify({'error': '请求体为空'}), 400
+    return enqueue_saved_upload(job_type, file_path, filename, fingerprint, file_size, logger, current_user,
+                                reuse_identical, format=fmt, **payload)
+
+
+def enqueue_saved_upload(job_type, file_path, filename, fingerprint, file_size, logger, current_user,
+                         reuse_identical=True, **payload):
+    """
+    为已保存到任务目录的上传文件登记后台任务（普通上传和分块上传共用）
+
+    Args:
+        job_type: 任务类型（order_upload / inventory_upload）
+        file_path: 已保存的文件路径（由 job_file_path 分配，任务结束后删除）
+        filename: 原始文件名
+        fingerprint: 文件内容的 SHA-256
+        file_size: 文件字节数
+        logger: 日志记录器
+        current_user: 当前用户信息字典
+        reuse_identical: 是否复用相同文件的导入结果或执行中的任务
+        **payload: 传给任务处理函数的其他参数
+
+    Returns:
+        (响应, 状态码)：成功时为 202 和任务ID，相同文件已导入过时为 200 和上次的结果
+    """
+    # 验证文件大小
+    logger.info('开始验证文件大小...')
+    is_size_valid, size_msg = FileValidator.validate_file_size(file_path, max_size_mb=MAX_UPLOAD_SIZE_MB)
+    if not is_size_valid:
+        os.unlink(file_path)
+        logger.error(f'文件大小验证失败: {size_msg}')
+        return jsonify({'error': f'文件大小错误: {size_msg}'}), 400
+
+    if reuse_identical:
+        history = find_upload_history(fingerprint, job_type)
+        if history:
+            os.unlink(file_path)
+            logger.info(f'相同内容的文件已于 {history["created_at"]} 导入（{history["filename"]}），直接返回上次的结果')
+            result = dict(history['result'], cached=True, original_filename=history['filename'],
+                          uploaded_at=history['created_at'], original_job_id=history['job_id'])
+            return jsonify(result), 200
+
+    user = None
+    if current_user:
+        user = {'username': current_user.get('username', 'unknown'), 'role': current_user.get('role', 'user')}
+    payload.update({'file_path': file_path, 'filename': filename, 'user': user,
+                    'fingerprint': fingerprint, 'file_size': file_size})
+
+    try:
+        job_id, created = submit_job(job_type, payload, filename=filename,
+                                     username=user['username'] if user else None,
+                                     fingerprint=fingerprint if reuse_identical else None)
+    except QueueFullError as e:
+        os.unlink(file_path)
+        logger.error(f'任务排队已满: {e}')
+        return jsonify({'error': str(e)}), 503
+
+    if not created:
+        os.unlink(file_path)
+        logger.info(f'相同内容的文件正在处理，返回已有任务: {job_id}')
+        return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/api/jobs/{job_id}',
+                        'attached': True}), 202
+
+    logger.info(f'已登记后台任务: {job_id}')
+    return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/api/jobs/{job_id}'}), 202
+
+
+def run_order_upload_job(job, payload):
+    """
+    后台任务：流式校验Excel文件，预分类重复记录后逐块写入 OrderDetails，返回上传结果字典
+
+    预分类完成后（写入之前）各类行数即保存到任务的 summary 中；payload 中 dry_run 为 True 时不写入数据库。
+    """
+    filename = payload['filename']
+    user = payload.get('user')
+    operation_type = payload.get('operation_type', 'upload_excel')
+    dry_run = payload.get('dry_run', False)
+    telemetry = IngestTelemetry(payload.get('log_prefix', 'upload_to_database'))
+    logger = telemetry.logger
+    logger.info(f'开始执行上传任务 {job.id}: {filename}')
+
+    pipeline = UploadPipeline(filename, telemetry, job=job, file_path=payload['file_path'])
+    try:
+        logger.info('开始解析并验证文件格式...')
+        is_valid, msg = pipeline.parse(fmt=payload.get('format'), column_types=payload.get('column_types'))
+        if not is_valid:
+            logger.error(f'文件格式验证失败: {msg}')
+            raise IngestJobError(f'文件格式错误: {msg}')
+
+        logger.info(f'文件格式验证通过，共 {pipeline.row_count} 行，开始重复预分类...')
+        reader = pipeline.reader
+        plan = pipeline.run_stage('classify', classify_order_upload, reader.iter_chunks(), telemetry,
+                                  reader.datetime_resolutions)
+        job.set_summary(order_upload_summary(plan))
+
+        if dry_run:
+            result = build_order_upload_result(plan, dry_run=True)
+            logger.info(f'试运行完成，未写入数据库，结果: {result}')
+        else:
+            result = pipeline.run_stage('database', write_order_upload, reader.iter_chunks(plan['row_filter']),
+                                        plan, telemetry, reader.datetime_resolutions)
+            logger.info(f'数据库上传处理完成，结果: {result}')
+    except Exception as e:
+        logger.error(f'上传任务失败: {e}', exc_info=not isinstance(e, IngestJobError))
+        if user:
+            log_operation(
+                username=user['username'],
+                role=user['role'],
+                operation_type=operation_type,
+                detail={'filename': filename, 'job_id': job.id},
+                result='failed',
+                error_message=str(e)
+            )
+        raise
+    finally:
+        pipeline.cleanup()
+        telemetry.close()
+
+    # 记录成功导入的文件指纹，之后上传内容相同的文件时直接返回本次结果（有写入失败的行时不记录，允许重新上传）
+    if result.get('success') and not dry_run and not result.get('error_count') and payload.get('fingerprint'):
+        record_upload_history(payload['fingerprint'], job.job_type, filename, payload.get('file_size'), result,
+                              job_id=job.id, username=user['username'] if user else None)
+
+    # 试运行没有修改数据，不记录操作日志
+    if result.get('success') and user and not dry_run:
+        log_operation(
+            username=user['username'],
+            role=user['role'],
+            operation_type=operation_type,
+            detail={
+                'filename': filename,
+                'log_file': telemetry.log_filename,
+                'job_id': job.id,
+                'total': result.get('total', 0),
+                'success_count': result.get('success_count', 0),
+                'duplicate_count': result.get('duplicate_count', 0),
+                'error_count': result.get('error_count', 0),
+                'filtered_count': result.get('filtered_count', 0)
+            },
+            result='success'
+        )
+
+    result['debug_log'] = telemetry.log_filename
+    # 附加各阶段耗时与内存统计
+    result['stages'] = pipeline.stage_report()
+    return result
+
+
+def run_inventory_upload_job(job, payload):
+    """后台任务：校验库存CSV文件并逐块写入 Inventory，返回上传结果字典"""
+    result, status_code = ingest_inventory_csv(payload['file_path'], payload.get('user'), job)
+    if status_code != 200:
+        raise IngestJobError(result.get('error', '库存上传失败'))
+    return result
 
 
 def process_inventory_csv(file_input, current_user=None):
+    """处理库存CSV数据并插入/更新到Inventory表（返回 Flask 响应）
+    
+    Args:
+        file_input: 上传的CSV文件路径（字符串）或文件对象
+        current_user: 当前用户信息字典（包含username和role字段）
+    """
+    result, status_code = ingest_inventory_csv(file_input, current_user)
+    return jsonify(result), status_code
+
+
+def ingest_inventory_csv(file_input, current_user=None, job=None):
     """处理库存CSV数据并插入/更新到Inventory表
     
     Args:
         file_input: 上传的CSV文件路径（字符串）或文件对象
         current_user: 当前用户信息字典（包含username和role字段）
+        job: 可选的后台任务（utils.ingest_jobs.IngestJob），用于汇报阶段和进度
+    
+    Returns:
+        (结果字典, HTTP状态码)
     """
-    # 创建日志记录器
-    logger, log_filename = create_upload_logger("inventory_process")
+    # 创建日志记录器（处理结束时关闭）
+    with IngestTelemetry("inventory_process") as telemetry:
+        return _ingest_inventory_csv(file_input, current_user, job, telemetry)
+
+
+def _ingest_inventory_csv(file_input, current_user, job, telemetry):
+    """ingest_inventory_csv 的实现，各阶段统计记录在 telemetry 中"""
+    logger = telemetry.logger
     logger.info('开始处理库存CSV数据')
     if current_user:
         logger.info(f'操作用户: {current_user.get("username", "unknown")}, 角色: {current_user.get("role", "unknown")}')
     
-    # 首先验证CSV文件格式，传递必需的列列表
+    # 首先分块验证CSV文件格式（第一遍读取），传递必需的列列表
     required_columns = ['商品名称', '仓库', '数量', '可销数', '可配数', '锁定数', '商品建档日期']
     logger.info(f'开始验证CSV文件格式，必需列: {required_columns}')
-    is_valid, msg, df = FileValidator.validate_csv_format(file_input, required_columns)
+    if job:
+        job.set_stage('validate')
+    file_size = os.path.getsize(file_input) if isinstance(file_input, str) else None
+    with telemetry.stage('validate', bytes=file_size) as record:
+        is_valid, msg, csv_info = FileValidator.validate_csv_stream(
+            file_input, required_columns, progress=job.set_progress if job else None
+        )
+        if is_valid:
+            record['rows'] += csv_info['total_rows']
     
     if not is_valid:
         logger.error(f'CSV文件格式验证失败: {msg}')
-        return jsonify({'error': f'文件格式错误: {msg}'}), 400
+        return {'error': f'文件格式错误: {msg}'}, 400
     
-    # 使用验证函数返回的DataFrame，避免重复读取
-    logger.info(f'CSV文件验证通过，共 {len(df)} 行，{len(df.columns)} 列')
-    logger.info(f'列名: {df.columns.tolist()}')
-    logger.info(f'文件编码: {msg.split("编码: ")[-1] if "编码:" in msg else "未知"}')
+    logger.info(f'CSV文件验证通过，共 {csv_info["total_rows"]} 行，{len(csv_info["columns"])} 列')
+    logger.info(f'列名: {csv_info["columns"]}')
+    logger.info(f'文件编码: {csv_info["encoding"]}')
     
-    # 检查必要的列是否存在（验证函数已检查，但再次确认）
-    required_columns = ['商品名称', '仓库', '数量', '可销数', '可配数', '锁定数', '商品建档日期']
-    missing_columns = [col for col in required_columns if col not in df.columns]
-    
-    if missing_columns:
-        logger.error(f'CSV文件缺少必要列: {missing_columns}')
-        return jsonify({'error': f'CSV文件缺少必要列: {missing_columns}'}), 400
-    
-    conn = get_db_connection()
+    # 库存数据整体写入后提交，使用唯一的写入连接
+    conn = get_writer_connection()
     cursor = conn.cursor()
     
     # 记录数据库当前状态
@@ -819,266 +1028,41 @@ def process_inventory_csv(file_input, current_user=None):
     db_existing_count = cursor.fetchone()[0]
     logger.info(f'📊 数据库当前记录数: {db_existing_count}')
     
-    # 统计CSV中的唯一记录数（基于商品名称+仓库）
-    unique_keys = df[['商品名称', '仓库']].drop_duplicates()
-    csv_unique_count = len(unique_keys)
-    logger.info(f'📊 CSV文件唯一记录数（商品名称+仓库）: {csv_unique_count}')
-    logger.info(f'📊 CSV文件总行数: {len(df)}')
-    logger.info(f'📊 CSV文件列数: {len(df.columns)}')
+    # CSV中的唯一记录数（基于商品名称+仓库），在验证时统计
+    logger.info(f'📊 CSV文件唯一记录数（商品名称+仓库）: {csv_info["unique_keys"]}')
+    logger.info(f'📊 CSV文件总行数: {csv_info["total_rows"]}')
+    logger.info(f'📊 CSV文件列数: {len(csv_info["columns"])}')
     logger.info('=' * 60)
     
-    # 定义清理函数，去除字符串开头和结尾的空白字符（空格、制表符等）
-    def clean_value(value):
-        """清理字段值：去除开头和结尾的空白字符，保留中间的空白"""
-        if value is None:
-            return None
-        if isinstance(value, str):
-            # 去除开头和结尾的空白字符（包括空格、制表符等）
-            cleaned = value.strip()
-            # 如果去除空白后变为空字符串，返回None
-            return cleaned if cleaned != '' else None
-        # 非字符串值保持不变
-        return value
-    
-    # 定义字段转换函数，处理各种类型的字段转换
-    def convert_field_value(value, field_type='str'):
-        """转换字段值，如果clean_value后为空则返回None
-        
-        Args:
-            value: 原始值
-            field_type: 字段类型，可选 'str', 'int', 'float'
-        Returns:
-            转换后的值，如果清理后为空则返回None
-        """
-        # 首先清理值
-        cleaned = clean_value(value)
-        if cleaned is None:
-            return None
-        
-        # 根据字段类型转换
-        try:
-            if field_type == 'int':
-                return int(cleaned)
-            elif field_type == 'float':
-                return float(cleaned)
-            else:  # 'str' 或其他类型
-                return cleaned
-        except (ValueError, TypeError):
-            # 转换失败时返回None
-            return None
-    
     total_count = 0
-    inserted_count = 0
-    updated_count = 0
     failed_count = 0
     
     try:
-        # 处理每一行数据
-        for index, row in df.iterrows():
-            total_count += 1
-            
-            try:
-                # 清理关键字段值
-                product_name = clean_value(row['商品名称'])
-                warehouse = clean_value(row['仓库'])
-                
-                # 检查商品名称和仓库是否已存在（使用清理后的值）
-                cursor.execute('''
-                    SELECT id FROM Inventory 
-                    WHERE 商品名称 = ? AND 仓库 = ?
-                ''', (product_name, warehouse))
-                
-                existing_record = cursor.fetchone()
-                
-                if existing_record:
-                    # 更新现有记录
-                    update_sql = '''
-                    UPDATE Inventory SET
-                        数量 = ?,
-                        可销数 = ?,
-                        可配数 = ?,
-                        锁定数 = ?,
-                        商品建档日期 = ?,
-                        商品代码 = ?,
-                        商品规格代码 = ?,
-                        商品规格名称 = ?,
-                        商品标签 = ?,
-                        商品单位 = ?,
-                        库存重量 = ?,
-                        可销售天数 = ?,
-                        在途数 = ?,
-                        安全库存下限 = ?,
-                        安全库存上限 = ?,
-                        订单占用数 = ?,
-                        未付款数 = ?,
-                        库位 = ?,
-                        商品条码 = ?,
-                        商品简称 = ?,
-                        商品备注 = ?,
-                        规格备注 = ?,
-                        库存状态 = ?,
-                        商品分类 = ?,
-                        商品税号 = ?,
-                        供应商 = ?,
-                        保质期 = ?,
-                        有效日期 = ?,
-                        生产日期 = ?,
-                        供应商货号 = ?,
-                        品牌 = ?,
-                        箱规 = ?,
-                        标准进价 = ?,
-                        最新采购价 = ?,
-                        最新采购供应商 = ?,
-                        成本价格 = ?,
-                        销售价格 = ?,
-                        成本总金额 = ?,
-                        销售总金额 = ?,
-                        近3日销量 = ?,
-                        近7日销量 = ?,
-                        近15日销量 = ?,
-                        近30日销量 = ?,
-                        更新时间 = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                    '''
-                    
-                    # 准备更新数据
-                    update_data = (
-                        convert_field_value(row['数量'], 'int'),
-                        convert_field_value(row['可销数'], 'int'),
-                        convert_field_value(row['可配数'], 'int'),
-                        convert_field_value(row['锁定数'], 'int'),
-                        convert_field_value(row['商品建档日期'], 'str'),
-                        convert_field_value(row.get('商品代码'), 'str'),
-                        convert_field_value(row.get('商品规格代码'), 'str'),
-                        convert_field_value(row.get('商品规格名称'), 'str'),
-                        convert_field_value(row.get('商品标签'), 'str'),
-                        convert_field_value(row.get('商品单位'), 'str'),
-                        convert_field_value(row.get('库存重量'), 'float'),
-                        convert_field_value(row.get('可销售天数'), 'str'),
-                        convert_field_value(row.get('在途数'), 'int'),
-                        convert_field_value(row.get('安全库存下限'), 'int'),
-                        convert_field_value(row.get('安全库存上限'), 'int'),
-                        convert_field_value(row.get('订单占用数'), 'int'),
-                        convert_field_value(row.get('未付款数'), 'int'),
-                        convert_field_value(row.get('库位'), 'str'),
-                        convert_field_value(row.get('商品条码'), 'str'),
-                        convert_field_value(row.get('商品简称'), 'str'),
-                        convert_field_value(row.get('商品备注'), 'str'),
-                        convert_field_value(row.get('规格备注'), 'str'),
-                        convert_field_value(row.get('库存状态'), 'str'),
-                        convert_field_value(row.get('商品分类'), 'str'),
-                        convert_field_value(row.get('商品税号'), 'str'),
-                        convert_field_value(row.get('供应商'), 'str'),
-                        convert_field_value(row.get('保质期'), 'str'),
-                        convert_field_value(row.get('有效日期'), 'str'),
-                        convert_field_value(row.get('生产日期'), 'str'),
-                        convert_field_value(row.get('供应商货号'), 'str'),
-                        convert_field_value(row.get('品牌'), 'str'),
-                        convert_field_value(row.get('箱规'), 'str'),
-                        convert_field_value(row.get('标准进价'), 'float'),
-                        convert_field_value(row.get('最新采购价'), 'float'),
-                        convert_field_value(row.get('最新采购供应商'), 'str'),
-                        convert_field_value(row.get('成本价格'), 'float'),
-                        convert_field_value(row.get('销售价格'), 'float'),
-                        convert_field_value(row.get('成本总金额'), 'float'),
-                        convert_field_value(row.get('销售总金额'), 'float'),
-                        convert_field_value(row.get('近3日销量'), 'int'),
-                        convert_field_value(row.get('近7日销量'), 'int'),
-                        convert_field_value(row.get('近15日销量'), 'int'),
-                        convert_field_value(row.get('近30日销量'), 'int'),
-                        existing_record[0]  # WHERE id = ?
-                    )
-                    
-                    cursor.execute(update_sql, update_data)
-                    updated_count += 1
-                    print(f'✅ 第 {index + 1} 行: 更新记录 (ID: {existing_record[0]}) 商品名称="{product_name}" 仓库="{warehouse}"')
-                    
-                else:
-                    # 插入新记录
-                    insert_sql = '''
-                    INSERT INTO Inventory (
-                        商品名称, 仓库, 数量, 可销数, 可配数, 锁定数, 商品建档日期,
-                        商品代码, 商品规格代码, 商品规格名称, 商品标签, 商品单位,
-                        库存重量, 可销售天数, 在途数, 安全库存下限, 安全库存上限,
-                        订单占用数, 未付款数, 库位, 商品条码, 商品简称, 商品备注,
-                        规格备注, 库存状态, 商品分类, 商品税号, 供应商, 保质期,
-                        有效日期, 生产日期, 供应商货号, 品牌, 箱规, 标准进价,
-                        最新采购价, 最新采购供应商, 成本价格, 销售价格, 成本总金额,
-                        销售总金额, 近3日销量, 近7日销量, 近15日销量, 近30日销量
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 
-                             ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 
-                             ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    '''
-                    
-                    # 准备插入数据（商品名称和仓库已使用clean_value清理）
-                    insert_data = (
-                        product_name,
-                        warehouse,
-                        convert_field_value(row['数量'], 'int'),
-                        convert_field_value(row['可销数'], 'int'),
-                        convert_field_value(row['可配数'], 'int'),
-                        convert_field_value(row['锁定数'], 'int'),
-                        convert_field_value(row['商品建档日期'], 'str'),
-                        convert_field_value(row.get('商品代码'), 'str'),
-                        convert_field_value(row.get('商品规格代码'), 'str'),
-                        convert_field_value(row.get('商品规格名称'), 'str'),
-                        convert_field_value(row.get('商品标签'), 'str'),
-                        convert_field_value(row.get('商品单位'), 'str'),
-                        convert_field_value(row.get('库存重量'), 'float'),
-                        convert_field_value(row.get('可销售天数'), 'str'),
-                        convert_field_value(row.get('在途数'), 'int'),
-                        convert_field_value(row.get('安全库存下限'), 'int'),
-                        convert_field_value(row.get('安全库存上限'), 'int'),
-                        convert_field_value(row.get('订单占用数'), 'int'),
-                        convert_field_value(row.get('未付款数'), 'int'),
-                        convert_field_value(row.get('库位'), 'str'),
-                        convert_field_value(row.get('商品条码'), 'str'),
-                        convert_field_value(row.get('商品简称'), 'str'),
-                        convert_field_value(row.get('商品备注'), 'str'),
-                        convert_field_value(row.get('规格备注'), 'str'),
-                        convert_field_value(row.get('库存状态'), 'str'),
-                        convert_field_value(row.get('商品分类'), 'str'),
-                        convert_field_value(row.get('商品税号'), 'str'),
-                        convert_field_value(row.get('供应商'), 'str'),
-                        convert_field_value(row.get('保质期'), 'str'),
-                        convert_field_value(row.get('有效日期'), 'str'),
-                        convert_field_value(row.get('生产日期'), 'str'),
-                        convert_field_value(row.get('供应商货号'), 'str'),
-                        convert_field_value(row.get('品牌'), 'str'),
-                        convert_field_value(row.get('箱规'), 'str'),
-                        convert_field_value(row.get('标准进价'), 'float'),
-                        convert_field_value(row.get('最新采购价'), 'float'),
-                        convert_field_value(row.get('最新采购供应商'), 'str'),
-                        convert_field_value(row.get('成本价格'), 'float'),
-                        convert_field_value(row.get('销售价格'), 'float'),
-                        convert_field_value(row.get('成本总金额'), 'float'),
-                        convert_field_value(row.get('销售总金额'), 'float'),
-                        convert_field_value(row.get('近3日销量'), 'int'),
-                        convert_field_value(row.get('近7日销量'), 'int'),
-                        convert_field_value(row.get('近15日销量'), 'int'),
-                        convert_field_value(row.get('近30日销量'), 'int')
-                    )
-                    
-                    cursor.execute(insert_sql, insert_data)
-                    inserted_count += 1
-                    print(f'✅ 第 {index + 1} 行: 插入新记录 商品名称="{product_name}" 仓库="{warehouse}"')
-                    
-            except Exception as e:
-                print(f'❌ 处理第 {index + 1} 行时出错: {e}')
-                print(f'   问题数据: 商品名称="{product_name}", 仓库="{warehouse}"')
-                import traceback
-                traceback.print_exc()
-                failed_count += 1
-                continue
+        # 本次写入前的最大 id，写入后 id 更大的记录为新增记录，其余成功行为更新
+        start_max_id = get_inventory_max_id(conn)
+        
+        # 第二遍读取：逐块清理转换并 upsert（按字符串读取，各块的列类型与块内数据无关），全部写入后统一提交
+        if job:
+            job.set_stage('database', rows_total=csv_info['total_rows'])
+        for df, _ in iter_csv_chunks(file_input, csv_info['encoding'], dtype=str):
+            failed_count += upsert_inventory_chunk(conn, df, telemetry)
+            total_count += len(df)
+            logger.debug(f'已写入 {total_count}/{csv_info["total_rows"]} 行，失败 {failed_count} 行')
+            if job:
+                job.set_progress(total_count)
         
-        conn.commit()
+        inserted_count = count_inventory_inserted_since(conn, start_max_id)
+        updated_count = total_count - failed_count - inserted_count
+        
+        with telemetry.stage('commit', total_count):
+            conn.commit()
         
         # 查询最终数据库记录数
         cursor.execute('SELECT COUNT(*) FROM Inventory')
         db_final_count = cursor.fetchone()[0]
-        print(f'📊 数据库最终记录数: {db_final_count}')
-        print(f'📊 数据库记录变化: +{inserted_count}新增, {updated_count}更新')
-        print('=' * 60)
+        logger.info(f'📊 数据库最终记录数: {db_final_count}')
+        logger.info(f'📊 数据库记录变化: +{inserted_count}新增, {updated_count}更新')
+        logger.info('=' * 60)
         
         # 记录操作日志
         from utils.operation_logger import log_operation
@@ -1086,24 +1070,24 @@ def process_inventory_csv(file_input, current_user=None):
             log_operation(current_user['username'], current_user['role'], 'upload_inventory', 
                          f'上传库存数据: 总计{total_count}行, 新增{inserted_count}行, 更新{updated_count}行, 失败{failed_count}行')
         else:
-            print('警告：current_user为空，跳过操作日志记录')
+            logger.warning('current_user为空，跳过操作日志记录')
         
-        print(f'库存上传完成: 总计{total_count}行, 新增{inserted_count}行, 更新{updated_count}行, 失败{failed_count}行')
+        logger.info(f'库存上传完成: 总计{total_count}行, 新增{inserted_count}行, 更新{updated_count}行, 失败{failed_count}行')
         
-        return jsonify({
+        return {
             'success': True,
             'total': total_count,
             'inserted': inserted_count,
             'updated': updated_count,
             'failed': failed_count,
-            'message': '库存数据上传完成'
-        })
+            'message': '库存数据上传完成',
+            'debug_log': telemetry.log_filename,
+            'stages': telemetry.report()
+        }, 200
         
     except Exception as e:
         conn.rollback()
-        print(f'处理库存数据时发生错误: {e}')
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': f'处理库存数据时发生错误: {str(e)}'}), 500
+        logger.error(f'处理库存数据时发生错误: {e}', exc_info=True)
+        return {'error': f'处理库存数据时发生错误: {str(e)}'}, 500
     finally:
         conn.close()
\ No newline at end of file
@@ -20,6 +20,12 @@ from api.product_manage import register_product_manage_routes
 from api.auth import register_auth_routes
 from api.report import register_report_routes
 from api.analyse_by_product import register_analyse_by_product_routes
+from api.jobs import register_jobs_routes
+from api.chunked_upload import register_chunked_upload_routes
+from api.db_status import register_db_status_routes
+from dbpy.database import init_db_pool
+from utils.ingest_jobs import init_ingest_jobs
+from dbpy.migrations import run_migrations
 
 app = Flask(__name__)
 
@@ -56,6 +62,18 @@ register_product_manage_routes(app)
 register_auth_routes(app)
 register_report_routes(app)
 register_analyse_by_product_routes(app)
+register_jobs_routes(app)
+register_chunked_upload_routes(app)
+register_db_status_routes(app)
+
+# 请求结束时把数据库连接归还连接池
+init_db_pool(app)
+
+# 执行未执行过的数据库结构迁移
+run_migrations()
+
+# 创建后台上传任务表，并重新排队上次未完成的任务（需在注册上传路由之后）
+init_ingest_jobs()
 
 if __name__ == '__main__':
     import argparse
@@ -16,25 +16,55 @@ DATE=$(date +%Y%m%d_%H%M%S)
 # 创建备份目录（如果不存在）
 mkdir -p "$BACKUP_DIR"
 
+# 服务数据库（WAL 模式下持续写入）通过 dbpy/db_backup.py 生成一致性快照后再压缩，不直接压缩数据库文件和 -wal 文件
+# 使用服务的虚拟环境（与 rongzao.service 相同），系统 python3 没有 sqlcipher3、python-dotenv，无法生成快照
+SERVICE_DB="$DB_DIR/rongzao.db"
+PYTHON="$DB_DIR/.venv/bin/python"
+
+# 备份失败的文件数
+FAILED=0
+
 # 查找并备份所有 .db 文件
 echo "开始备份数据库文件 - $DATE"
 
-find "$DB_DIR" -maxdepth 1 -name "*.db" -type f | while read -r db_file; do
+# 循环不放在管道中（否则在子 shell 中执行），循环结束后仍能读取 FAILED
+while read -r db_file; do
     db_name=$(basename "$db_file")
     backup_file="$BACKUP_DIR/${db_name}.backup_$DATE.zip"
 
     echo "正在备份: $db_name"
-    # 使用 xz 压缩，压缩率高
-    xz -c "$db_file" > "$backup_file"
+    if [ "$db_file" = "$SERVICE_DB" ]; then
+        snapshot_file="$BACKUP_DIR/${db_name}.snapshot_$DATE"
+        if [ -x "$PYTHON" ]; then
+            # 快照是单个完整的数据库文件，使用 xz 压缩，压缩率高
+            "$PYTHON" "$DB_DIR/dbpy/db_backup.py" "$snapshot_file" && xz -c "$snapshot_file" > "$backup_file"
+            status=$?
+        else
+            echo "找不到虚拟环境的 Python: $PYTHON" >&2
+            status=1
+        fi
+        rm -f "$snapshot_file"
+    else
+        # 使用 xz 压缩，压缩率高
+        xz -c "$db_file" > "$backup_file"
+        status=$?
+    fi
 
-    if [ $? -eq 0 ]; then
+    if [ $status -eq 0 ]; then
         echo "备份成功: $backup_file"
     else
-        echo "备份失败: $db_name"
+        echo "备份失败: $db_name" >&2
+        FAILED=$((FAILED + 1))
         # 清理失败的压缩文件
         rm -f "$backup_file"
     fi
-done
+done < <(find "$DB_DIR" -maxdepth 1 -name "*.db" -type f)
+
+# 有文件备份失败时不清理旧备份（避免连续失败时删光可用的备份），以非0状态退出，由 cron 邮件等方式告警
+if [ $FAILED -gt 0 ]; then
+    echo "数据库备份失败: $FAILED 个文件，未清理旧备份 - $DATE" >&2
+    exit 1
+fi
 
 # 实现保留策略
 echo "开始清理旧备份文件 - $DATE"
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量导入历史订单明细文件（新部署、灾难恢复时重新导入多年的导出文件）
+多个进程并行解析、校验并计算记录哈希，经有界队列交给主进程单连接写入 OrderDetails；
+去重与过滤规则与上传接口一致（文件内去重、过滤"金蝶对接"记录、record_hash 已存在的记录跳过）。
+每个文件全部写入后记入检查点文件，中断后重新执行会跳过已完成的文件。
+使用方法：
+    python3 -m dbpy.backfill <目录> [--workers 4] [--checkpoint 检查点文件]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 加载环境变量（数据库加密密钥在导入 dbpy.database 时读取）
+load_dotenv()
+
+from dbpy.database import calculate_record_hashes, get_db_connection
+from dbpy.order_ingest import RecordHashFilter, normalize_order_chunk, write_order_details
+from utils.file_validator import FileValidator
+from utils.ingest_telemetry import IngestTelemetry
+from utils.streaming_reader import ExcelChunkReader
+
+# 订单导出文件扩展名
+ORDER_FILE_EXTENSIONS = ('.xlsx', '.xls')
+
+# 默认检查点文件名（位于导入目录下）
+CHECKPOINT_FILENAME = '.backfill_checkpoint.json'
+
+# 等待解析进程消息的超时时间（秒），超时后检查是否有解析进程异常退出
+QUEUE_POLL_SECONDS = 5
+
+
+def find_order_files(directory):
+    """递归查找目录下的订单导出文件（忽略 Office 临时文件），按路径排序"""
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.startswith('~$') or not name.lower().endswith(ORDER_FILE_EXTENSIONS):
+                continue
+            files.append(os.path.join(root, name))
+    return sorted(files)
+
+
+class BackfillCheckpoint:
+    """
+    已完成文件的检查点（JSON 文件）
+
+    以相对导入目录的路径为键，同时记录文件大小和修改时间，文件被替换后会重新导入。
+    每完成一个文件就整体重写一次（先写临时文件再替换），中断时不会留下不完整的检查点。
+    """
+
+    def __init__(self, path, directory):
+        self.path = path
+        self.directory = directory
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.files = json.load(f).get('files', {})
+
+    def _key(self, file_path):
+        return os.path.relpath(file_path, self.directory)
+
+    def _signature(self, file_path):
+        stat = os.stat(file_path)
+        return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+    def is_done(self, file_path):
+        entry = self.files.get(self._key(file_path))
+        if not entry:
+            return False
+        signature = self._signature(file_path)
+        return entry['size'] == signature['size'] and entry['mtime'] == signature['mtime']
+
+    def mark_done(self, file_path, stats):
+        entry = self._signature(file_path)
+        entry.update(stats)
+        entry['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.files[self._key(file_path)] = entry
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def parse_order_file(file_path, chunk_rows, messages):
+    """
+    解析进程：校验并逐块解析一个订单文件，把待写入的数据块放入队列
+
+    队列消息为 (类型, 文件路径, 内容)：
+        ('chunk', path, DataFrame)：文件内去重、过滤"金蝶对接"后的数据块（含 record_hash 列）
+        ('done', path, 统计字典)：文件的所有数据块都已放入队列
+        ('failed', path, 错误信息)：文件校验或解析失败
+
+    Args:
+        file_path: 订单文件路径
+        chunk_rows: 每块行数
+        messages: 有界队列（队列满时阻塞，解析速度受写入速度限制）
+    """
+    start = time.perf_counter()
+    try:
+        reader = ExcelChunkReader(file_path, chunk_rows)
+        try:
+            is_valid, msg = FileValidator.validate_excel_stream(reader)
+            if not is_valid:
+                messages.put(('failed', file_path, msg))
+                return
+
+            hash_filter = RecordHashFilter()
+            total_count = 0
+            filtered_count = 0
+            for df in reader.iter_chunks():
+                normalize_order_chunk(df, reader.datetime_resolutions)
+                hashes = calculate_record_hashes(df)
+                # 文件内去重（包括与前面块重复的行）
+                first_seen = hash_filter.first_seen_mask(hashes)
+                # 过滤掉店铺名称为"金蝶对接"的记录
+                keep = first_seen & (df['店铺名称'] != '金蝶对接').to_numpy()
+                total_count += int(first_seen.sum())
+                filtered_count += int(first_seen.sum() - keep.sum())
+
+                df['record_hash'] = hashes
+                if keep.any():
+                    messages.put(('chunk', file_path, df[keep]))
+        finally:
+            reader.close()
+    except Exception as e:
+        messages.put(('failed', file_path, f'读取Excel文件失败: {e}'))
+        return
+
+    messages.put(('done', file_path, {
+        'rows': reader.total_rows,
+        'total': total_count,
+        'filtered_count': filtered_count,
+        'parse_seconds': round(time.perf_counter() - start, 1)
+    }))
+
+
+def run_backfill(directory, workers=None, checkpoint_path=None, chunk_rows=None, queue_size=None):
+    """
+    并行导入目录下的订单文件
+
+    Args:
+        directory: 订单文件目录（递归查找 .xlsx/.xls）
+        workers: 解析进程数，默认 CPU 核数减一
+        checkpoint_path: 检查点文件路径，默认为目录下的 .backfill_checkpoint.json
+        chunk_rows: 每块行数，默认 UPLOAD_STREAM_CHUNK_ROWS
+        queue_size: 队列中最多暂存的数据块数，默认解析进程数的两倍
+
+    Returns:
+        汇总统计字典
+    """
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    queue_size = queue_size or workers * 2
+    checkpoint = BackfillCheckpoint(checkpoint_path or os.path.join(directory, CHECKPOINT_FILENAME), directory)
+
+    files = find_order_files(directory)
+    pending = [path for path in files if not checkpoint.is_done(path)]
+    summary = {
+        'files': len(files), 'skipped_files': len(files) - len(pending), 'done_files': 0, 'failed_files': 0,
+        'success_count': 0, 'duplicate_count': 0, 'error_count': 0, 'filtered_count': 0
+    }
+
+    with IngestTelemetry('backfill') as telemetry:
+        logger = telemetry.logger
+        logger.info(f'目录 {directory}: 共 {len(files)} 个文件，已完成 {summary["skipped_files"]} 个，'
+                    f'待导入 {len(pending)} 个（解析进程 {workers} 个）')
+        if not pending:
+            return summary
+
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        written = {path: [0, 0, 0] for path in pending}
+        manager = multiprocessing.Manager()
+        pool = ProcessPoolExecutor(max_workers=workers)
+        conn = get_db_connection()
+        try:
+            messages = manager.Queue(maxsize=queue_size)
+            futures = {pool.submit(parse_order_file, path, chunk_rows, messages): path for path in pending}
+            remaining = set(pending)
+
+            while remaining:
+                try:
+                    kind, path, payload = messages.get(timeout=QUEUE_POLL_SECONDS)
+                except queue.Empty:
+                    # 解析进程异常退出时不会再发送消息，按失败处理
+                    for future, path in futures.items():
+                        if path in remaining and future.done() and future.exception() is not None:
+                            remaining.discard(path)
+                            summary['failed_files'] += 1
+                            logger.error(f'解析进程异常退出 {path}: {future.exception()}')
+                    continue
+
+                if kind == 'chunk':
+                    # INSERT OR IGNORE 跳过数据库中已存在的记录；服务可能同时在写入订单，
+                    # write_order_details 每块在写锁内读取最大 id 并累加汇总表，不会重复累加其他进程的订单
+                    counts = write_order_details(conn, payload, created_at, telemetry=telemetry)
+                    written[path] = [total + count for total, count in zip(written[path], counts)]
+                    continue
+
+                remaining.discard(path)
+                position = len(pending) - len(remaining)
+                if kind == 'failed':
+                    summary['failed_files'] += 1
+                    logger.error(f'[{position}/{len(pending)}] {path} 导入失败: {payload}')
+                    continue
+
+                success_count, duplicate_count, error_count = written[path]
+                stats = dict(payload, success_count=success_count, duplicate_count=duplicate_count,
+                             error_count=error_count)
+                if error_count == 0:
+                    # 有写入失败的行时不记入检查点，下次执行重新导入（已写入的行会被跳过）
+                    checkpoint.mark_done(path, stats)
+                summary['done_files'] += 1
+                for key in ('success_count', 'duplicate_count', 'error_count', 'filtered_count'):
+                    summary[key] += stats[key]
+                logger.info(f'[{position}/{len(pending)}] {path}: 新增={success_count}, 重复={duplicate_count}, '
+                            f'错误={error_count}, 过滤={stats["filtered_count"]}, 解析耗时 {stats["parse_seconds"]}s')
+        finally:
+            conn.close()
+            # 提前退出时（如 Ctrl+C）取消未开始的文件，检查点中只有已完整写入的文件
+            pool.shutdown(wait=False, cancel_futures=True)
+            manager.shutdown()
+
+        logger.info(f'导入完成: {summary}')
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='并行导入目录下的历史订单明细文件（.xlsx/.xls）')
+    parser.add_argument('directory', help='订单文件目录（递归查找）')
+    parser.add_argument('--workers', type=int, help='解析进程数，默认 CPU 核数减一')
+    parser.add_argument('--checkpoint', help=f'检查点文件路径，默认为目录下的 {CHECKPOINT_FILENAME}')
+    parser.add_argument('--chunk-rows', type=int, help='每块行数，默认 UPLOAD_STREAM_CHUNK_ROWS')
+    parser.add_argument('--queue-size', type=int, help='队列中最多暂存的数据块数，默认解析进程数的两倍')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f'错误: 目录不存在: {args.directory}')
+        return 1
+
+    summary = run_backfill(args.directory, args.workers, args.checkpoint, args.chunk_rows, args.queue_size)
+    return 1 if summary['failed_files'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+销售渠道
+渠道按店铺类型中的关键字识别（如店铺类型包含 抖音、今日头条、鲁班 的订单属于抖音渠道），规则保存在 ChannelInfo 表中。
+订单入库时按规则计算 OrderDetails.channel_id（未匹配任何渠道时为 NULL），统计查询直接按 channel_id 分组。
+
+新增渠道（如拼多多）只需在 ChannelInfo 中插入一行，再重新分类已有订单（同时重建每日销售汇总表）：
+    INSERT INTO ChannelInfo (name, code, keywords) VALUES ('拼多多', 'pdd', '拼多多');
+    python3 dbpy/channels.py
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbpy.daily_sales import rebuild_daily_sales
+from dbpy.database import get_db_connection
+
+# name: 渠道名称；code: 接口返回的统计字段前缀（如 douyin_orders）；
+# keywords: 店铺类型中包含任一关键字即属于该渠道，多个关键字用英文逗号分隔；按 id 顺序匹配，先匹配到的渠道优先
+CREATE_CHANNEL_INFO_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS ChannelInfo (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        code TEXT NOT NULL UNIQUE,
+        keywords TEXT NOT NULL
+    )
+'''
+
+# 默认渠道（id, 名称, 字段前缀, 关键字）
+DEFAULT_CHANNELS = [
+    (1, '抖音', 'douyin', '抖音,今日头条,鲁班'),
+    (2, '天猫', 'tmall', '天猫'),
+    (3, '有赞', 'youzan', '有赞'),
+    (4, '京东', 'jd', '京东'),
+]
+
+
+def create_channel_info_table(conn):
+    """创建 ChannelInfo 表，表为空时写入默认渠道"""
+    conn.execute(CREATE_CHANNEL_INFO_TABLE_SQL)
+    if conn.execute('SELECT COUNT(*) FROM ChannelInfo').fetchone()[0] == 0:
+        conn.executemany('INSERT INTO ChannelInfo (id, name, code, keywords) VALUES (?, ?, ?, ?)', DEFAULT_CHANNELS)
+
+
+def load_channels(conn):
+    """
+    读取渠道列表（按 id 排序）
+
+    Returns:
+        [{'id', 'name', 'code', 'keywords'}, ...]，keywords 为关键字列表
+    """
+    rows = conn.execute('SELECT id, name, code, keywords FROM ChannelInfo ORDER BY id').fetchall()
+    return [
+        {
+            'id': row[0],
+            'name': row[1],
+            'code': row[2],
+            'keywords': [keyword.strip() for keyword in (row[3] or '').split(',') if keyword.strip()],
+        }
+        for row in rows
+    ]
+
+
+class ChannelClassifier:
+    """
+    按 ChannelInfo 的规则把店铺类型映射为 channel_id
+
+    导出文件中不同的店铺类型只有几十个，每个值只匹配一次。
+    """
+
+    def __init__(self, channels):
+        self.channels = channels
+        self._cache = {}
+
+    @classmethod
+    def load(cls, conn):
+        """从数据库读取当前的渠道规则"""
+        return cls(load_channels(conn))
+
+    def classify(self, shop_type):
+        """返回店铺类型所属渠道的 id，未匹配任何渠道时返回 None"""
+        if shop_type is None or (isinstance(shop_type, float) and np.isnan(shop_type)):
+            return None
+        shop_type = str(shop_type)
+        if shop_type not in self._cache:
+            self._cache[shop_type] = next(
+                (channel['id'] for channel in self.channels
+                 if any(keyword in shop_type for keyword in channel['keywords'])),
+                None
+            )
+        return self._cache[shop_type]
+
+    def classify_values(self, values):
+        """
+        一列店铺类型映射为 channel_id
+
+        Returns:
+            与 values 等长的 object 数组，元素为 int 或 None
+        """
+        codes, shop_types = pd.factorize(pd.Series(values, dtype=object))
+        channel_ids = np.array([self.classify(shop_type) for shop_type in shop_types] + [None], dtype=object)
+        # factorize 对空值返回 -1，正好取到末尾的 None
+        return channel_ids[codes]
+
+
+def reclassify_orders(conn):
+    """
+    按当前的渠道规则重新计算所有订单的 channel_id（只更新取值有变化的行，由调用方提交）
+
+    Returns:
+        更新的行数
+    """
+    classifier = ChannelClassifier.load(conn)
+    shop_types = [row[0] for row in conn.execute('SELECT DISTINCT 店铺类型 FROM OrderDetails') if row[0] is not None]
+
+    conn.execute('DROP TABLE IF EXISTS temp.shop_type_channel')
+    conn.execute('CREATE TABLE temp.shop_type_channel (shop_type TEXT PRIMARY KEY, channel_id INTEGER)')
+    try:
+        conn.executemany(
+            'INSERT INTO temp.shop_type_channel (shop_type, channel_id) VALUES (?, ?)',
+            [(shop_type, classifier.classify(shop_type)) for shop_type in shop_types]
+        )
+        lookup = 'SELECT channel_id FROM temp.shop_type_channel WHERE shop_type = OrderDetails.店铺类型'
+        cursor = conn.execute(f'UPDATE OrderDetails SET channel_id = ({lookup}) WHERE channel_id IS NOT ({lookup})')
+        return cursor.rowcount
+    finally:
+        conn.execute('DROP TABLE IF EXISTS temp.shop_type_channel')
+
+
+if __name__ == '__main__':
+    conn = get_db_connection()
+    try:
+        updated = reclassify_orders(conn)
+        print(f'重新分类订单渠道: 更新 {updated} 条')
+        # 汇总表按 channel_id 汇总，渠道变化后重建
+        print(f'重建每日销售汇总: {rebuild_daily_sales(conn)} 行')
+        conn.commit()
+    finally:
+        conn.close()
@@ -9,6 +9,7 @@ import sys
 sys.path.append('.')
 
 from dbpy.database import get_db_connection
+from dbpy.inventory_ingest import INVENTORY_UNIQUE_INDEX_SQL
 
 def create_inventory_table():
     """创建Inventory表"""
@@ -108,6 +109,10 @@ def create_inventory_table():
             except Exception as e:
                 print(f'  ✗ 创建索引 {index_name} 失败: {e}')
         
+        # 商品名称+仓库唯一索引（库存上传按此 upsert）
+        cursor.execute(INVENTORY_UNIQUE_INDEX_SQL)
+        print('  ✓ idx_inventory_商品名称_仓库 UNIQUE ON (商品名称, 仓库)')
+        
         print('✓ 索引创建完成')
         
         # 提交事务
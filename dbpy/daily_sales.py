@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+每日销售汇总
+DailySales 按 付款日期 × 商品（product_id）× 渠道 × 店铺名称 汇总 OrderDetails，数据分析、报表、周报导出和商品详情都从汇总表读取，
+不再逐行聚合订单明细。商品映射（ProductInfo）在查询时按 product_id 连接，修改映射不需要重建汇总表。
+
+订单写入时在同一事务中把新增的行累加到汇总表（只涉及这些行的键）；
+汇总表或商品映射每次变化时 DailySalesVersion 中的版本号加一，进程内的前缀和缓存（dbpy/sales_prefix.py）据此判断是否需要重新读取。
+修改渠道规则后、或怀疑汇总表与订单明细不一致时，可以全量重建或检查：
+    python3 dbpy/daily_sales.py rebuild
+    python3 dbpy/daily_sales.py check
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbpy.database import get_db_connection
+from dbpy.order_schema import VALID_ORDER_CONDITION
+
+# 键：pay_date、product_id（商品名称为空时为0）、channel_id（未匹配任何渠道时为0）、店铺名称
+# 有效订单（排除退款成功、退款中）：quantity 订购数、amount 让利后金额、line_count 订单行数、first_pay_ts 最早付款时间
+# 退款订单：refunding_quantity/refunding_amount 退款中的订购数和金额，refunded_amount 退款成功的金额
+CREATE_DAILY_SALES_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS DailySales (
+        pay_date INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        店铺名称 TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        amount REAL NOT NULL DEFAULT 0,
+        line_count INTEGER NOT NULL DEFAULT 0,
+        refunding_quantity INTEGER NOT NULL DEFAULT 0,
+        refunding_amount REAL NOT NULL DEFAULT 0,
+        refunded_amount REAL NOT NULL DEFAULT 0,
+        first_pay_ts INTEGER,
+        PRIMARY KEY (pay_date, product_id, channel_id, 店铺名称)
+    ) WITHOUT ROWID
+'''
+
+# 单个商品类型的销售详情按 product_id+付款日期 查询
+DAILY_SALES_PRODUCT_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_daily_sales_product ON DailySales(product_id, pay_date)'
+
+# 汇总表的版本号（只有 id=1 一行）
+CREATE_DAILY_SALES_VERSION_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS DailySalesVersion (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+'''
+
+DAILY_SALES_KEY_COLUMNS = ['pay_date', 'product_id', 'channel_id', '店铺名称']
+DAILY_SALES_MEASURE_COLUMNS = [
+    'quantity', 'amount', 'line_count', 'refunding_quantity', 'refunding_amount', 'refunded_amount', 'first_pay_ts'
+]
+
+# 汇总 OrderDetails 的查询，{where} 为附加的筛选条件（付款时间为空的订单不计入）
+_AGGREGATE_SQL = f'''
+    SELECT
+        pay_date,
+        COALESCE(product_id, 0) AS product_id,
+        COALESCE(channel_id, 0) AS channel_id,
+        COALESCE(店铺名称, '') AS 店铺名称,
+        COALESCE(SUM(CASE WHEN {VALID_ORDER_CONDITION} THEN 订购数 END), 0) AS quantity,
+        COALESCE(SUM(CASE WHEN {VALID_ORDER_CONDITION} THEN 让利后金额 END), 0) AS amount,
+        COUNT(CASE WHEN {VALID_ORDER_CONDITION} THEN 1 END) AS line_count,
+        COALESCE(SUM(CASE WHEN 是否退款 = '退款中' THEN 订购数 END), 0) AS refunding_quantity,
+        COALESCE(SUM(CASE WHEN 是否退款 = '退款中' THEN 让利后金额 END), 0) AS refunding_amount,
+        COALESCE(SUM(CASE WHEN 是否退款 = '退款成功' THEN 让利后金额 END), 0) AS refunded_amount,
+        MIN(CASE WHEN {VALID_ORDER_CONDITION} THEN pay_ts END) AS first_pay_ts
+    FROM OrderDetails
+    WHERE pay_date IS NOT NULL AND {{where}}
+    GROUP BY 1, 2, 3, 4
+'''
+
+_ALL_COLUMNS = ', '.join(DAILY_SALES_KEY_COLUMNS + DAILY_SALES_MEASURE_COLUMNS)
+
+# 金额由多行累加，检查一致性时允许的浮点误差
+_AMOUNT_TOLERANCE = 0.005
+
+
+def create_daily_sales_table(conn):
+    """创建 DailySales 表和索引"""
+    conn.execute(CREATE_DAILY_SALES_TABLE_SQL)
+    conn.execute(DAILY_SALES_PRODUCT_INDEX_SQL)
+
+
+def daily_sales_version(conn):
+    """汇总表当前的版本号（从未更新过时为0）"""
+    row = conn.execute('SELECT version FROM DailySalesVersion WHERE id = 1').fetchone()
+    return row[0] if row else 0
+
+
+def bump_daily_sales_version(conn):
+    """
+    汇总表或商品映射（ProductInfo.mapped_title）变化后把版本号加一（在同一事务中调用，由调用方提交）
+
+    Returns:
+        新的版本号
+    """
+    conn.execute(CREATE_DAILY_SALES_VERSION_TABLE_SQL)
+    conn.execute(
+        'INSERT INTO DailySalesVersion (id, version) VALUES (1, 1) '
+        'ON CONFLICT (id) DO UPDATE SET version = version + 1'
+    )
+    return daily_sales_version(conn)
+
+
+def last_order_id(conn):
+    """OrderDetails 当前最大的 id（写入前记录，写入后 id 更大的行即为本次新增的行）"""
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM OrderDetails').fetchone()[0]
+
+
+def add_orders_to_daily_sales(conn, after_id):
+    """
+    把 id 大于 after_id 的订单累加到汇总表并更新版本号（在写入订单的同一事务中调用，由调用方提交）
+
+    Args:
+        conn: 数据库连接
+        after_id: 写入前的 last_order_id()
+
+    Returns:
+        新增订单的汇总行（按 DAILY_SALES_KEY_COLUMNS + DAILY_SALES_MEASURE_COLUMNS 排列的元组列表），
+        提交后可交给 sales_prefix.apply_daily_sales_delta 更新缓存
+    """
+    rows = [tuple(row) for row in conn.execute(_AGGREGATE_SQL.format(where='id > ?'), (after_id,))]
+    measures = [column for column in DAILY_SALES_MEASURE_COLUMNS if column != 'first_pay_ts']
+    updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in measures)
+    placeholders = ', '.join(['?'] * len(DAILY_SALES_KEY_COLUMNS + DAILY_SALES_MEASURE_COLUMNS))
+    conn.executemany(f'''
+        INSERT INTO DailySales ({_ALL_COLUMNS}) VALUES ({placeholders})
+        ON CONFLICT ({', '.join(DAILY_SALES_KEY_COLUMNS)}) DO UPDATE SET
+            {updates},
+            first_pay_ts = COALESCE(MIN(first_pay_ts, excluded.first_pay_ts), first_pay_ts, excluded.first_pay_ts)
+    ''', rows)
+    bump_daily_sales_version(conn)
+    return rows
+
+
+def rebuild_daily_sales(conn):
+    """
+    按 OrderDetails 全量重建汇总表（由调用方提交）
+
+    Returns:
+        汇总行数
+    """
+    create_daily_sales_table(conn)
+    conn.execute('DELETE FROM DailySales')
+    cursor = conn.execute(f'INSERT INTO DailySales ({_ALL_COLUMNS}) {_AGGREGATE_SQL.format(where="1")}')
+    bump_daily_sales_version(conn)
+    return cursor.rowcount
+
+
+def check_daily_sales(conn, limit=20):
+    """
+    对比汇总表与按 OrderDetails 重新汇总的结果
+
+    没有订单明细对应的汇总行只要各项数值为0也视为一致。
+
+    Returns:
+        (不一致的键数, 前 limit 个不一致的 (键, 汇总表的值, 明细汇总的值))
+    """
+    conn.execute('DROP TABLE IF EXISTS temp.daily_sales_expected')
+    conn.execute(f'CREATE TABLE temp.daily_sales_expected AS {_AGGREGATE_SQL.format(where="1")}')
+    try:
+        keys = ' AND '.join(f'e.{column} = d.{column}' for column in DAILY_SALES_KEY_COLUMNS)
+        differs = ' OR '.join(
+            f'ABS(COALESCE(e.{column}, 0) - COALESCE(d.{column}, 0)) > {_AMOUNT_TOLERANCE}'
+            if column.endswith('amount') else f'e.{column} IS NOT d.{column}'
+            for column in DAILY_SALES_MEASURE_COLUMNS
+        )
+        expected_columns = ', '.join(f'e.{column}' for column in DAILY_SALES_KEY_COLUMNS + DAILY_SALES_MEASURE_COLUMNS)
+        actual_columns = ', '.join(f'd.{column}' for column in DAILY_SALES_KEY_COLUMNS + DAILY_SALES_MEASURE_COLUMNS)
+        not_empty = ' OR '.join(f'd.{column} != 0' for column in DAILY_SALES_MEASURE_COLUMNS if column != 'first_pay_ts')
+        rows = conn.execute(f'''
+            SELECT {expected_columns}, {actual_columns}
+            FROM temp.daily_sales_expected e
+            LEFT JOIN DailySales d ON {keys}
+            WHERE d.pay_date IS NULL OR {differs}
+            UNION ALL
+            SELECT {', '.join(['NULL'] * len(DAILY_SALES_KEY_COLUMNS + DAILY_SALES_MEASURE_COLUMNS))}, {actual_columns}
+            FROM DailySales d
+            LEFT JOIN temp.daily_sales_expected e ON {keys}
+            WHERE e.pay_date IS NULL AND ({not_empty})
+        ''').fetchall()
+    finally:
+        conn.execute('DROP TABLE IF EXISTS temp.daily_sales_expected')
+
+    width = len(DAILY_SALES_KEY_COLUMNS) + len(DAILY_SALES_MEASURE_COLUMNS)
+    key_count = len(DAILY_SALES_KEY_COLUMNS)
+    mismatches = []
+    for row in rows[:limit]:
+        expected, actual = tuple(row[:width]), tuple(row[width:])
+        key = expected[:key_count] if expected[0] is not None else actual[:key_count]
+        mismatches.append((
+            key,
+            dict(zip(DAILY_SALES_MEASURE_COLUMNS, actual[key_count:])) if actual[0] is not None else None,
+            dict(zip(DAILY_SALES_MEASURE_COLUMNS, expected[key_count:])) if expected[0] is not None else None,
+        ))
+    return len(rows), mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='每日销售汇总表（DailySales）的重建与一致性检查')
+    parser.add_argument('command', choices=['rebuild', 'check'], help='rebuild: 全量重建；check: 与订单明细对比')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        if args.command == 'rebuild':
+            count = rebuild_daily_sales(conn)
+            conn.commit()
+            print(f'✓ 汇总表已重建: {count} 行')
+            return 0
+
+        count, mismatches = check_daily_sales(conn)
+        if count == 0:
+            print('✓ 汇总表与订单明细一致')
+            return 0
+        print(f'✗ 汇总表有 {count} 个键与订单明细不一致（可执行 rebuild 重建）:')
+        for key, actual, expected in mismatches:
+            print(f'  {key}: 汇总表={actual}, 订单明细={expected}')
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
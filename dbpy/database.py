@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 import sqlcipher3 as sqlite3  # 使用SQLCipher加密版本
 import hashlib
+import itertools
 import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 import bcrypt
+from flask import g, has_request_context
 
 # 数据库文件路径：指向项目根目录的rongzao.db
 # os.path.dirname(__file__) 是 dbpy 目录
@@ -18,97 +24,387 @@ DB_ENCRYPTION_KEY = os.environ.get('DB_ENCRYPTION_KEY')
 SQLCIPHER_COMPATIBILITY = 4  # SQLCipher 4.x 兼容
 SQLCIPHER_KDF_ITER = 256000  # 高强度密钥派生迭代次数
 
-# 简单数据库连接池
+# SQLCipher 4 的密钥派生参数：PBKDF2-HMAC-SHA512，盐为数据库文件的前16字节，派生出32字节的加密密钥
+SQLCIPHER_KDF_ALGORITHM = 'sha512'
+SQLCIPHER_SALT_SIZE = 16
+SQLCIPHER_KEY_SIZE = 32
+
+# 连接池最大连接数（并发使用数据库的请求、后台任务超过该数时等待归还）
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+
+# 连接池已满时等待可用连接的最长秒数，超时抛出 PoolTimeoutError
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+
+# 服务启动时预先创建的只读连接数（首个分析请求不需要等待创建连接）
+DB_POOL_PREWARM = int(os.environ.get('DB_POOL_PREWARM', 2))
+
+# 只读连接池（分析接口）的最大连接数
+DB_READ_POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE', 8))
+
+# 等待唯一写入连接的最长秒数（导入时按块写入，每块写入后即归还）
+DB_WRITER_TIMEOUT = float(os.environ.get('DB_WRITER_TIMEOUT', 120))
+
+# 连接参数：日志模式（WAL 下读取不会被写入事务阻塞）、同步级别、页缓存、内存映射、临时表位置
+DB_JOURNAL_MODE = os.environ.get('DB_JOURNAL_MODE', 'WAL')
+DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'NORMAL')
+DB_CACHE_SIZE = int(os.environ.get('DB_CACHE_SIZE', -65536))  # 负数表示 KiB，默认64MB
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 268435456))  # 加密数据库不使用内存映射，仅未加密时生效
+DB_TEMP_STORE = os.environ.get('DB_TEMP_STORE', 'MEMORY')
+
+# 由口令派生的原始密钥：(数据库文件路径, 盐, PRAGMA key 的值)
+_derived_key = None
+_derived_key_lock = threading.Lock()
+
+
+def _read_sqlcipher_salt(path):
+    """读取已加密数据库文件开头的盐，文件不存在或为空时返回None"""
+    try:
+        with open(path, 'rb') as f:
+            salt = f.read(SQLCIPHER_SALT_SIZE)
+    except OSError:
+        return None
+    return salt if len(salt) == SQLCIPHER_SALT_SIZE else None
+
+
+def sqlcipher_key_pragma():
+    """
+    打开加密数据库使用的 PRAGMA key 语句
+
+    SQLCipher 每次用口令打开连接都要做一次 256000 轮的 PBKDF2 派生（数百毫秒 CPU）。
+    数据库文件已存在时，本进程按 SQLCipher 4 相同的算法和文件中的盐派生一次原始密钥，
+    之后的连接直接使用原始密钥（x'密钥+盐'），数据库文件不变，DB Browser 仍用口令打开。
+    新建数据库（文件还不存在）或兼容版本不是4时仍使用口令。
+    """
+    global _derived_key
+    salt = _read_sqlcipher_salt(DB_PATH) if SQLCIPHER_COMPATIBILITY == 4 else None
+    if salt is None:
+        return f"PRAGMA key='{DB_ENCRYPTION_KEY}'"
+
+    with _derived_key_lock:
+        if _derived_key is None or _derived_key[:2] != (DB_PATH, salt):
+            key = hashlib.pbkdf2_hmac(SQLCIPHER_KDF_ALGORITHM, DB_ENCRYPTION_KEY.encode('utf-8'), salt,
+                                      SQLCIPHER_KDF_ITER, SQLCIPHER_KEY_SIZE)
+            _derived_key = (DB_PATH, salt, f"PRAGMA key = \"x'{key.hex()}{salt.hex()}'\"")
+        return _derived_key[2]
+
+
+class PoolTimeoutError(Exception):
+    """等待可用数据库连接超时"""
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    连接池中的连接
+
+    close() 把连接归还连接池而不是关闭，调用 conn.close() 的旧代码也能复用连接；
+    真正关闭连接使用 discard()。
+    """
+
+    pool = None
+    checked_out = False
+    # 每次取出时的编号，用于确认归还的是本次取出的连接（连接归还后可能已被其他线程取出）
+    lease = 0
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.return_connection(self)
+
+    def discard(self):
+        """关闭连接（不归还连接池）"""
+        super().close()
+
+
 class SimpleConnectionPool:
-    """简单的数据库连接池，最大连接数5"""
-    
-    def __init__(self, max_connections=5):
+    """
+    线程安全的数据库连接池
+
+    取连接时优先复用空闲连接，连接数未达上限时新建连接，达到上限时阻塞等待其他线程归还，
+    超过 timeout 秒仍没有可用连接时抛出 PoolTimeoutError。
+    stats 记录取用、复用、新建、等待、超时次数，用于观察连接复用情况。
+    """
+
+    def __init__(self, max_connections=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, read_only=False):
         self.max_connections = max_connections
-        self.available_connections = []  # 可用连接列表
-        self.active_connections = 0      # 活跃连接数
-        self._lock = None  # 单线程环境，暂不需要锁
-    
-    def get_connection(self):
-        """从连接池获取连接"""
-        if self.available_connections:
-            # 有可用连接，直接返回
-            conn = self.available_connections.pop()
-            # 确保连接仍然有效
+        self.timeout = timeout
+        # 只读连接（PRAGMA query_only）用于分析查询，不能写入（包括临时表）
+        self.read_only = read_only
+        self.available_connections = []  # 空闲连接列表
+        self.active_connections = 0      # 已创建且未关闭的连接数（含正在创建的）
+        self._lock = threading.Condition()
+        self._leases = itertools.count(1)
+        self.stats = {'checkouts': 0, 'reuses': 0, 'creations': 0, 'waits': 0, 'timeouts': 0, 'discards': 0}
+
+    def get_connection(self, timeout=None):
+        """从连接池获取连接（连接池已满时等待，最多等待 timeout 秒，默认为连接池的 timeout）"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = self._checkout(deadline)
+            if conn is None:
+                # 已占用一个连接名额，在锁外创建连接（SQLCipher 派生密钥较慢）
+                try:
+                    conn = self._create_new_connection()
+                except Exception:
+                    self._forget_connection()
+                    raise
+                break
+            # 确保空闲连接仍然有效
             try:
                 conn.execute('SELECT 1')
-                return conn
-            except sqlite3.ProgrammingError:
-                # 连接已关闭或无效，创建新连接
-                self.active_connections -= 1
-                return self._create_new_connection()
-        
-        # 没有可用连接，检查是否达到最大连接数
-        if self.active_connections < self.max_connections:
-            return self._create_new_connection()
-        else:
-            # 达到最大连接数，等待或创建新连接（简化：直接创建）
-            # 在实际生产环境中应该实现等待机制
-            print(f"警告: 达到最大连接数({self.max_connections})，创建额外连接")
-            return self._create_new_connection(False)  # 不计数
-    
-    def return_connection(self, conn):
-        """归还连接到连接池"""
-        if conn and self.active_connections <= self.max_connections:
-            # 重置连接状态
-            try:
-                conn.rollback()  # 回滚任何未提交的事务
-                self.available_connections.append(conn)
-            except:
-                # 连接可能已损坏，关闭它
-                conn.close()
-                self.active_connections -= 1
-        else:
-            # 超过最大连接数或连接无效，直接关闭
-            if conn:
-                conn.close()
-    
-    def _create_new_connection(self, count=True):
+                break
+            except sqlite3.Error:
+                self._discard(conn)
+
+        with self._lock:
+            conn.checked_out = True
+            conn.lease = next(self._leases)
+        return conn
+
+    def _checkout(self, deadline):
+        """取出一个空闲连接；没有空闲连接但未达上限时占用一个名额并返回None"""
+        with self._lock:
+            self.stats['checkouts'] += 1
+            waited = False
+            while True:
+                if self.available_connections:
+                    self.stats['reuses'] += 1
+                    return self.available_connections.pop()
+                if self.active_connections < self.max_connections:
+                    self.active_connections += 1
+                    self.stats['creations'] += 1
+                    return None
+                if not waited:
+                    self.stats['waits'] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeoutError(f'等待数据库连接超时（连接池上限 {self.max_connections}）')
+                self._lock.wait(remaining)
+
+    def _forget_connection(self):
+        """连接已关闭或创建失败，释放它占用的名额"""
+        with self._lock:
+            self.active_connections -= 1
+            self._lock.notify()
+
+    def _discard(self, conn):
+        try:
+            conn.discard()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self.stats['discards'] += 1
+        self._forget_connection()
+
+    def return_connection(self, conn, lease=None):
+        """
+        归还连接到连接池（重复归还时忽略）
+
+        Args:
+            conn: 连接
+            lease: 可选，取出时的 conn.lease；连接已被归还并重新取出时（编号不同）忽略
+        """
+        if conn is None:
+            return
+        if not isinstance(conn, PooledConnection) or conn.pool is not self:
+            conn.close()
+            return
+        with self._lock:
+            if not conn.checked_out or (lease is not None and conn.lease != lease):
+                return
+            conn.checked_out = False
+
+        # 回滚任何未提交的事务，连接已损坏时关闭它
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._lock:
+            self.available_connections.append(conn)
+            self._lock.notify()
+
+    def _create_new_connection(self):
         """创建新数据库连接（支持SQLCipher加密）"""
-        conn = sqlite3.connect(DB_PATH)
+        # 连接由连接池在线程间传递，同一时间只有一个线程使用
+        conn = sqlite3.connect(DB_PATH, factory=PooledConnection, check_same_thread=False)
         
         # 如果设置了加密密钥，则启用SQLCipher加密
         if DB_ENCRYPTION_KEY:
-            conn.execute(f"PRAGMA key='{DB_ENCRYPTION_KEY}'")
+            conn.execute(sqlcipher_key_pragma())
             conn.execute(f'PRAGMA cipher_compatibility={SQLCIPHER_COMPATIBILITY}')
             conn.execute(f'PRAGMA kdf_iter={SQLCIPHER_KDF_ITER}')
         
         conn.row_factory = sqlite3.Row
         conn.execute('PRAGMA foreign_keys = ON')
-        
-        if count:
-            self.active_connections += 1
+        # 日志模式保存在数据库文件中，只读连接设置 query_only 之前设置
+        if DB_JOURNAL_MODE:
+            conn.execute(f'PRAGMA journal_mode = {DB_JOURNAL_MODE}')
+        conn.execute(f'PRAGMA synchronous = {DB_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA cache_size = {DB_CACHE_SIZE}')
+        conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+        conn.execute(f'PRAGMA temp_store = {DB_TEMP_STORE}')
+        if self.read_only:
+            conn.execute('PRAGMA query_only = ON')
+        conn.pool = self
         return conn
-    
+
+    def prewarm(self, count):
+        """预先创建 count 个空闲连接（不超过连接池上限），返回实际创建的连接数"""
+        created = []
+        try:
+            for _ in range(count):
+                with self._lock:
+                    if self.active_connections >= self.max_connections:
+                        break
+                    self.active_connections += 1
+                    self.stats['creations'] += 1
+                try:
+                    created.append(self._create_new_connection())
+                except Exception:
+                    self._forget_connection()
+                    raise
+        finally:
+            with self._lock:
+                self.available_connections.extend(created)
+                self._lock.notify_all()
+        return len(created)
+
+    def get_stats(self):
+        """连接池统计：各计数器，以及当前连接数、空闲连接数"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update(
+                max_connections=self.max_connections,
+                open_connections=self.active_connections,
+                idle_connections=len(self.available_connections)
+            )
+        return stats
+
     def close_all(self):
-        """关闭所有连接"""
-        for conn in self.available_connections:
+        """关闭所有空闲连接"""
+        with self._lock:
+            connections, self.available_connections = self.available_connections, []
+            self.active_connections -= len(connections)
+            self._lock.notify_all()
+        for conn in connections:
             try:
-                conn.close()
-            except:
+                conn.discard()
+            except sqlite3.Error:
                 pass
-        self.available_connections = []
-        self.active_connections = 0
 
-# 全局连接池实例
+# 全局连接池实例：读写连接（任务状态、上传历史等少量写入）、只读连接（分析查询）、唯一写入连接（导入和商品管理）
 _connection_pool = SimpleConnectionPool()
+_read_pool = SimpleConnectionPool(max_connections=DB_READ_POOL_SIZE, read_only=True)
+_writer_pool = SimpleConnectionPool(max_connections=1, timeout=DB_WRITER_TIMEOUT)
 
 
-def get_db_connection():
-    """获取数据库连接（从连接池）"""
-    return _connection_pool.get_connection()
+def get_db_connection(read_only=False):
+    """
+    获取数据库连接（从连接池，conn.close() 即归还）
+
+    在 Flask 请求中取出的连接会记录在请求上，请求结束时未归还的连接自动归还。
+
+    Args:
+        read_only: 为 True 时从只读连接池获取（分析查询使用，WAL 模式下不会被导入阻塞）
+    """
+    conn = (_read_pool if read_only else _connection_pool).get_connection()
+    if has_request_context():
+        g.setdefault('_db_connections', []).append((conn, conn.lease))
+    return conn
+
+def _return_connection(conn, lease=None):
+    if isinstance(conn, PooledConnection) and conn.pool is not None:
+        conn.pool.return_connection(conn, lease)
+    elif conn is not None:
+        conn.close()
 
 def release_db_connection(conn):
     """归还数据库连接到连接池"""
-    _connection_pool.return_connection(conn)
+    _return_connection(conn)
 
 def close_db_connection(conn):
     """关闭数据库连接（兼容旧代码，实际归还到连接池）"""
-    _connection_pool.return_connection(conn)
+    _return_connection(conn)
+
+
+@contextmanager
+def db_connection(read_only=False):
+    """
+    使用连接池中的连接：with db_connection() as conn: ...
+
+    在 Flask 请求中同一请求共用一个连接（读写、只读各一个），请求结束时（teardown）归还；
+    不在请求中时（后台任务、命令行脚本）退出 with 块时归还。
+
+    Args:
+        read_only: 为 True 时使用只读连接（分析查询）
+    """
+    if has_request_context():
+        key = '_db_read_connection' if read_only else '_db_connection'
+        conn, lease = g.get(key, (None, None))
+        if conn is None or not conn.checked_out or conn.lease != lease:
+            conn = get_db_connection(read_only)
+            setattr(g, key, (conn, conn.lease))
+        yield conn
+        return
+
+    pool = _read_pool if read_only else _connection_pool
+    conn = pool.get_connection()
+    try:
+        yield conn
+    finally:
+        pool.return_connection(conn)
+
+
+def get_writer_connection():
+    """
+    获取唯一的写入连接（conn.close() 即归还），其他线程正在使用时等待，最多等待 DB_WRITER_TIMEOUT 秒
+
+    导入订单、库存和商品管理的修改都通过这个连接写入，写入在进程内排队执行，
+    不会因为多个写入事务同时进行而等待数据库锁超时。写入连接不与请求绑定，用完立即归还；
+    长时间的导入应按块取用，使其他写入可以在块之间进行。
+    """
+    return _writer_pool.get_connection()
+
+
+@contextmanager
+def writer_connection():
+    """使用唯一的写入连接：with writer_connection() as conn: ...（退出 with 块时归还）"""
+    conn = get_writer_connection()
+    try:
+        yield conn
+    finally:
+        _writer_pool.return_connection(conn)
+
+
+def release_request_connections(exception=None):
+    """请求结束时归还本请求取出的所有连接（注册为 Flask teardown_appcontext 回调）"""
+    for conn, lease in g.pop('_db_connections', []):
+        _return_connection(conn, lease)
+    g.pop('_db_connection', None)
+    g.pop('_db_read_connection', None)
+
+
+def init_db_pool(app):
+    """把连接池绑定到 Flask 应用：请求结束时归还连接，并预先创建 DB_POOL_PREWARM 个连接"""
+    app.teardown_appcontext(release_request_connections)
+    try:
+        _connection_pool.prewarm(1)
+        _read_pool.prewarm(DB_POOL_PREWARM)
+    except sqlite3.Error as e:
+        print(f'预先创建数据库连接失败: {e}')
+
+
+def get_pool_stats():
+    """各连接池的统计（取用、复用、新建、等待、超时次数等）"""
+    return {
+        'default': _connection_pool.get_stats(),
+        'read_only': _read_pool.get_stats(),
+        'writer': _writer_pool.get_stats(),
+    }
 
 def calculate_record_hash(row):
     """计算记录的哈希值（基于所有字段）"""
@@ -123,4 +419,33 @@ def calculate_record_hash(row):
 
     # 计算MD5哈希
     hash_string = '|'.join(field_values)
-    return hashlib.md5(hash_string.encode('utf-8')).hexdigest()
\ No newline at end of file
+    return hashlib.md5(hash_string.encode('utf-8')).hexdigest()
+
+
+def calculate_record_hashes(df):
+    """
+    批量计算记录哈希值，结果与逐行调用 calculate_record_hash 完全一致
+
+    列顺序只排序一次，每列整体转换为字符串（空值转为''），再逐行拼接计算MD5，
+    避免为每一行构造 Series 并重复排序、判空。
+
+    Args:
+        df: 待计算的 DataFrame（不应包含 record_hash 列）
+
+    Returns:
+        与 df 行顺序一致的哈希值数组（ndarray, dtype=object）
+    """
+    # 按列名排序（与 calculate_record_hash 的 sorted(row.index) 一致），按位置取列以兼容重名列
+    column_order = sorted(range(len(df.columns)), key=lambda i: df.columns[i])
+
+    string_columns = []
+    for position in column_order:
+        values = df.iloc[:, position].to_numpy(dtype=object)
+        strings = list(map(str, values))
+        for idx in np.flatnonzero(pd.isna(values)):
+            strings[idx] = ''
+        string_columns.append(strings)
+
+    md5 = hashlib.md5
+    hashes = [md5('|'.join(parts).encode('utf-8')).hexdigest() for parts in zip(*string_columns)]
+    return np.array(hashes, dtype=object)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库一致性快照（backup_db.sh 调用）
+WAL 模式下服务持续写入，分别复制数据库文件和 -wal 文件时中间可能发生检查点，恢复后会丢失已提交的事务或页面损坏。
+这里通过连接池打开数据库（密钥由 dbpy.database 处理），用 SQLite 在线备份接口在一个读事务内复制全部页面，
+得到单个完整的数据库文件：仍按同一密钥加密，日志模式改为 DELETE，恢复时直接替换 rongzao.db 即可。
+使用方法：
+    python3 dbpy/db_backup.py <输出文件>
+"""
+
+import os
+import sys
+
+from dotenv import load_dotenv
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+# 密钥等配置在导入 dbpy.database 时读取
+load_dotenv(os.path.join(PROJECT_ROOT, '.env'))
+
+from dbpy.database import (  # noqa: E402
+    DB_ENCRYPTION_KEY, SQLCIPHER_COMPATIBILITY, SQLCIPHER_KDF_ITER, get_db_connection, sqlcipher_key_pragma, sqlite3
+)
+
+
+def backup_database(destination):
+    """
+    把当前数据库的一致性快照写入 destination（先写临时文件，检查通过后再改名）
+
+    Returns:
+        快照的页数
+    """
+    temp_path = destination + '.tmp'
+    if os.path.exists(temp_path):
+        os.unlink(temp_path)
+
+    source = get_db_connection(read_only=True)
+    try:
+        target = sqlite3.connect(temp_path)
+        try:
+            if DB_ENCRYPTION_KEY:
+                target.execute(sqlcipher_key_pragma())
+                target.execute(f'PRAGMA cipher_compatibility={SQLCIPHER_COMPATIBILITY}')
+                target.execute(f'PRAGMA kdf_iter={SQLCIPHER_KDF_ITER}')
+            # 一次复制全部页面，整个复制过程在同一个读快照中（不阻塞服务写入）
+            source.backup(target)
+            target.execute('PRAGMA journal_mode = DELETE')
+            result = target.execute('PRAGMA quick_check').fetchone()[0]
+            if result != 'ok':
+                raise sqlite3.DatabaseError(f'快照完整性检查失败: {result}')
+            page_count = target.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+    except Exception:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    finally:
+        source.close()
+
+    os.replace(temp_path, destination)
+    return page_count
+
+
+def main():
+    if len(sys.argv) != 2:
+        print('用法: python3 dbpy/db_backup.py <输出文件>')
+        return 2
+    try:
+        page_count = backup_database(sys.argv[1])
+    except Exception as e:
+        print(f'✗ 生成数据库快照失败: {e}')
+        return 1
+    print(f'✓ 数据库快照已生成: {sys.argv[1]}（{page_count} 页）')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,19 +5,9 @@
 """
 import json
 import os
+from dbpy.daily_sales import bump_daily_sales_version
 from dbpy.database import get_db_connection
-
-
-def extract_alias(product_name):
-    """
-    提取商品别名
-    去除-后面的颜色、尺码等信息
-    """
-    if '-' in product_name:
-        # 找到第一个-的位置，去除后面的内容
-        alias = product_name.split('-')[0].strip()
-        return alias
-    return product_name
+from utils.product_name import extract_alias
 
 
 def determine_category(product_name, category_keywords):
@@ -72,9 +62,18 @@ def main():
 
     all_mappings = []
 
+    # 订单入库时自动登记的商品（大类和映射都为空）在这里补充，已设置过的商品不修改
+    cursor.execute('SELECT name, category, mapped_title FROM ProductInfo')
+    existing_products = {row['name']: row for row in cursor.fetchall()}
+
     # 4. 填充ProductInfo表
     inserted_count = 0
+    updated_count = 0
     for product_name in product_names:
+        existing = existing_products.get(product_name)
+        if existing is not None and (existing['category'] is not None or existing['mapped_title'] is not None):
+            continue
+
         # 提取alias
         alias = extract_alias(product_name)
 
@@ -84,6 +83,14 @@ def main():
         # 确定mapped_title
         mapped_title = determine_mapped_title(product_name, all_mappings)
 
+        if existing is not None:
+            cursor.execute('''
+                UPDATE ProductInfo SET alias = ?, category = ?, mapped_title = ?
+                WHERE name = ?
+            ''', (alias, category_id, mapped_title, product_name))
+            updated_count += 1
+            continue
+
         # 插入数据
         cursor.execute('''
             INSERT INTO ProductInfo (name, alias, category, mapped_title)
@@ -91,8 +98,10 @@ def main():
         ''', (product_name, alias, category_id, mapped_title))
         inserted_count += 1
 
+    # 数据分析的前缀和缓存按商品映射汇总，映射变化后需要重新读取
+    bump_daily_sales_version(conn)
     conn.commit()
-    print(f'成功插入 {inserted_count} 条商品信息到ProductInfo表')
+    print(f'成功插入 {inserted_count} 条商品信息到ProductInfo表，补充 {updated_count} 条自动登记的商品')
 
     # 5. 显示统计信息
     cursor.execute('SELECT COUNT(*) as total FROM ProductInfo')
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Inventory 批量写入
+按列清理和转换CSV数据，依赖 (商品名称, 仓库) 唯一索引，
+用 INSERT ... ON CONFLICT DO UPDATE 分块 executemany
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils.ingest_telemetry import stage_timer
+
+# (商品名称, 仓库) 唯一索引，upsert 依赖它判断记录是否已存在
+INVENTORY_UNIQUE_INDEX_SQL = 'CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_商品名称_仓库 ON Inventory(商品名称, 仓库)'
+
+# CSV 写入的字段及类型（'str'、'int'、'float'），顺序与 Inventory 表一致
+INVENTORY_COLUMNS = [
+    ('商品名称', 'str'), ('仓库', 'str'), ('数量', 'int'), ('可销数', 'int'),
+    ('可配数', 'int'), ('锁定数', 'int'), ('商品建档日期', 'str'),
+    ('商品代码', 'str'), ('商品规格代码', 'str'), ('商品规格名称', 'str'), ('商品标签', 'str'),
+    ('商品单位', 'str'), ('库存重量', 'float'), ('可销售天数', 'str'), ('在途数', 'int'),
+    ('安全库存下限', 'int'), ('安全库存上限', 'int'), ('订单占用数', 'int'), ('未付款数', 'int'),
+    ('库位', 'str'), ('商品条码', 'str'), ('商品简称', 'str'), ('商品备注', 'str'),
+    ('规格备注', 'str'), ('库存状态', 'str'), ('商品分类', 'str'), ('商品税号', 'str'),
+    ('供应商', 'str'), ('保质期', 'str'), ('有效日期', 'str'), ('生产日期', 'str'),
+    ('供应商货号', 'str'), ('品牌', 'str'), ('箱规', 'str'), ('标准进价', 'float'),
+    ('最新采购价', 'float'), ('最新采购供应商', 'str'), ('成本价格', 'float'), ('销售价格', 'float'),
+    ('成本总金额', 'float'), ('销售总金额', 'float'), ('近3日销量', 'int'), ('近7日销量', 'int'),
+    ('近15日销量', 'int'), ('近30日销量', 'int'),
+]
+
+INVENTORY_KEY_COLUMNS = ('商品名称', '仓库')
+
+
+def build_inventory_upsert_sql():
+    """生成 Inventory 的 upsert 语句：不存在时插入，已存在时更新除键以外的字段和更新时间"""
+    names = [name for name, _ in INVENTORY_COLUMNS]
+    updates = ',\n            '.join(f'{name} = excluded.{name}' for name in names if name not in INVENTORY_KEY_COLUMNS)
+    return f'''
+        INSERT INTO Inventory ({', '.join(names)})
+        VALUES ({', '.join('?' * len(names))})
+        ON CONFLICT(商品名称, 仓库) DO UPDATE SET
+            {updates},
+            更新时间 = CURRENT_TIMESTAMP
+    '''
+
+
+def _clean_text(series):
+    """去除开头和结尾的空白字符（导出文件中常带制表符），空字符串视为空值"""
+    text = series.astype(object).where(series.notna())
+    text = text.str.strip()
+    return text.where(text != '')
+
+
+def _to_sql_values(values, missing):
+    """转为 object 数组，空值位置为 None"""
+    result = values.astype(object)
+    result[missing] = None
+    return result
+
+
+def convert_inventory_column(series, field_type):
+    """
+    按列清理并转换字段值，无法转换或清理后为空的值为 None
+
+    Args:
+        series: 按字符串读取的CSV列
+        field_type: 'str'、'int' 或 'float'
+
+    Returns:
+        object 数组（str/int/float 或 None）
+    """
+    text = _clean_text(series)
+    if field_type == 'str':
+        return _to_sql_values(text.to_numpy(dtype=object), text.isna().to_numpy())
+
+    numbers = pd.to_numeric(text, errors='coerce').to_numpy(dtype=float)
+    missing = ~np.isfinite(numbers)
+    if field_type == 'int':
+        # 超出 INTEGER 范围的值按无法转换处理
+        missing |= np.abs(np.where(missing, 0, numbers)) >= 2 ** 63
+        # '12.0' 这类值按浮点数截断为整数（与 int(float(x)) 一致）
+        numbers = np.trunc(np.where(missing, 0, numbers))
+        return _to_sql_values(numbers.astype(np.int64), missing)
+    return _to_sql_values(numbers, missing)
+
+
+def build_inventory_params(df):
+    """
+    按列构造 executemany 参数
+
+    Args:
+        df: 按字符串读取的CSV数据块
+
+    Returns:
+        参数元组列表，顺序与 build_inventory_upsert_sql() 一致
+    """
+    row_count = len(df)
+    columns = []
+    for name, field_type in INVENTORY_COLUMNS:
+        if name in df.columns:
+            columns.append(convert_inventory_column(df[name], field_type))
+        else:
+            columns.append(np.full(row_count, None, dtype=object))
+    return list(zip(*columns))
+
+
+def get_inventory_max_id(conn):
+    """当前 Inventory 最大 id，写入后 id 更大的记录即为新增记录"""
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM Inventory').fetchone()[0]
+
+
+def count_inventory_inserted_since(conn, max_id):
+    """统计 id 大于 max_id 的记录数（本次新增）"""
+    return conn.execute('SELECT COUNT(*) FROM Inventory WHERE id > ?', (max_id,)).fetchone()[0]
+
+
+def upsert_inventory_chunk(conn, df, telemetry=None):
+    """
+    写入一块库存数据（不提交，由调用方在全部写入后统一提交）
+
+    整块 executemany 失败时逐行重试以定位出错的行；upsert 可重复执行，
+    整块失败前已写入的行重试时只会再更新一次。
+
+    Args:
+        conn: 数据库连接
+        df: 按字符串读取的CSV数据块
+        telemetry: 可选的 IngestTelemetry，统计 convert、insert 阶段并记录日志
+
+    Returns:
+        失败行数
+    """
+    upsert_sql = build_inventory_upsert_sql()
+    with stage_timer(telemetry, 'convert', len(df)):
+        params = build_inventory_params(df)
+    cursor = conn.cursor()
+    try:
+        with stage_timer(telemetry, 'insert', len(params)):
+            cursor.executemany(upsert_sql, params)
+        return 0
+    except Exception as e:
+        if telemetry:
+            telemetry.logger.warning(f'库存批量写入失败，改为逐行写入: {e}')
+
+    failed = 0
+    for row in params:
+        try:
+            cursor.execute(upsert_sql, row)
+        except Exception as e:
+            failed += 1
+            if telemetry:
+                telemetry.sample('insert_error', f'写入库存记录失败: 商品名称="{row[0]}" 仓库="{row[1]}": {e}', 'error')
+    return failed
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库结构迁移
+已执行到的版本号记录在 PRAGMA user_version 中，应用启动时按顺序执行未执行过的迁移。
+使用方法：
+    python3 dbpy/migrations.py
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbpy.channels import create_channel_info_table, reclassify_orders
+from dbpy.daily_sales import CREATE_DAILY_SALES_VERSION_TABLE_SQL, create_daily_sales_table, rebuild_daily_sales
+from dbpy.database import get_db_connection
+from dbpy.inventory_ingest import INVENTORY_UNIQUE_INDEX_SQL
+from dbpy.order_ingest import payment_time_keys
+from dbpy.order_schema import (
+    CHANNEL_ID_COLUMN, ORDER_DETAILS_DERIVED_COLUMNS, PAY_DATE_INDEX_SQL, PRODUCT_ID_COLUMN, VALID_ORDER_CONDITION
+)
+from dbpy.products import backfill_order_product_ids, create_product_info_table
+from dbpy.upload_history import CREATE_UPLOAD_HISTORY_TABLE_SQL
+
+# 回填付款日期字段时每批处理的行数
+PAY_DATE_BACKFILL_BATCH_SIZE = 50000
+
+# db_init.py 早期创建的 OrderDetails 索引：统计查询都不使用（商品名称的查找由 idx_product_pay_date 的前缀代替），
+# 只增加写入开销
+OBSOLETE_ORDER_DETAILS_INDEXES = ['idx_单据编号', 'idx_商品代码', 'idx_商品名称', 'idx_是否退款', 'idx_创建时间']
+
+# 迁移 5、6 创建的统计查询索引（之后的迁移会替换或删除这些索引，这里保持迁移当时的定义）
+ORDER_QUERY_INDEXES_V5 = [
+    PAY_DATE_INDEX_SQL,
+    'CREATE INDEX IF NOT EXISTS idx_valid_pay_date '
+    'ON OrderDetails(pay_date, 商品名称, 店铺类型, 订购数, 让利后金额, pay_ts, 是否退款) '
+    f'WHERE {VALID_ORDER_CONDITION}',
+    'CREATE INDEX IF NOT EXISTS idx_product_pay_date '
+    'ON OrderDetails(商品名称, pay_date, pay_ts, 订购数, 让利后金额, 店铺类型, 是否退款)',
+]
+ORDER_QUERY_INDEXES_V6 = [
+    PAY_DATE_INDEX_SQL,
+    'CREATE INDEX IF NOT EXISTS idx_valid_pay_date '
+    'ON OrderDetails(pay_date, 商品名称, channel_id, 订购数, 让利后金额, pay_ts, 是否退款) '
+    f'WHERE {VALID_ORDER_CONDITION}',
+    'CREATE INDEX IF NOT EXISTS idx_product_pay_date '
+    'ON OrderDetails(商品名称, pay_date, pay_ts, 订购数, 让利后金额, channel_id, 是否退款)',
+]
+
+# 迁移 7 创建的 DailySales（按商品名称汇总，迁移 9 改为按 product_id 汇总并重建），这里保持迁移当时的定义
+DAILY_SALES_SQL_V7 = [
+    '''
+    CREATE TABLE IF NOT EXISTS DailySales (
+        pay_date INTEGER NOT NULL,
+        商品名称 TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        店铺名称 TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        amount REAL NOT NULL DEFAULT 0,
+        line_count INTEGER NOT NULL DEFAULT 0,
+        refunding_quantity INTEGER NOT NULL DEFAULT 0,
+        refunding_amount REAL NOT NULL DEFAULT 0,
+        refunded_amount REAL NOT NULL DEFAULT 0,
+        first_pay_ts INTEGER,
+        PRIMARY KEY (pay_date, 商品名称, channel_id, 店铺名称)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_daily_sales_product ON DailySales(商品名称, pay_date)',
+]
+GENERATE_DAILY_SALES_SQL_V7 = f'''
+    INSERT INTO DailySales
+    SELECT
+        pay_date,
+        COALESCE(商品名称, ''),
+        COALESCE(channel_id, 0),
+        COALESCE(店铺名称, ''),
+        COALESCE(SUM(CASE WHEN {VALID_ORDER_CONDITION} THEN 订购数 END), 0),
+        COALESCE(SUM(CASE WHEN {VALID_ORDER_CONDITION} THEN 让利后金额 END), 0),
+        COUNT(CASE WHEN {VALID_ORDER_CONDITION} THEN 1 END),
+        COALESCE(SUM(CASE WHEN 是否退款 = '退款中' THEN 订购数 END), 0),
+        COALESCE(SUM(CASE WHEN 是否退款 = '退款中' THEN 让利后金额 END), 0),
+        COALESCE(SUM(CASE WHEN 是否退款 = '退款成功' THEN 让利后金额 END), 0),
+        MIN(CASE WHEN {VALID_ORDER_CONDITION} THEN pay_ts END)
+    FROM OrderDetails
+    WHERE pay_date IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+'''
+
+
+def _table_exists(conn, table_name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()
+    return row is not None
+
+
+def migrate_inventory_unique_index(conn):
+    """
+    Inventory 按 商品名称+仓库 去重并添加唯一索引
+
+    先去掉键字段首尾的空白字符（导出文件中的制表符），
+    同一 商品名称+仓库 有多条记录时保留最近更新的一条，其余删除。
+    """
+    if not _table_exists(conn, 'Inventory'):
+        # 表尚未创建，create_inventory_table 建表时会一并创建唯一索引
+        return
+
+    whitespace = "' ' || char(9) || char(10) || char(13)"
+    conn.execute(f'''
+        UPDATE Inventory
+        SET 商品名称 = TRIM(商品名称, {whitespace}), 仓库 = TRIM(仓库, {whitespace})
+        WHERE 商品名称 != TRIM(商品名称, {whitespace}) OR 仓库 != TRIM(仓库, {whitespace})
+    ''')
+
+    cursor = conn.execute('''
+        DELETE FROM Inventory WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY 商品名称, 仓库 ORDER BY 更新时间 DESC, id DESC
+                ) AS rn
+                FROM Inventory
+                WHERE 商品名称 IS NOT NULL AND 仓库 IS NOT NULL
+            ) WHERE rn > 1
+        )
+    ''')
+    print(f'  删除重复库存记录: {cursor.rowcount} 条')
+
+    conn.execute(INVENTORY_UNIQUE_INDEX_SQL)
+
+
+def _add_column(conn, table_name, column_name, column_type):
+    """表已存在且缺少该列时添加（表尚未创建时由建表语句创建该列）"""
+    if not _table_exists(conn, table_name):
+        return
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table_name})').fetchall()]
+    if column_name not in columns:
+        conn.execute(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}')
+
+
+def migrate_ingest_job_summary(conn):
+    """IngestJob 增加 summary 列（写入前的预分类统计）"""
+    _add_column(conn, 'IngestJob', 'summary', 'TEXT')
+
+
+def migrate_upload_history(conn):
+    """创建 UploadHistory 表，IngestJob 增加 fingerprint 列（上传文件内容的 SHA-256）"""
+    conn.execute(CREATE_UPLOAD_HISTORY_TABLE_SQL)
+    _add_column(conn, 'IngestJob', 'fingerprint', 'TEXT')
+
+
+def migrate_order_pay_date(conn):
+    """
+    OrderDetails 增加 pay_date、pay_ts 列，按已有的付款时间分批回填，并添加 pay_date 索引
+
+    回填与入库使用同一个解析函数（payment_time_keys），新旧数据的取值规则一致。
+    """
+    if not _table_exists(conn, 'OrderDetails'):
+        return
+    for column_name, column_type in ORDER_DETAILS_DERIVED_COLUMNS:
+        _add_column(conn, 'OrderDetails', column_name, column_type)
+
+    last_id = 0
+    updated = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, 付款时间 FROM OrderDetails WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, PAY_DATE_BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        ids = [row[0] for row in rows]
+        pay_date, pay_ts = payment_time_keys([row[1] for row in rows])
+        conn.executemany(
+            'UPDATE OrderDetails SET pay_date = ?, pay_ts = ? WHERE id = ?', zip(pay_date, pay_ts, ids)
+        )
+        updated += len(ids)
+        last_id = ids[-1]
+    print(f'  回填付款日期: {updated} 条')
+
+    conn.execute(PAY_DATE_INDEX_SQL)
+
+
+def migrate_order_query_indexes(conn):
+    """OrderDetails 删除未使用的索引，创建统计查询使用的覆盖索引和有效订单部分索引"""
+    if not _table_exists(conn, 'OrderDetails'):
+        return
+    for index_name in OBSOLETE_ORDER_DETAILS_INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {index_name}')
+    for index_sql in ORDER_QUERY_INDEXES_V5:
+        conn.execute(index_sql)
+
+
+def migrate_order_channel(conn):
+    """
+    创建 ChannelInfo 表，OrderDetails 增加 channel_id 列并按店铺类型回填，
+    统计查询的覆盖索引改为包含 channel_id（代替店铺类型）
+    """
+    create_channel_info_table(conn)
+    if not _table_exists(conn, 'OrderDetails'):
+        return
+    _add_column(conn, 'OrderDetails', *CHANNEL_ID_COLUMN)
+    print(f'  回填订单渠道: {reclassify_orders(conn)} 条')
+
+    conn.execute('DROP INDEX IF EXISTS idx_valid_pay_date')
+    conn.execute('DROP INDEX IF EXISTS idx_product_pay_date')
+    for index_sql in ORDER_QUERY_INDEXES_V6:
+        conn.execute(index_sql)
+
+
+def migrate_daily_sales(conn):
+    """
+    创建每日销售汇总表 DailySales 并按已有订单生成，
+    删除统计查询改为读取汇总表后不再使用的 OrderDetails 覆盖索引
+    """
+    for sql in DAILY_SALES_SQL_V7:
+        conn.execute(sql)
+    if not _table_exists(conn, 'OrderDetails'):
+        return
+    conn.execute('DELETE FROM DailySales')
+    print(f'  生成每日销售汇总: {conn.execute(GENERATE_DAILY_SALES_SQL_V7).rowcount} 行')
+    conn.execute('DROP INDEX IF EXISTS idx_valid_pay_date')
+    conn.execute('DROP INDEX IF EXISTS idx_product_pay_date')
+
+
+def migrate_daily_sales_version(conn):
+    """创建汇总表版本号 DailySalesVersion（数据分析的前缀和缓存据此判断是否需要重新读取）"""
+    conn.execute(CREATE_DAILY_SALES_VERSION_TABLE_SQL)
+
+
+def migrate_order_product_id(conn):
+    """
+    OrderDetails 增加 product_id 列：为订单中的商品名称登记 ProductInfo 并回填，
+    DailySales 改为按 product_id 汇总（删除后重建）
+    """
+    create_product_info_table(conn)
+    conn.execute('DROP TABLE IF EXISTS DailySales')
+    create_daily_sales_table(conn)
+    if not _table_exists(conn, 'OrderDetails'):
+        return
+    _add_column(conn, 'OrderDetails', *PRODUCT_ID_COLUMN)
+    registered, updated = backfill_order_product_ids(conn)
+    print(f'  登记商品: {registered} 个，回填订单商品: {updated} 条')
+    print(f'  重建每日销售汇总: {rebuild_daily_sales(conn)} 行')
+
+
+# (版本号, 说明, 迁移函数)，版本号依次递增，已发布的迁移不要修改
+MIGRATIONS = [
+    (1, 'Inventory 按商品名称+仓库去重并添加唯一索引', migrate_inventory_unique_index),
+    (2, 'IngestJob 增加 summary 列', migrate_ingest_job_summary),
+    (3, '创建 UploadHistory 表，IngestJob 增加 fingerprint 列', migrate_upload_history),
+    (4, 'OrderDetails 增加 pay_date、pay_ts 列并回填', migrate_order_pay_date),
+    (5, 'OrderDetails 按统计查询重建索引', migrate_order_query_indexes),
+    (6, '创建 ChannelInfo 表，OrderDetails 增加 channel_id 列并回填', migrate_order_channel),
+    (7, '创建每日销售汇总表 DailySales', migrate_daily_sales),
+    (8, '创建汇总表版本号 DailySalesVersion', migrate_daily_sales_version),
+    (9, 'OrderDetails 增加 product_id 列并回填，DailySales 改为按 product_id 汇总', migrate_order_product_id),
+]
+
+
+def run_migrations():
+    """
+    执行所有未执行的迁移，每个迁移在单独的事务中执行并更新 user_version
+
+    Python sqlite3 只在 INSERT、UPDATE 等语句前自动开始事务，CREATE、ALTER、DROP 在事务外立即生效，
+    因此每个迁移显式 BEGIN IMMEDIATE，迁移的全部语句和 PRAGMA user_version 在同一个事务中提交：
+    迁移中途失败时整体回滚，数据库保持在上一个版本，下次启动重新执行该迁移。
+    取得写锁后重新读取版本号，多个进程同时启动时同一个迁移只执行一次。
+
+    Returns:
+        执行后的版本号
+    """
+    conn = get_db_connection()
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for target, description, migrate in MIGRATIONS:
+            if target <= version:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if target <= version:
+                    conn.rollback()
+                    continue
+                print(f'执行数据库迁移 {target}: {description}')
+                migrate(conn)
+                # PRAGMA 不支持参数绑定，版本号来自上面的常量列表
+                conn.execute(f'PRAGMA user_version = {int(target)}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            version = target
+        return version
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    print(f'数据库版本: {run_migrations()}')
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+OrderDetails 批量写入
+按列从 DataFrame 构造参数元组，分块 executemany，新增的行在同一事务中累加到每日销售汇总表，每块提交一次
+"""
+
+import os
+import warnings
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from dbpy.channels import ChannelClassifier
+from dbpy.daily_sales import add_orders_to_daily_sales, daily_sales_version, last_order_id
+from dbpy.order_schema import ORDER_DETAILS_COLUMN_NAMES, build_order_details_insert_sql
+from dbpy.products import ProductIds
+from dbpy.sales_prefix import apply_daily_sales_delta
+from utils.file_validator import PAY_TIME_FORMAT
+from utils.ingest_telemetry import stage_timer
+from utils.streaming_reader import format_datetime_series
+
+# 每个写入块的行数（可通过环境变量 ORDER_INSERT_CHUNK_SIZE 调整）
+ORDER_INSERT_CHUNK_SIZE = int(os.environ.get('ORDER_INSERT_CHUNK_SIZE', 5000))
+
+
+def normalize_order_chunk(df, datetime_resolutions=None):
+    """
+    把一块订单数据转换为入库格式：日期时间转字符串，空值转空字符串
+
+    Args:
+        df: 订单数据块
+        datetime_resolutions: 各日期时间列的整列精度（ExcelChunkReader.datetime_resolutions），
+                              使分块转换的字符串与整表 astype(str) 一致；为 None 时按本块转换
+    """
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            if datetime_resolutions and col in datetime_resolutions:
+                df[col] = format_datetime_series(df[col], datetime_resolutions[col])
+            else:
+                df[col] = df[col].astype(str)
+        # 将NaT（Not a Time）转换为空字符串
+        df[col] = df[col].where(pd.notna(df[col]), '')
+    return df
+
+
+def payment_time_keys(values):
+    """
+    付款时间转为查询字段 (pay_date, pay_ts)
+
+    先按标准格式（%Y-%m-%d %H:%M:%S）整列解析，不符合的值再推断格式（如只有日期、带毫秒）；
+    空值、空字符串、"NaT" 和无法解析的值为 None。
+
+    Args:
+        values: 付款时间（入库格式的字符串）
+
+    Returns:
+        (pay_date, pay_ts)：与 values 等长的 object 数组，元素为 int 或 None
+    """
+    text = pd.Series(values, dtype=object).fillna('').astype(str).str.strip()
+    parsed = pd.to_datetime(text, errors='coerce', format=PAY_TIME_FORMAT)
+    retry = (parsed.isna() & ~text.isin(['', 'NaT'])).to_numpy()
+    if retry.any():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            try:
+                parsed[retry] = pd.to_datetime(text[retry], errors='coerce', format='mixed')
+            except (ValueError, TypeError):
+                parsed[retry] = [pd.to_datetime(value, errors='coerce') for value in text[retry]]
+
+    pay_date = np.full(len(text), None, dtype=object)
+    pay_ts = np.full(len(text), None, dtype=object)
+    valid = parsed.notna().to_numpy()
+    if valid.any():
+        times = parsed[valid]
+        pay_date[valid] = (times.dt.year * 10000 + times.dt.month * 100 + times.dt.day).tolist()
+        pay_ts[valid] = (times.astype('int64') // 10 ** 9).tolist()
+    return pay_date, pay_ts
+
+
+class RecordHashFilter:
+    """
+    分块上传时的文件内去重
+
+    只保存每个 record_hash 的前 64 位（uint64 有序数组，每行 8 字节），
+    用于判断某行是否已在前面的块中出现过，不需要把整个文件的哈希字符串留在内存中。
+    """
+
+    def __init__(self):
+        self._seen = np.empty(0, dtype=np.uint64)
+
+    def first_seen_mask(self, hashes):
+        """
+        返回布尔掩码：该行哈希在本块中首次出现且不在之前的块中出现过时为 True
+
+        Args:
+            hashes: 本块的 record_hash 序列（32 位十六进制字符串）
+        """
+        hashes = pd.Series(hashes)
+        keys = np.fromiter((int(h[:16], 16) for h in hashes), dtype=np.uint64, count=len(hashes))
+        mask = ~hashes.duplicated(keep='first').to_numpy()
+        if len(self._seen):
+            positions = np.minimum(np.searchsorted(self._seen, keys), len(self._seen) - 1)
+            mask &= self._seen[positions] != keys
+        new_keys = np.sort(keys[mask])
+        self._seen = np.insert(self._seen, np.searchsorted(self._seen, new_keys), new_keys)
+        return mask
+
+
+class UploadHashStaging:
+    """
+    上传前的重复预分类
+
+    把整个文件（文件内去重后）待写入行的 record_hash 连同所在块号、块内位置写入临时表，
+    再与 OrderDetails.record_hash 连接一次，找出数据库中已存在的行，只有其余的行需要写入。
+    临时表只属于当前连接，连接归还连接池前由 close() 删除。
+    """
+
+    TABLE = 'temp.upload_record_hashes'
+
+    def __init__(self, conn):
+        self.conn = conn
+        conn.execute(f'DROP TABLE IF EXISTS {self.TABLE}')
+        conn.execute(f'CREATE TABLE {self.TABLE} (record_hash TEXT NOT NULL, chunk_no INTEGER, row_pos INTEGER)')
+
+    def add(self, chunk_no, positions, hashes):
+        """
+        暂存一块中待写入行的哈希
+
+        Args:
+            chunk_no: 块号
+            positions: 行在块内的位置
+            hashes: 对应行的 record_hash
+        """
+        self.conn.executemany(
+            f'INSERT INTO {self.TABLE} (record_hash, chunk_no, row_pos) VALUES (?, ?, ?)',
+            zip(hashes, repeat(int(chunk_no)), map(int, positions))
+        )
+
+    def existing_rows(self):
+        """
+        一次连接查询找出数据库中已存在的行
+
+        Returns:
+            {块号: 块内位置数组}
+        """
+        rows = self.conn.execute(f'''
+            SELECT u.chunk_no, u.row_pos
+            FROM {self.TABLE} u
+            JOIN OrderDetails o ON o.record_hash = u.record_hash
+        ''').fetchall()
+        existing = {}
+        for chunk_no, row_pos in rows:
+            existing.setdefault(chunk_no, []).append(row_pos)
+        return {chunk_no: np.array(positions, dtype=np.int64) for chunk_no, positions in existing.items()}
+
+    def close(self):
+        """删除临时表"""
+        self.conn.commit()
+        self.conn.execute(f'DROP TABLE IF EXISTS {self.TABLE}')
+
+
+def build_order_params(df, created_at, channels, products):
+    """
+    按列构造 executemany 参数（record_hash + 业务字段 + 付款日期字段 + 渠道 + 商品 + 创建时间）
+
+    Args:
+        df: 已包含 record_hash 列的 DataFrame
+        created_at: 创建时间字符串
+        channels: ChannelClassifier，按店铺类型计算 channel_id
+        products: ProductIds，按商品名称查找 product_id（新名称登记到 ProductInfo，由调用方提交）
+
+    Returns:
+        参数元组列表，顺序与 build_order_details_insert_sql() 一致
+    """
+    row_count = len(df)
+    columns = [df['record_hash'].to_numpy(dtype=object)]
+    for name in ORDER_DETAILS_COLUMN_NAMES:
+        if name in df.columns:
+            columns.append(df[name].to_numpy(dtype=object))
+        else:
+            # 导出文件中缺少的列按空字符串写入（与原 row.get(col, '') 一致）
+            columns.append(repeat('', row_count))
+    if '付款时间' in df.columns:
+        columns.extend(payment_time_keys(df['付款时间'].to_numpy(dtype=object)))
+    else:
+        columns.extend([repeat(None, row_count), repeat(None, row_count)])
+    if '店铺类型' in df.columns:
+        columns.append(channels.classify_values(df['店铺类型'].to_numpy(dtype=object)))
+    else:
+        columns.append(repeat(None, row_count))
+    if '商品名称' in df.columns:
+        columns.append(products.id_values(df['商品名称'].to_numpy(dtype=object)))
+    else:
+        columns.append(repeat(None, row_count))
+    columns.append(repeat(created_at, row_count))
+    return list(zip(*columns))
+
+
+def _insert_rows_one_by_one(conn, insert_sql, params, telemetry=None):
+    """整块写入失败时逐行重试，定位出错的行，返回 (新增数, 错误数)（由调用方提交）"""
+    cursor = conn.cursor()
+    inserted = 0
+    errors = 0
+    for row in params:
+        before = conn.total_changes
+        try:
+            cursor.execute(insert_sql, row)
+            inserted += conn.total_changes - before
+        except Exception as e:
+            errors += 1
+            if telemetry:
+                telemetry.sample('insert_error', f'插入记录失败 (record_hash={row[0]}): {e}', 'error')
+    return inserted, errors
+
+
+def _begin_order_write(conn):
+    """
+    开始本块的写事务并返回 OrderDetails 当前最大的 id
+
+    BEGIN IMMEDIATE 先取得数据库写锁再读取最大 id：服务和 dbpy.backfill 等其他进程的写入只能在本块提交之后，
+    id 大于返回值的行都是本块写入的，不会把其他进程的订单重复累加到 DailySales。
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    return last_order_id(conn)
+
+
+def write_order_details(conn, df, created_at, chunk_size=None, telemetry=None):
+    """
+    批量写入 OrderDetails（INSERT OR IGNORE）
+
+    每 chunk_size 行执行一次 executemany，新增数由 conn.total_changes 的差值得出，
+    其余行即为数据库中已存在的重复记录。每块在持有写锁的事务中写入，新增的行在同一事务中累加到 DailySales 后提交，
+    提交后再累加到本进程的销售前缀和缓存。调用时连接上不应有未提交的事务。
+
+    Args:
+        conn: 数据库连接
+        df: 待写入的 DataFrame（需包含 record_hash 列）
+        created_at: 创建时间字符串
+        chunk_size: 每块行数，默认 ORDER_INSERT_CHUNK_SIZE
+        telemetry: 可选的 IngestTelemetry，统计 insert、rollup、commit 阶段并记录日志
+
+    Returns:
+        (新增数, 重复数, 错误数)
+    """
+    chunk_size = chunk_size or ORDER_INSERT_CHUNK_SIZE
+    insert_sql = build_order_details_insert_sql()
+    channels = ChannelClassifier.load(conn)
+    products = ProductIds.load(conn)
+    cursor = conn.cursor()
+
+    success_count = 0
+    duplicate_count = 0
+    error_count = 0
+
+    for start in range(0, len(df), chunk_size):
+        registered_before = len(products.ids)
+        params = build_order_params(df.iloc[start:start + chunk_size], created_at, channels, products)
+        if len(products.ids) != registered_before:
+            # 新登记的商品先单独提交，本块写入失败回滚时参数中的 product_id 仍然有效
+            # （登记不更新 DailySalesVersion，本块累加汇总表时版本号只更新一次）
+            conn.commit()
+        after_id = _begin_order_write(conn)
+        before = conn.total_changes
+        try:
+            with stage_timer(telemetry, 'insert', len(params)):
+                cursor.executemany(insert_sql, params)
+            inserted = conn.total_changes - before
+            errors = 0
+        except Exception as e:
+            conn.rollback()
+            if telemetry:
+                telemetry.logger.warning(f'第 {start + 1}-{start + len(params)} 行批量写入失败，改为逐行写入: {e}')
+            after_id = _begin_order_write(conn)
+            with stage_timer(telemetry, 'insert_row_by_row', len(params)):
+                inserted, errors = _insert_rows_one_by_one(conn, insert_sql, params, telemetry)
+
+        delta = None
+        try:
+            if inserted:
+                with stage_timer(telemetry, 'rollup', inserted):
+                    delta = add_orders_to_daily_sales(conn, after_id)
+                    version = daily_sales_version(conn)
+            with stage_timer(telemetry, 'commit', len(params)):
+                conn.commit()
+        except Exception:
+            # 汇总表与订单明细必须一起提交，失败时本块的写入一并回滚
+            conn.rollback()
+            raise
+        if delta:
+            apply_daily_sales_delta(delta, version, products.registered)
+
+        success_count += inserted
+        error_count += errors
+        duplicate_count += len(params) - inserted - errors
+
+        if telemetry:
+            telemetry.logger.debug(f'已写入 {start + len(params)}/{len(df)} 行: 新增={success_count}, 重复={duplicate_count}, 错误={error_count}')
+
+    return success_count, duplicate_count, error_count
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+OrderDetails 表结构定义
+订单商品明细导出的业务字段只在这里定义一次，建表脚本（db_init.py）和上传写入共用
+"""
+
+from datetime import datetime
+
+# 业务字段（与订单商品明细导出的列一一对应），列表顺序即建表顺序和插入顺序
+ORDER_DETAILS_COLUMNS = [
+    ('店铺类型', 'TEXT'),
+    ('店铺名称', 'TEXT'),
+    ('分销商名称', 'REAL'),
+    ('单据编号', 'TEXT'),
+    ('订单类型', 'TEXT'),
+    ('拍单时间', 'TEXT'),
+    ('付款时间', 'TEXT'),
+    ('审核时间', 'TEXT'),
+    ('会员代码', 'TEXT'),
+    ('会员名称', 'TEXT'),
+    ('内部便签', 'TEXT'),
+    ('业务员', 'TEXT'),
+    ('建议仓库', 'TEXT'),
+    ('建议快递', 'TEXT'),
+    ('到账', 'TEXT'),
+    ('商品图片', 'TEXT'),
+    ('品牌', 'TEXT'),
+    ('商品税率', 'REAL'),
+    ('商品代码', 'TEXT'),
+    ('商品名称', 'TEXT'),
+    ('商品简称', 'TEXT'),
+    ('规格代码', 'TEXT'),
+    ('规格名称', 'TEXT'),
+    ('商品备注', 'TEXT'),
+    ('代发订单', 'TEXT'),
+    ('订单标记', 'TEXT'),
+    ('预计发货时间', 'TEXT'),
+    ('订购数', 'INTEGER'),
+    ('总重量', 'REAL'),
+    ('折扣', 'REAL'),
+    ('标准进价', 'REAL'),
+    ('标准单价', 'REAL'),
+    ('标准金额', 'REAL'),
+    ('实际单价', 'REAL'),
+    ('实际金额', 'REAL'),
+    ('让利后金额', 'REAL'),
+    ('让利金额', 'REAL'),
+    ('物流费用', 'REAL'),
+    ('成本总价', 'REAL'),
+    ('买家备注', 'TEXT'),
+    ('卖家备注', 'TEXT'),
+    ('制单人', 'TEXT'),
+    ('商品实际利润', 'REAL'),
+    ('商品标准利润', 'REAL'),
+    ('商品已发货数量', 'INTEGER'),
+    ('平台旗帜', 'TEXT'),
+    ('发货时间', 'TEXT'),
+    ('原产地', 'TEXT'),
+    ('平台商品名称', 'TEXT'),
+    ('平台规格名称', 'TEXT'),
+    ('供应商', 'REAL'),
+    ('赠品来源', 'REAL'),
+    ('买家支付金额', 'REAL'),
+    ('平台支付金额', 'REAL'),
+    ('其他服务费', 'REAL'),
+    ('发票种类', 'TEXT'),
+    ('发票抬头类型', 'TEXT'),
+    ('发票类型', 'TEXT'),
+    ('开户行', 'TEXT'),
+    ('账号', 'TEXT'),
+    ('发票电话', 'TEXT'),
+    ('发票地址', 'TEXT'),
+    ('收货邮箱', 'TEXT'),
+    ('周期购商品', 'TEXT'),
+    ('平台单号', 'TEXT'),
+    ('到账时间', 'TEXT'),
+    ('附加信息', 'TEXT'),
+    ('发票抬头', 'TEXT'),
+    ('发票内容', 'TEXT'),
+    ('纳税人识别号', 'TEXT'),
+    ('收货人', 'TEXT'),
+    ('收货人手机', 'TEXT'),
+    ('邮编', 'REAL'),
+    ('收货地址', 'TEXT'),
+    ('商品类别', 'TEXT'),
+    ('二次备注', 'TEXT'),
+    ('商品单位', 'TEXT'),
+    ('币别', 'TEXT'),
+    ('会员邮箱', 'TEXT'),
+    ('订单标签', 'TEXT'),
+    ('平台交易状态', 'TEXT'),
+    ('赠品', 'TEXT'),
+    ('是否退款', 'TEXT'),
+    ('地区信息', 'TEXT'),
+    ('确认收货时间', 'REAL'),
+    ('作废', 'TEXT'),
+]
+
+# 业务字段名列表
+ORDER_DETAILS_COLUMN_NAMES = [name for name, _ in ORDER_DETAILS_COLUMNS]
+
+# 由付款时间派生的查询字段（入库时计算，不参与 record_hash）：
+#   pay_date 付款日期 YYYYMMDD 整数，pay_ts 付款时间的秒级时间戳（按字面时间计算，不做时区转换）
+# 付款时间为空、"NaT" 或无法解析时为 NULL，按日期范围查询只使用这两列
+ORDER_DETAILS_DERIVED_COLUMNS = [
+    ('pay_date', 'INTEGER'),
+    ('pay_ts', 'INTEGER'),
+]
+
+ORDER_DETAILS_DERIVED_COLUMN_NAMES = [name for name, _ in ORDER_DETAILS_DERIVED_COLUMNS]
+
+# 销售渠道（ChannelInfo.id，入库时按店铺类型计算，未匹配任何渠道时为 NULL），见 dbpy/channels.py
+CHANNEL_ID_COLUMN = ('channel_id', 'INTEGER')
+
+# 商品（ProductInfo.id，入库时按商品名称查找，新名称自动登记；商品名称为空时为 NULL），见 dbpy/products.py
+PRODUCT_ID_COLUMN = ('product_id', 'INTEGER')
+
+# 按付款日期范围查询使用的索引
+PAY_DATE_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_pay_date ON OrderDetails(pay_date)'
+
+# 有效订单（排除退款成功、退款中）的筛选条件
+VALID_ORDER_CONDITION = "((是否退款 != '退款成功' AND 是否退款 != '退款中') OR 是否退款 IS NULL)"
+
+# OrderDetails 的索引：统计查询读取每日销售汇总表（dbpy/daily_sales.py），
+# 订单明细只有可用日期列表（DISTINCT pay_date）按索引读取
+ORDER_DETAILS_INDEXES = [
+    PAY_DATE_INDEX_SQL,
+]
+
+
+def pay_date_key(date_str):
+    """
+    把 YYYY-MM-DD 日期字符串转为 pay_date 的整数键（如 '2025-01-31' -> 20250131）
+
+    Raises:
+        ValueError: 日期格式不正确
+    """
+    try:
+        return int(datetime.strptime(date_str.strip(), '%Y-%m-%d').strftime('%Y%m%d'))
+    except (AttributeError, ValueError):
+        raise ValueError(f'日期格式不正确: {date_str}')
+
+
+def format_pay_date(pay_date):
+    """pay_date 整数键转为 YYYY-MM-DD 字符串"""
+    text = str(pay_date)
+    return f'{text[:4]}-{text[4:6]}-{text[6:8]}'
+
+
+def build_order_details_ddl(table_name='OrderDetails'):
+    """生成OrderDetails建表SQL"""
+    business_columns = ',\n'.join(f'        {name} {col_type}' for name, col_type in ORDER_DETAILS_COLUMNS)
+    derived_columns = ',\n'.join(f'        {name} {col_type}' for name, col_type in ORDER_DETAILS_DERIVED_COLUMNS)
+    return f'''
+    CREATE TABLE {table_name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        record_hash TEXT NOT NULL,
+
+{business_columns},
+
+{derived_columns},
+        {CHANNEL_ID_COLUMN[0]} {CHANNEL_ID_COLUMN[1]},
+        {PRODUCT_ID_COLUMN[0]} {PRODUCT_ID_COLUMN[1]},
+
+        创建时间 DATETIME DEFAULT CURRENT_TIMESTAMP,
+
+        UNIQUE(record_hash)
+    );
+    '''
+
+
+def build_order_details_insert_sql(table_name='OrderDetails'):
+    """生成OrderDetails插入SQL（INSERT OR IGNORE，参数顺序：record_hash、业务字段、派生字段、channel_id、product_id、创建时间）"""
+    columns = (['record_hash'] + ORDER_DETAILS_COLUMN_NAMES + ORDER_DETAILS_DERIVED_COLUMN_NAMES
+               + [CHANNEL_ID_COLUMN[0], PRODUCT_ID_COLUMN[0], '创建时间'])
+    placeholders = ', '.join(['?'] * len(columns))
+    return f'INSERT OR IGNORE INTO {table_name} ({", ".join(columns)}) VALUES ({placeholders})'
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+商品维度
+ProductInfo.id 是商品的整数键：订单入库时按商品名称查找 id 写入 OrderDetails.product_id，
+新出现的商品名称自动登记到 ProductInfo（大类和映射为空，在商品管理中设置，或由 init_product_info.py 自动填充）。
+每日销售汇总表和统计查询都按 product_id 关联 ProductInfo，不再按商品名称文本连接。
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils.product_name import extract_alias
+
+# name: 订单中的完整商品名称；alias: 去掉颜色、尺码后的别名；category: CategoryInfo.id；mapped_title: 统计用的商品类型
+CREATE_PRODUCT_INFO_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS ProductInfo (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        alias TEXT,
+        category INTEGER,
+        mapped_title TEXT
+    )
+'''
+
+# 入库时按商品名称查找 id
+PRODUCT_INFO_NAME_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_product_info_name ON ProductInfo(name)'
+
+
+def create_product_info_table(conn):
+    """创建 ProductInfo 表（已存在时只补充名称索引）"""
+    conn.execute(CREATE_PRODUCT_INFO_TABLE_SQL)
+    conn.execute(PRODUCT_INFO_NAME_INDEX_SQL)
+
+
+def _name_key(value):
+    """商品名称的查找键（与写入 TEXT 列后的值一致），空值和空字符串返回 None"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    name = value if isinstance(value, str) else str(value)
+    return name or None
+
+
+class ProductIds:
+    """
+    商品名称 -> ProductInfo.id
+
+    同名的多行取最小的 id。导出文件中不同的商品名称只有几千个，每个值只查找一次。
+    """
+
+    def __init__(self, conn, ids):
+        self.conn = conn
+        self.ids = ids
+        # 本对象登记的商品 {id: 商品名称}
+        self.registered = {}
+
+    @classmethod
+    def load(cls, conn):
+        """从数据库读取当前的商品名称和 id"""
+        rows = conn.execute('SELECT name, MIN(id) FROM ProductInfo WHERE name IS NOT NULL GROUP BY name')
+        return cls(conn, {row[0]: row[1] for row in rows})
+
+    def register(self, names):
+        """
+        登记 ProductInfo 中还没有的商品名称（由调用方提交）
+
+        不更新 DailySalesVersion：新商品没有映射，在写入它的订单、累加汇总表时版本号才随之更新一次，
+        本进程的销售前缀和缓存从 registered 得到新商品的名称。
+
+        Returns:
+            新登记的商品数
+        """
+        missing = list(dict.fromkeys(name for name in names if name not in self.ids))
+        if not missing:
+            return 0
+        cursor = self.conn.cursor()
+        for name in missing:
+            cursor.execute('INSERT INTO ProductInfo (name, alias) VALUES (?, ?)', (name, extract_alias(name)))
+            self.ids[name] = cursor.lastrowid
+            self.registered[cursor.lastrowid] = name
+        return len(missing)
+
+    def id_values(self, values):
+        """
+        一列商品名称映射为 product_id，新出现的名称先登记（由调用方提交）
+
+        Returns:
+            与 values 等长的 object 数组，元素为 int，商品名称为空时为 None
+        """
+        codes, names = pd.factorize(pd.Series(values, dtype=object))
+        keys = [_name_key(name) for name in names]
+        self.register(key for key in keys if key is not None)
+        product_ids = np.array([self.ids.get(key) for key in keys] + [None], dtype=object)
+        # factorize 对空值返回 -1，正好取到末尾的 None
+        return product_ids[codes]
+
+
+def backfill_order_product_ids(conn):
+    """
+    为 OrderDetails 中 product_id 为空的订单登记商品并回填 product_id（由调用方提交）
+
+    Returns:
+        (新登记的商品数, 回填的订单行数)
+    """
+    products = ProductIds.load(conn)
+    names = [row[0] for row in conn.execute('SELECT DISTINCT 商品名称 FROM OrderDetails WHERE product_id IS NULL')]
+    registered = products.register(key for key in map(_name_key, names) if key is not None)
+    cursor = conn.execute('''
+        UPDATE OrderDetails
+        SET product_id = (SELECT MIN(p.id) FROM ProductInfo p WHERE p.name = OrderDetails.商品名称)
+        WHERE product_id IS NULL AND 商品名称 IS NOT NULL AND 商品名称 != ''
+    ''')
+    return registered, cursor.rowcount
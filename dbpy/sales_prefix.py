@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+按 商品类型（ProductInfo.mapped_title）× 渠道 的销量、金额前缀和
+数据分析页按任意日期范围统计各商品类型的销量和金额。每日数值保存在 DailySales 中，这里按商品映射汇总到
+商品类型 × 渠道，再沿日期累加成前缀和数组（NumPy，缓存在进程内，每天一列，第0列为0）：
+[start, end] 的合计为 cum[:, end] - cum[:, start - 1]，所有商品类型一次向量化相减，耗时与日期范围和历史长度无关。
+
+缓存对应 DailySalesVersion 中的版本号：查询时版本号不同（其他进程写入了订单、重建了汇总表或修改了商品映射）则重新读取；
+本进程写入订单后把新增的每日数值直接累加到缓存（早于或晚于已有日期时扩展列），不需要重新读取。
+
+没有映射的商品（入库时自动登记的新商品名称）只用于列出范围内未匹配的商品名称，按 (商品, 有订单的日期) 稀疏记录，
+占用与 DailySales 的行数成正比，不随商品数 × 天数增长。
+"""
+
+import threading
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from dbpy.daily_sales import DAILY_SALES_KEY_COLUMNS, DAILY_SALES_MEASURE_COLUMNS, daily_sales_version
+
+# 日期序号：距 1970-01-01 的天数
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# 前缀和数组的列：每日数值列 -> (数组属性, dtype)
+_PREFIX_ARRAYS = {
+    'quantity': ('cum_quantity', np.int64),
+    'amount': ('cum_amount', np.float64),
+    'line_count': ('cum_lines', np.int64),
+}
+
+# 未映射商品的 (行号, 日期序号) 编码为一个 int64：行号 << 32 | (日期序号 + 2**31)，按编码排序即按商品、日期排序
+_DAY_BITS = 32
+_DAY_OFFSET = 1 << 31
+_DAY_MASK = (1 << _DAY_BITS) - 1
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def day_number(pay_date):
+    """pay_date（YYYYMMDD 整数）转换为日期序号"""
+    pay_date = int(pay_date)
+    return date(pay_date // 10000, pay_date // 100 % 100, pay_date % 100).toordinal() - _EPOCH_ORDINAL
+
+
+def _day_numbers(pay_dates):
+    # 不同的日期只有几千个，每个只转换一次
+    codes, unique_dates = pd.factorize(pay_dates)
+    return np.array([day_number(value) for value in unique_dates], dtype=np.int64)[codes]
+
+
+def _add_to_prefix(cum, rows, cols, values):
+    """把 values 加到 cum 的 (rows, cols) 日期上，并更新这些行之后各列的前缀和"""
+    affected, local_rows = np.unique(rows, return_inverse=True)
+    daily = np.zeros((len(affected), cum.shape[1] - 1), dtype=cum.dtype)
+    np.add.at(daily, (local_rows, cols), values.astype(cum.dtype))
+    cum[affected, 1:] += np.cumsum(daily, axis=1)
+
+
+class SalesPrefixSums:
+    """
+    商品类型 × 渠道 的前缀和，以及未映射商品有有效订单的日期（用于统计未匹配的商品名称）
+
+    第 i 列为 first_day + i - 1 当天及之前的合计（第0列为0）。
+    """
+
+    def __init__(self, version, title_by_id, name_by_id):
+        self.version = version
+        self.title_by_id = title_by_id
+        self.name_by_id = name_by_id
+        self.first_day = None
+        # 商品类型 × 渠道：[(mapped_title, channel_id)]，channel_id 为0表示未匹配任何渠道
+        self.keys = []
+        self._key_rows = {}
+        self.cum_quantity = np.zeros((0, 1), dtype=np.int64)
+        self.cum_amount = np.zeros((0, 1), dtype=np.float64)
+        self.cum_lines = np.zeros((0, 1), dtype=np.int64)
+        # 没有映射的商品：[product_id]，及其有有效订单的 (行号, 日期序号)（编码见 _DAY_BITS，有序、不重复）
+        self.unmatched_ids = []
+        self._unmatched_rows = {}
+        self.unmatched_day_keys = np.zeros(0, dtype=np.int64)
+
+    @property
+    def day_count(self):
+        return self.cum_lines.shape[1] - 1
+
+    @classmethod
+    def load(cls, conn):
+        """从 DailySales 和 ProductInfo 读取（在同一个读事务中读取版本号和数据）"""
+        began = not conn.in_transaction
+        if began:
+            conn.execute('BEGIN')
+        try:
+            version = daily_sales_version(conn)
+            products = conn.execute('SELECT id, name, mapped_title FROM ProductInfo').fetchall()
+            rows = conn.execute('''
+                SELECT pay_date, product_id, channel_id,
+                       SUM(quantity) AS quantity, SUM(amount) AS amount, SUM(line_count) AS line_count
+                FROM DailySales
+                WHERE line_count > 0
+                GROUP BY pay_date, product_id, channel_id
+            ''').fetchall()
+        finally:
+            if began:
+                conn.rollback()
+
+        title_by_id = {row[0]: row[2] for row in products if row[2]}
+        name_by_id = {row[0]: row[1] for row in products}
+        prefix = cls(version, title_by_id, name_by_id)
+        prefix.add_daily_sales(pd.DataFrame(
+            [tuple(row) for row in rows],
+            columns=['pay_date', 'product_id', 'channel_id', 'quantity', 'amount', 'line_count']
+        ))
+        return prefix
+
+    def _extend_days(self, first_day, last_day):
+        """扩展日期列，使 [first_day, last_day] 都在范围内（之前的列为0，之后的列沿用最后的合计）"""
+        if self.first_day is None:
+            self.first_day = first_day
+        before = max(self.first_day - first_day, 0)
+        after = max(last_day - (self.first_day + self.day_count - 1), 0)
+        if before or after:
+            for name, _ in _PREFIX_ARRAYS.values():
+                setattr(self, name, np.pad(getattr(self, name), ((0, 0), (before, after)), mode='edge'))
+            self.first_day -= before
+
+    @staticmethod
+    def _rows_for(keys, row_index, labels):
+        """labels 对应的行号，新出现的标签追加到 keys"""
+        rows = np.empty(len(labels), dtype=np.int64)
+        for i, label in enumerate(labels):
+            row = row_index.get(label)
+            if row is None:
+                row = row_index[label] = len(keys)
+                keys.append(label)
+            rows[i] = row
+        return rows
+
+    def add_daily_sales(self, frame):
+        """
+        累加每日数值
+
+        Args:
+            frame: 包含 pay_date、product_id、channel_id、quantity、amount、line_count 列的 DataFrame
+        """
+        frame = frame[frame['line_count'] > 0]
+        if frame.empty:
+            return
+        days = _day_numbers(frame['pay_date'].to_numpy())
+        self._extend_days(int(days.min()), int(days.max()))
+        cols = days - self.first_day
+
+        titles = frame['product_id'].map(self.title_by_id)
+        mapped = titles.notna().to_numpy()
+
+        if mapped.any():
+            labels = list(zip(titles[mapped], frame['channel_id'][mapped].astype(int)))
+            rows = self._rows_for(self.keys, self._key_rows, labels)
+            self._grow_rows(('cum_quantity', 'cum_amount', 'cum_lines'), len(self.keys))
+            for column, (name, _) in _PREFIX_ARRAYS.items():
+                _add_to_prefix(getattr(self, name), rows, cols[mapped], frame[column].to_numpy()[mapped])
+
+        if not mapped.all():
+            product_ids = list(frame['product_id'][~mapped].astype(int))
+            rows = self._rows_for(self.unmatched_ids, self._unmatched_rows, product_ids)
+            keys = (rows << _DAY_BITS) | (days[~mapped] + _DAY_OFFSET)
+            self.unmatched_day_keys = np.union1d(self.unmatched_day_keys, keys)
+
+    def _grow_rows(self, names, row_count):
+        for name in names:
+            cum = getattr(self, name)
+            if cum.shape[0] < row_count:
+                setattr(self, name, np.pad(cum, ((0, row_count - cum.shape[0]), (0, 0))))
+
+    def _unmatched_rows_in_range(self, start_key, end_key):
+        """[start_key, end_key] 内有有效订单的未映射商品的行号（升序）"""
+        keys = self.unmatched_day_keys
+        if start_key is not None or end_key is not None:
+            days = (keys & _DAY_MASK) - _DAY_OFFSET
+            in_range = np.ones(len(keys), dtype=bool)
+            if start_key is not None:
+                in_range &= days >= day_number(start_key)
+            if end_key is not None:
+                in_range &= days <= day_number(end_key)
+            keys = keys[in_range]
+        return np.unique(keys >> _DAY_BITS)
+
+    def _column_range(self, start_key, end_key):
+        """[start_key, end_key] 对应的前缀和列 (起始列, 结束列)，合计为 cum[:, 结束列] - cum[:, 起始列]"""
+        if self.first_day is None:
+            return 0, 0
+        start = 0 if start_key is None else day_number(start_key) - self.first_day
+        end = self.day_count if end_key is None else day_number(end_key) - self.first_day + 1
+        start = min(max(start, 0), self.day_count)
+        end = min(max(end, start), self.day_count)
+        return start, end
+
+    def range_totals(self, start_key=None, end_key=None):
+        """
+        日期范围内各商品类型 × 渠道的合计
+
+        Args:
+            start_key: 开始日期（pay_date 整数，None 表示不限）
+            end_key: 结束日期（pay_date 整数，None 表示不限）
+
+        Returns:
+            {'keys': [(mapped_title, channel_id)], 'quantity', 'amount', 'line_count': 与 keys 对应的数组,
+             'unmatched_names': 范围内有有效订单、但没有映射的商品名称}
+        """
+        start, end = self._column_range(start_key, end_key)
+        return {
+            'keys': list(self.keys),
+            'quantity': self.cum_quantity[:, end] - self.cum_quantity[:, start],
+            # 前缀和相减的浮点误差舍入到分
+            'amount': np.round(self.cum_amount[:, end] - self.cum_amount[:, start], 2),
+            'line_count': self.cum_lines[:, end] - self.cum_lines[:, start],
+            # product_id 为0（商品名称为空）的订单按空名称统计
+            'unmatched_names': [
+                self.name_by_id.get(self.unmatched_ids[i], '') for i in self._unmatched_rows_in_range(start_key, end_key)
+            ],
+        }
+
+
+def sales_range_totals(conn, start_key=None, end_key=None):
+    """
+    按缓存的前缀和计算日期范围内的合计（版本号与数据库不同时先重新读取），返回值见 SalesPrefixSums.range_totals
+    """
+    global _cache
+    version = daily_sales_version(conn)
+    with _cache_lock:
+        if _cache is None or _cache.version != version:
+            _cache = SalesPrefixSums.load(conn)
+        return _cache.range_totals(start_key, end_key)
+
+
+def apply_daily_sales_delta(rows, version, product_names=None):
+    """
+    本进程写入订单并提交后，把新增的汇总行累加到缓存
+
+    只有缓存恰好是上一个版本时才累加；否则缓存已过期（或尚未读取），下次查询时会重新读取。
+
+    Args:
+        rows: add_orders_to_daily_sales 返回的汇总行
+        version: 写入后的版本号
+        product_names: 写入时新登记的商品 {product_id: 商品名称}（登记商品不更新版本号，
+                       新商品没有映射，缓存只需要补充名称）
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.version != version - 1:
+            return
+        try:
+            if product_names:
+                _cache.name_by_id.update(product_names)
+            _cache.add_daily_sales(pd.DataFrame(rows, columns=DAILY_SALES_KEY_COLUMNS + DAILY_SALES_MEASURE_COLUMNS))
+            _cache.version = version
+        except Exception as e:
+            print(f'更新销售前缀和缓存失败，下次查询时重新读取: {e}')
+            _cache = None
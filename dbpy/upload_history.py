@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+上传历史
+按上传文件内容的 SHA-256 指纹记录已成功导入的订单文件和导入结果，
+再次上传内容完全相同的文件时直接返回上次的结果，不重新解析和写入。
+"""
+
+import json
+from datetime import datetime
+
+from dbpy.database import get_db_connection
+
+CREATE_UPLOAD_HISTORY_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS UploadHistory (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fingerprint TEXT NOT NULL,
+        job_type TEXT NOT NULL,
+        filename TEXT,
+        file_size INTEGER,
+        row_count INTEGER,
+        success_count INTEGER,
+        duplicate_count INTEGER,
+        result TEXT,
+        job_id TEXT,
+        username TEXT,
+        created_at DATETIME,
+        UNIQUE(fingerprint, job_type)
+    )
+'''
+
+# 结果中只与当次执行有关、不需要保存的字段
+_TRANSIENT_RESULT_KEYS = ('debug_log', 'stages')
+
+
+def find_upload_history(fingerprint, job_type):
+    """
+    查询内容相同的文件是否已成功导入过
+
+    Returns:
+        上传历史字典（result 已解析为字典），没有记录时返回None
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            'SELECT * FROM UploadHistory WHERE fingerprint = ? AND job_type = ?', (fingerprint, job_type)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    history = dict(row)
+    history['result'] = json.loads(history['result']) if history['result'] else {}
+    return history
+
+
+def record_upload_history(fingerprint, job_type, filename, file_size, result, job_id=None, username=None):
+    """
+    记录一次成功导入（同一指纹已有记录时保留首次导入的结果）
+
+    Args:
+        fingerprint: 文件内容的 SHA-256
+        job_type: 任务类型
+        filename: 原始文件名
+        file_size: 文件字节数
+        result: 上传结果字典
+        job_id: 导入任务ID
+        username: 上传用户
+    """
+    saved_result = {key: value for key, value in result.items() if key not in _TRANSIENT_RESULT_KEYS}
+    conn = get_db_connection()
+    try:
+        conn.execute('''
+            INSERT OR IGNORE INTO UploadHistory (fingerprint, job_type, filename, file_size, row_count,
+                                                 success_count, duplicate_count, result, job_id, username, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (fingerprint, job_type, filename, file_size, result.get('total'), result.get('success_count'),
+              result.get('duplicate_count'), json.dumps(saved_result, ensure_ascii=False, default=str),
+              job_id, username, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+    finally:
+        conn.close()
@@ -537,9 +537,6 @@ function setupFileUpload() {
  * 处理文件上传
  */
 async function handleFileUpload(file) {
-    const formData = new FormData();
-    formData.append('file', file);
-
     try {
         const token = getToken();
         const headers = {};
@@ -556,10 +553,12 @@ async function handleFileUpload(file) {
             headers['X-CSRFToken'] = csrfToken;
         }
 
-        const response = await fetch('/api/analyse/upload', {
-            method: 'POST',
-            headers: headers,
-            body: formData
+        // 分块上传（大文件中断后重新选择同一文件可从中断处继续）
+        const response = await uploadFileInChunks(file, 'analyse', headers, (message) => {
+            const uploadResult = document.getElementById('uploadResult');
+            uploadResult.style.display = 'block';
+            uploadResult.style.color = '#666';
+            uploadResult.querySelector('p').textContent = message;
         });
 
         // 检查是否需要重新登录
@@ -573,12 +572,36 @@ async function handleFileUpload(file) {
             return;
         }
 
-        const result = await response.json();
+        let result = await response.json();
+        let ok = response.ok;
 
-        if (response.ok) {
+        // 文件已登记为后台任务，轮询任务状态直到完成
+        if (response.status === 202) {
             const uploadResult = document.getElementById('uploadResult');
             uploadResult.style.display = 'block';
-            const message = `上传完成！总计 ${result.total} 条，成功 ${result.success_count} 条，重复 ${result.duplicate_count} 条，错误 ${result.error_count} 条`;
+            uploadResult.style.color = '#666';
+            uploadResult.querySelector('p').textContent = result.attached
+                ? '相同内容的文件正在处理中，等待处理结果...'
+                : '文件已上传，排队等待处理...';
+            const job = await pollIngestJob(result.job_id, headers, (message) => {
+                uploadResult.querySelector('p').textContent = message;
+            });
+            if (!job) {
+                return;
+            }
+            ok = job.status === 'succeeded';
+            result = ok ? job.result : { error: job.error };
+        }
+
+        if (ok) {
+            const uploadResult = document.getElementById('uploadResult');
+            uploadResult.style.display = 'block';
+            let message = `上传完成！总计 ${result.total} 条，成功 ${result.success_count} 条，重复 ${result.duplicate_count} 条，错误 ${result.error_count} 条`;
+            // 内容完全相同的文件已导入过，服务端直接返回上次的结果
+            if (result.cached) {
+                message = `该文件与 ${result.uploaded_at} 上传的 ${result.original_filename} 内容相同，已导入过，未重复处理。` +
+                          `上次结果：总计 ${result.total} 条，成功 ${result.success_count} 条，重复 ${result.duplicate_count} 条`;
+            }
             uploadResult.querySelector('p').textContent = message;
             
             // 根据错误数量设置颜色：有错误时显示红色，否则显示绿色
@@ -621,6 +644,170 @@ async function handleFileUpload(file) {
     }
 }
 
+/**
+ * 发送请求，网络中断、请求过于频繁（429）或服务器错误（5xx）时等待后重试
+ * @param {string} url - 请求地址
+ * @param {Object} options - fetch 参数
+ * @param {number} retries - 最多重试次数
+ * @returns {Response} 最后一次请求的响应
+ */
+async function fetchWithRetry(url, options, retries = 5) {
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const response = await fetch(url, options);
+            if ((response.status === 429 || response.status >= 500) && attempt < retries) {
+                await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+                continue;
+            }
+            return response;
+        } catch (error) {
+            if (attempt >= retries) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+        }
+    }
+}
+
+/**
+ * 分块上传文件（可续传）：登记上传后按顺序逐块上传，最后通知服务端交给后台任务
+ * 上传ID按文件名、大小和修改时间保存在 localStorage 中，中断后重新选择同一文件时从服务端已收到的下一块继续
+ * @param {File} file - 要上传的文件
+ * @param {string} target - 上传目标（analyse / database / inventory）
+ * @param {Object} headers - 请求头（包含认证信息和CSRF token）
+ * @param {Function} onProgress - 进度回调，参数为进度提示文字
+ * @returns {Response} 完成接口的响应（与普通上传接口相同：202 任务ID 或 200 上传结果）；中途出错时为出错请求的响应
+ */
+async function uploadFileInChunks(file, target, headers, onProgress) {
+    const resumeKey = `chunkedUpload:${target}:${file.name}:${file.size}:${file.lastModified}`;
+    let upload = null;
+
+    // 同一文件上次未上传完成时查询已收到的块数
+    const savedUploadId = localStorage.getItem(resumeKey);
+    if (savedUploadId) {
+        const response = await fetchWithRetry(`/api/uploads/${savedUploadId}`, { headers: headers });
+        if (response.status === 401) {
+            return response;
+        }
+        if (response.ok) {
+            upload = await response.json();
+        } else {
+            localStorage.removeItem(resumeKey);
+        }
+    }
+
+    if (!upload) {
+        const response = await fetchWithRetry('/api/uploads', {
+            method: 'POST',
+            headers: { ...headers, 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, target: target })
+        });
+        if (!response.ok) {
+            return response;
+        }
+        upload = await response.json();
+        localStorage.setItem(resumeKey, upload.upload_id);
+    } else if (upload.received_chunks > 0) {
+        onProgress(`继续上次中断的上传：已上传 ${upload.received_chunks}/${upload.total_chunks} 块`);
+    }
+
+    for (let chunkNo = upload.received_chunks; chunkNo < upload.total_chunks; chunkNo++) {
+        const start = chunkNo * upload.chunk_size;
+        const end = Math.min(start + upload.chunk_size, file.size);
+        onProgress(`正在上传文件：${Math.floor(start * 100 / file.size)}%（第 ${chunkNo + 1}/${upload.total_chunks} 块）`);
+
+        let response;
+        try {
+            response = await fetchWithRetry(`/api/uploads/${upload.upload_id}/chunks/${chunkNo}`, {
+                method: 'PUT',
+                headers: { ...headers, 'Content-Type': 'application/octet-stream' },
+                body: file.slice(start, end)
+            });
+        } catch (error) {
+            throw new Error('网络中断，重新选择同一文件可从中断处继续上传');
+        }
+        if (!response.ok) {
+            return response;
+        }
+    }
+
+    onProgress('文件上传完成，正在登记处理任务...');
+    const response = await fetchWithRetry(`/api/uploads/${upload.upload_id}/complete`, {
+        method: 'POST',
+        headers: headers
+    });
+    // 409 表示服务端还缺少部分块，保留上传ID以便继续上传
+    if (response.status !== 409) {
+        localStorage.removeItem(resumeKey);
+    }
+    return response;
+}
+
+/**
+ * 轮询后台上传任务，直到任务成功或失败
+ * @param {string} jobId - 上传接口返回的任务ID
+ * @param {Object} headers - 请求头（包含认证信息）
+ * @param {Function} onProgress - 进度回调，参数为进度提示文字
+ * @returns {Object|null} 任务信息（status、result、error 等），需要重新登录时返回 null
+ */
+async function pollIngestJob(jobId, headers, onProgress) {
+    const stageNames = {
+        parse: '解析校验',
+        validate: '解析校验',
+        classify: '检查重复',
+        database: '写入数据库'
+    };
+
+    while (true) {
+        // 接口限流为每秒1次，每2秒查询一次
+        await new Promise(resolve => setTimeout(resolve, 2000));
+
+        const response = await fetch(`/api/jobs/${jobId}`, { headers: headers });
+
+        if (response.status === 401) {
+            localStorage.removeItem('token');
+            localStorage.removeItem('user');
+            sessionStorage.removeItem('token');
+            sessionStorage.removeItem('user');
+            window.location.href = '/login';
+            return null;
+        }
+
+        // 请求过于频繁时等待下一次轮询
+        if (response.status === 429) {
+            continue;
+        }
+
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.error || '查询上传任务失败');
+        }
+
+        if (job.status === 'succeeded' || job.status === 'failed') {
+            return job;
+        }
+
+        if (job.status === 'queued') {
+            onProgress('文件已上传，排队等待处理...');
+        } else {
+            const stage = stageNames[job.stage] || '处理';
+            let message = `正在${stage}：已处理 ${job.rows_processed || 0}`;
+            if (job.rows_total) {
+                message += ` / ${job.rows_total}`;
+            }
+            message += ' 行';
+            if (job.rows_per_sec) {
+                message += `（${job.rows_per_sec} 行/秒）`;
+            }
+            // 写入前已完成重复预分类，显示将新增和已存在的记录数
+            if (job.summary) {
+                message += `，新记录 ${job.summary.new_count} 条，已存在 ${job.summary.duplicate_count} 条`;
+            }
+            onProgress(message);
+        }
+    }
+}
+
 // ==================== 日期选择器相关（仅 PC 端） ====================
 
 /**
@@ -878,9 +1065,6 @@ function setupInventoryFileUpload() {
  * 处理库存文件上传
  */
 async function handleInventoryFileUpload(file) {
-    const formData = new FormData();
-    formData.append('file', file);
-
     try {
         const token = getToken();
         const headers = {};
@@ -903,10 +1087,9 @@ async function handleInventoryFileUpload(file) {
             headers['X-CSRFToken'] = csrfToken;
         }
 
-        const response = await fetch('/api/upload/inventory', {
-            method: 'POST',
-            headers: headers,
-            body: formData
+        // 分块上传（大文件中断后重新选择同一文件可从中断处继续）
+        const response = await uploadFileInChunks(file, 'inventory', headers, (message) => {
+            uploadResult.querySelector('p').textContent = message;
         });
 
         // 检查是否需要重新登录
@@ -920,9 +1103,25 @@ async function handleInventoryFileUpload(file) {
             return;
         }
 
-        const result = await response.json();
+        let result = await response.json();
+        let ok = response.ok;
+
+        // 文件已登记为后台任务，轮询任务状态直到完成
+        if (response.status === 202) {
+            uploadResult.querySelector('p').textContent = result.attached
+                ? '相同内容的文件正在处理中，等待处理结果...'
+                : '文件已上传，排队等待处理...';
+            const job = await pollIngestJob(result.job_id, headers, (message) => {
+                uploadResult.querySelector('p').textContent = message;
+            });
+            if (!job) {
+                return;
+            }
+            ok = job.status === 'succeeded';
+            result = ok ? job.result : { error: job.error };
+        }
 
-        if (response.ok) {
+        if (ok) {
             let message = `上传完成！ 文件总行数: ${result.total} 新增记录: ${result.inserted} 更新记录: ${result.updated} 失败记录: ${result.failed}`;
             
             uploadResult.querySelector('p').textContent = message;
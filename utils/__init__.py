@@ -2,6 +2,7 @@
 # Utils package
 
 # 从 utils_common 导入函数以保持兼容性
-from utils_common import normalize_product_name, register_chinese_font
+from utils_common import register_chinese_font
+from utils.product_name import normalize_product_name, normalize_series
 
-__all__ = ['normalize_product_name', 'register_chinese_font']
\ No newline at end of file
+__all__ = ['normalize_product_name', 'normalize_series', 'register_chinese_font']
\ No newline at end of file
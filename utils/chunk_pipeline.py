@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+分块处理流水线
+读取线程逐块读取数据，线程池并行执行每块的转换（如日期格式化、计算记录哈希），
+调用方所在的线程按原顺序取出结果并写入数据库（SQLite 只有一个写入者）。
+各阶段之间是有界队列：写入跟不上时读取线程阻塞，内存中最多只有 max_pending 块数据，
+总耗时接近最慢的一个阶段，而不是各阶段耗时之和。
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 并行转换数据块的线程数，0 表示不使用流水线、在调用方线程中逐块处理
+# （默认2；单核机器上各阶段无法并行，默认0）
+PIPELINE_WORKERS = int(os.environ.get('INGEST_PIPELINE_WORKERS', min(2, (os.cpu_count() or 1) - 1)))
+
+# 已读取但尚未被写入线程取走的数据块上限（默认为转换线程数的两倍）
+PIPELINE_MAX_PENDING = int(os.environ.get('INGEST_PIPELINE_MAX_PENDING', 0)) or max(2, PIPELINE_WORKERS * 2)
+
+_END = object()
+
+
+class _ReaderError:
+    """读取线程中的异常，由写入线程取出后重新抛出"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def pipelined(chunks, transform, workers=None, max_pending=None):
+    """
+    按原顺序返回 transform(chunk) 的结果，读取、转换与调用方的处理（写入）互相重叠
+
+    结果按块的顺序返回，依赖顺序的处理（文件内去重、块号）仍在调用方线程中执行。
+    调用方提前结束迭代（break、异常）时，读取线程停止，未开始的转换被取消。
+
+    Args:
+        chunks: 数据块的可迭代对象（在读取线程中迭代）
+        transform: 转换函数 transform(chunk)，在线程池中执行，需要只修改传入的数据块
+        workers: 转换线程数，默认 PIPELINE_WORKERS；为 0 时不使用线程，逐块顺序处理
+        max_pending: 读取后尚未取走的数据块上限，默认 PIPELINE_MAX_PENDING
+
+    Yields:
+        各块的转换结果
+    """
+    workers = PIPELINE_WORKERS if workers is None else workers
+    if workers <= 0:
+        for chunk in chunks:
+            yield transform(chunk)
+        return
+
+    max_pending = max_pending or PIPELINE_MAX_PENDING
+    pending = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest-transform')
+
+    def put(item):
+        # 队列满时等待写入线程取走数据（背压），写入线程已退出时放弃
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for chunk in chunks:
+                if not put(executor.submit(transform, chunk)):
+                    return
+        except Exception as e:
+            put(_ReaderError(e))
+            return
+        finally:
+            # 生成器（如 ExcelChunkReader.iter_chunks）需要在迭代它的线程中关闭
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+        put(_END)
+
+    reader = threading.Thread(target=read, name='ingest-reader', daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is _END:
+                return
+            if isinstance(item, _ReaderError):
+                raise item.error
+            yield item.result()
+    finally:
+        stop.set()
+        # 取出队列中剩余的任务，使读取线程不再阻塞
+        while True:
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                break
+            if not isinstance(item, _ReaderError) and item is not _END:
+                item.cancel()
+        reader.join()
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -4,10 +4,138 @@
 用于验证上传的Excel和CSV文件格式
 """
 
+import numpy as np
 import pandas as pd
 import os
+import warnings
 from typing import Dict, List, Tuple, Optional
 
+from utils.streaming_reader import detect_csv_encoding, iter_csv_chunks, read_excel_columns
+
+# 默认的电商订单必需列
+EXCEL_REQUIRED_COLUMNS = ['商品名称', '订购数', '付款时间', '店铺类型', '让利后金额']
+
+# 默认的库存必需列
+CSV_REQUIRED_COLUMNS = ['商品名称', '仓库', '数量', '可销数']
+
+# 每条校验规则最多列出的出错行数（其余只计数）
+MAX_ERROR_ROWS_PER_RULE = 20
+
+# 订单导出文件中付款时间的格式，不符合时再按其它日期格式解析
+PAY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class ValidationErrors:
+    """
+    按规则汇总的数据格式错误
+    
+    每条规则只记录出错总行数和前 MAX_ERROR_ROWS_PER_RULE 个出错行，
+    错误很多的大文件也不会生成海量错误信息。
+    """
+    
+    def __init__(self, max_rows: int = MAX_ERROR_ROWS_PER_RULE):
+        self.max_rows = max_rows
+        # 规则 -> {'count': 出错行数, 'rows': [(行号, 值), ...], 'show_value': 是否显示值}
+        self.rules = {}
+    
+    def add(self, rule: str, mask, values: pd.Series, row_offset: int = 0, show_value: bool = True):
+        """
+        记录一条规则在一块数据中的出错行
+        
+        Args:
+            rule: 规则描述，如 "订购数格式不正确"
+            mask: 出错行的布尔掩码（与 values 等长）
+            values: 被检查的列，用于显示出错的值
+            row_offset: 本块第一行之前的数据行数
+            show_value: 错误信息中是否显示出错的值
+        """
+        positions = np.flatnonzero(np.asarray(mask, dtype=bool))
+        if len(positions) == 0:
+            return
+        
+        entry = self.rules.setdefault(rule, {'count': 0, 'rows': [], 'show_value': show_value})
+        entry['count'] += len(positions)
+        
+        room = self.max_rows - len(entry['rows'])
+        if room > 0:
+            for pos in positions[:room]:
+                # 文件行号 = 数据行号 + 表头1行 + 从1开始计数
+                entry['rows'].append((row_offset + int(pos) + 2, values.iloc[pos]))
+    
+    def __len__(self):
+        return sum(entry['count'] for entry in self.rules.values())
+    
+    def format_lines(self) -> List[str]:
+        """生成错误信息（每行一条）"""
+        lines = []
+        for rule, entry in self.rules.items():
+            for row, value in entry['rows']:
+                lines.append(f"第{row}行{rule}: {value}" if entry['show_value'] else f"第{row}行{rule}")
+            if entry['count'] > len(entry['rows']):
+                lines.append(f"{rule}共 {entry['count']} 行，仅列出前 {len(entry['rows'])} 行")
+        return lines
+    
+    def format_message(self) -> str:
+        """生成返回给前端的错误信息"""
+        return "数据格式错误:\n" + "\n".join(self.format_lines())
+
+
+def invalid_number_mask(series: pd.Series) -> np.ndarray:
+    """非空但无法转换为数值的单元格（空值不算错误）"""
+    if pd.api.types.is_numeric_dtype(series):
+        return np.zeros(len(series), dtype=bool)
+    numbers = pd.to_numeric(series, errors='coerce')
+    return (numbers.isna() & series.notna()).to_numpy()
+
+
+def invalid_integer_mask(series: pd.Series) -> np.ndarray:
+    """空值或无法转换为整数的单元格"""
+    if pd.api.types.is_integer_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return np.zeros(len(series), dtype=bool)
+    if pd.api.types.is_float_dtype(series):
+        # CSV 中有空单元格时整列被读成浮点数
+        return ~np.isfinite(series.to_numpy())
+    text = series.astype(str).str.strip()
+    return (series.isna() | ~text.str.fullmatch(r'[+-]?\d+')).to_numpy()
+
+
+def blank_mask(series: pd.Series) -> np.ndarray:
+    """空值或只含空白字符的单元格"""
+    return (series.isna() | series.astype(str).str.strip().eq('')).to_numpy()
+
+
+def invalid_datetime_mask(series: pd.Series) -> np.ndarray:
+    """非空但无法解析为日期时间的单元格（空值和空字符串不算错误）"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return np.zeros(len(series), dtype=bool)
+    
+    present = (series.notna() & series.ne('')).to_numpy()
+    values = series[present]
+    parsed = pd.to_datetime(values, errors='coerce', format=PAY_TIME_FORMAT)
+    retry = parsed.isna().to_numpy()
+    if retry.any():
+        # 不是标准格式的单元格再逐个推断格式
+        others = values[retry]
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                failed = pd.to_datetime(others, errors='coerce', format='mixed').isna().to_numpy()
+        except (ValueError, TypeError):
+            failed = np.array([_unparseable_datetime(value) for value in others], dtype=bool)
+        retry[retry] = failed
+    
+    mask = np.zeros(len(series), dtype=bool)
+    mask[present] = retry
+    return mask
+
+
+def _unparseable_datetime(value) -> bool:
+    try:
+        pd.to_datetime(value)
+        return False
+    except Exception:
+        return True
+
 
 class FileValidator:
     """文件格式验证器"""
@@ -32,59 +160,153 @@ class FileValidator:
             # 读取Excel文件
             df = pd.read_excel(file_path)
             
-            if df.empty:
-                return False, "Excel文件为空", None
-            
-            # 如果没有指定必需列，则使用默认的电商订单列
-            if required_columns is None:
-                required_columns = ['商品名称', '订购数', '付款时间', '店铺类型', '让利后金额']
+            is_valid, msg = FileValidator.validate_excel_dataframe(df, required_columns)
+            if not is_valid:
+                return False, msg, None
             
-            # 检查必需列是否存在
-            missing_columns = []
-            for col in required_columns:
-                if col not in df.columns:
-                    missing_columns.append(col)
-            
-            if missing_columns:
-                return False, f"Excel文件缺少必需列: {', '.join(missing_columns)}", None
+            return True, msg, df
             
-            # 验证数据类型和格式
-            errors = []
-            
-            # 检查订购数列是否为数值类型
-            if '订购数' in df.columns:
-                for idx, value in enumerate(df['订购数']):
-                    try:
-                        float(value)
-                    except (ValueError, TypeError):
-                        errors.append(f"第{idx + 2}行订购数格式不正确: {value}")
-            
-            # 检查让利后金额列是否为数值类型
-            if '让利后金额' in df.columns:
-                for idx, value in enumerate(df['让利后金额']):
-                    try:
-                        float(value)
-                    except (ValueError, TypeError):
-                        errors.append(f"第{idx + 2}行让利后金额格式不正确: {value}")
-            
-            # 检查付款时间列格式
-            if '付款时间' in df.columns:
-                for idx, value in enumerate(df['付款时间']):
-                    # 付款时间允许为空，所以跳过空值检查
-                    if pd.notna(value) and value != '':
-                        # 如果有值，则进行格式验证
-                        try:
-                            pd.to_datetime(value)
-                        except:
-                            errors.append(f"第{idx + 2}行付款时间格式不正确: {value}")
+        except Exception as e:
+            return False, f"读取Excel文件失败: {str(e)}", None
+    
+    @staticmethod
+    def validate_excel_dataframe(df: pd.DataFrame, required_columns: List[str] = None) -> Tuple[bool, str]:
+        """
+        验证已解析的Excel数据（不重复读取文件）
+        
+        Args:
+            df: 已读取的数据框
+            required_columns: 必需的列名列表
             
-            if errors:
-                return False, "数据格式错误:\n" + "\n".join(errors), None
+        Returns:
+            (是否有效, 错误信息)
+        """
+        if df is None or df.empty:
+            return False, "Excel文件为空"
+        
+        # 如果没有指定必需列，则使用默认的电商订单列
+        if required_columns is None:
+            required_columns = EXCEL_REQUIRED_COLUMNS
+        
+        # 检查必需列是否存在
+        missing_columns = FileValidator.find_missing_columns(df.columns, required_columns)
+        if missing_columns:
+            return False, f"Excel文件缺少必需列: {', '.join(missing_columns)}"
+        
+        # 验证数据类型和格式
+        errors = FileValidator.collect_excel_errors(df)
+        if errors:
+            return False, errors.format_message()
+        
+        return True, "Excel文件格式验证通过"
+    
+    @staticmethod
+    def validate_excel_stream(reader, required_columns: List[str] = None) -> Tuple[bool, str]:
+        """
+        流式读取并逐块验证Excel文件（ExcelChunkReader 的第一遍读取）
+        
+        Args:
+            reader: utils.streaming_reader.ExcelChunkReader 实例
+            required_columns: 必需的列名列表
             
-            return True, "Excel文件格式验证通过", df
+        Returns:
+            (是否有效, 错误信息)
+        """
+        if required_columns is None:
+            required_columns = EXCEL_REQUIRED_COLUMNS
+        
+        missing_columns = []
+        errors = ValidationErrors()
+        
+        def check_chunk(df, row_offset):
+            # 列名在每块中都相同，只在第一块检查；缺少必需列时停止读取
+            if row_offset == 0:
+                missing_columns.extend(FileValidator.find_missing_columns(df.columns, required_columns))
+                if missing_columns:
+                    return False
+            FileValidator.collect_excel_errors(df, row_offset, errors)
+        
+        try:
+            row_count = reader.scan(check_chunk)
+        except Exception as e:
+            return False, f"读取Excel文件失败: {str(e)}"
+        
+        if missing_columns:
+            return False, f"Excel文件缺少必需列: {', '.join(missing_columns)}"
+        if row_count == 0:
+            return False, "Excel文件为空"
+        if errors:
+            return False, errors.format_message()
+        
+        return True, "Excel文件格式验证通过"
+    
+    @staticmethod
+    def read_excel_columns(file_path, columns: List[str], dtype: Dict = None,
+                           fmt: str = None) -> Tuple[bool, str, Optional[pd.DataFrame]]:
+        """
+        只读取并逐块验证需要的几列（单遍读取，用于只需少数列的快速分析）
+        
+        Args:
+            file_path: Excel文件路径
+            columns: 需要的列名列表（都是必需列）
+            dtype: 可选，列名到类型的映射
+            fmt: 'csv'、'ndjson' 或 None（按扩展名读取 Excel）
             
+        Returns:
+            (是否有效, 错误信息, 数据框)
+        """
+        errors = ValidationErrors()
+        
+        def check_chunk(df, row_offset):
+            FileValidator.collect_excel_errors(df, row_offset, errors)
+        
+        try:
+            df = read_excel_columns(file_path, columns, dtype=dtype, fmt=fmt, on_chunk=check_chunk)
         except Exception as e:
             return False, f"读取Excel文件失败: {str(e)}", None
+        
+        missing_columns = FileValidator.find_missing_columns(df.columns, columns)
+        if missing_columns:
+            return False, f"Excel文件缺少必需列: {', '.join(missing_columns)}", None
+        if df.empty:
+            return False, "Excel文件为空", None
+        if errors:
+            return False, errors.format_message(), None
+        
+        return True, "Excel文件格式验证通过", df
+    
+    @staticmethod
+    def find_missing_columns(columns, required_columns: List[str]) -> List[str]:
+        """返回 columns 中缺少的必需列"""
+        return [col for col in required_columns if col not in columns]
+    
+    @staticmethod
+    def collect_excel_errors(df: pd.DataFrame, row_offset: int = 0,
+                             errors: 'ValidationErrors' = None) -> 'ValidationErrors':
+        """
+        检查订单数据的字段格式（按列整体检查）
+        
+        Args:
+            df: 数据框（可以是分块读取的一块）
+            row_offset: 本块第一行之前的数据行数，用于报告在文件中的行号
+            errors: 分块检查时累积错误的 ValidationErrors，为空时新建
+            
+        Returns:
+            ValidationErrors
+        """
+        if errors is None:
+            errors = ValidationErrors()
+        
+        # 检查订购数、让利后金额列是否为数值类型
+        for column in ('订购数', '让利后金额'):
+            if column in df.columns:
+                errors.add(f"{column}格式不正确", invalid_number_mask(df[column]), df[column], row_offset)
+        
+        # 检查付款时间列格式（付款时间允许为空）
+        if '付款时间' in df.columns:
+            errors.add("付款时间格式不正确", invalid_datetime_mask(df['付款时间']), df['付款时间'], row_offset)
+        
+        return errors
     
     @staticmethod
     def validate_csv_format(file_input, required_columns: List[str] = None) -> Tuple[bool, str, Optional[pd.DataFrame]]:
@@ -164,49 +386,17 @@ class FileValidator:
             
             # 如果没有指定必需列，则使用默认的库存列
             if required_columns is None:
-                required_columns = ['商品名称', '仓库', '数量', '可销数']
+                required_columns = CSV_REQUIRED_COLUMNS
             
             # 检查必需列是否存在
-            missing_columns = []
-            for col in required_columns:
-                if col not in df.columns:
-                    missing_columns.append(col)
-            
+            missing_columns = FileValidator.find_missing_columns(df.columns, required_columns)
             if missing_columns:
                 return False, f"CSV文件缺少必需列: {', '.join(missing_columns)}", None
             
             # 验证数据类型和格式
-            errors = []
-            
-            # 检查数量列是否为数值类型
-            if '数量' in df.columns:
-                for idx, value in enumerate(df['数量']):
-                    try:
-                        int(value)
-                    except (ValueError, TypeError):
-                        errors.append(f"第{idx + 2}行数量格式不正确: {value}")
-            
-            # 检查可销数列是否为数值类型
-            if '可销数' in df.columns:
-                for idx, value in enumerate(df['可销数']):
-                    try:
-                        int(value)
-                    except (ValueError, TypeError):
-                        errors.append(f"第{idx + 2}行可销数格式不正确: {value}")
-            
-            # 检查商品名称和仓库不能为空
-            if '商品名称' in df.columns:
-                for idx, value in enumerate(df['商品名称']):
-                    if pd.isna(value) or str(value).strip() == '':
-                        errors.append(f"第{idx + 2}行商品名称不能为空")
-            
-            if '仓库' in df.columns:
-                for idx, value in enumerate(df['仓库']):
-                    if pd.isna(value) or str(value).strip() == '':
-                        errors.append(f"第{idx + 2}行仓库不能为空")
-            
+            errors = FileValidator.collect_csv_errors(df)
             if errors:
-                return False, "数据格式错误:\n" + "\n".join(errors), None
+                return False, errors.format_message(), None
             
             # 重置文件指针（如果是文件对象），以便后续处理
             if is_file_object and hasattr(file_input, 'seek'):
@@ -217,6 +407,97 @@ class FileValidator:
         except Exception as e:
             return False, f"读取CSV文件失败: {str(e)}", None
 
+    @staticmethod
+    def validate_csv_stream(file_input, required_columns: List[str] = None, chunk_rows: int = None,
+                            progress=None) -> Tuple[bool, str, Optional[Dict]]:
+        """
+        分块读取并验证CSV文件（不把整个文件载入内存）
+        
+        Args:
+            file_input: CSV文件路径（字符串）或文件对象
+            required_columns: 必需的列名列表
+            chunk_rows: 每块行数
+            progress: 可选回调 progress(已验证行数)，每块调用一次
+            
+        Returns:
+            (是否有效, 错误信息, 文件信息)，文件信息包含 encoding、total_rows、columns、unique_keys
+        """
+        filename = file_input if isinstance(file_input, str) else str(getattr(file_input, 'filename', ''))
+        if not filename.lower().endswith('.csv'):
+            return False, "文件格式不正确，请上传CSV文件(.csv)", None
+        
+        if required_columns is None:
+            required_columns = CSV_REQUIRED_COLUMNS
+        
+        try:
+            used_encoding = detect_csv_encoding(file_input)
+            if used_encoding is None:
+                return False, f"无法读取CSV文件，不支持的编码格式", None
+            
+            total_rows = 0
+            columns = []
+            errors = ValidationErrors()
+            # 商品名称+仓库的唯一组合，用于统计
+            unique_keys = set()
+            for chunk, row_offset in iter_csv_chunks(file_input, used_encoding, chunk_rows):
+                if row_offset == 0:
+                    columns = chunk.columns.tolist()
+                    missing_columns = FileValidator.find_missing_columns(columns, required_columns)
+                    if missing_columns:
+                        return False, f"CSV文件缺少必需列: {', '.join(missing_columns)}", None
+                FileValidator.collect_csv_errors(chunk, row_offset, errors)
+                if '商品名称' in chunk.columns and '仓库' in chunk.columns:
+                    unique_keys.update(zip(chunk['商品名称'], chunk['仓库']))
+                total_rows += len(chunk)
+                if progress:
+                    progress(total_rows)
+            
+            if total_rows == 0:
+                return False, "CSV文件为空", None
+            
+            if errors:
+                return False, errors.format_message(), None
+            
+            info = {
+                'encoding': used_encoding,
+                'total_rows': total_rows,
+                'columns': columns,
+                'unique_keys': len(unique_keys)
+            }
+            return True, f"CSV文件格式验证通过 (编码: {used_encoding})", info
+            
+        except Exception as e:
+            return False, f"读取CSV文件失败: {str(e)}", None
+    
+    @staticmethod
+    def collect_csv_errors(df: pd.DataFrame, row_offset: int = 0,
+                           errors: 'ValidationErrors' = None) -> 'ValidationErrors':
+        """
+        检查库存数据的字段格式（按列整体检查）
+        
+        Args:
+            df: 数据框（可以是分块读取的一块）
+            row_offset: 本块第一行之前的数据行数，用于报告在文件中的行号
+            errors: 分块检查时累积错误的 ValidationErrors，为空时新建
+            
+        Returns:
+            ValidationErrors
+        """
+        if errors is None:
+            errors = ValidationErrors()
+        
+        # 检查数量、可销数列是否为整数
+        for column in ('数量', '可销数'):
+            if column in df.columns:
+                errors.add(f"{column}格式不正确", invalid_integer_mask(df[column]), df[column], row_offset)
+        
+        # 检查商品名称和仓库不能为空
+        for column in ('商品名称', '仓库'):
+            if column in df.columns:
+                errors.add(f"{column}不能为空", blank_mask(df[column]), df[column], row_offset, show_value=False)
+        
+        return errors
+    
     @staticmethod
     def validate_file_extension(file_path: str, allowed_extensions: List[str]) -> Tuple[bool, str]:
         """
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+后台上传任务队列
+上传接口只保存文件并登记任务，解析和入库在有界的后台线程池中执行；
+任务状态保存在 IngestJob 表中，服务重启后仍可查询，未完成的任务在启动时重新排队。
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from dbpy.database import PROJECT_ROOT, get_db_connection
+
+# 后台工作线程数（SQLite 同一时间只有一个写入者，默认1）
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 1))
+
+# 排队和执行中的任务上限，超过时上传接口返回503
+INGEST_MAX_PENDING = int(os.environ.get('INGEST_MAX_PENDING', 10))
+
+# 任务上传文件的保存目录（不使用系统临时目录，重启后仍可继续处理）
+INGEST_JOB_DIR = os.environ.get('INGEST_JOB_DIR', os.path.join(PROJECT_ROOT, 'uploads', 'jobs'))
+
+# 进度写入数据库的最小间隔（秒）
+PROGRESS_FLUSH_INTERVAL = 1.0
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+CREATE_INGEST_JOB_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS IngestJob (
+        id TEXT PRIMARY KEY,
+        job_type TEXT NOT NULL,
+        filename TEXT,
+        username TEXT,
+        status TEXT NOT NULL,
+        stage TEXT,
+        rows_processed INTEGER DEFAULT 0,
+        rows_total INTEGER,
+        payload TEXT,
+        fingerprint TEXT,
+        summary TEXT,
+        result TEXT,
+        error TEXT,
+        created_at DATETIME,
+        started_at DATETIME,
+        stage_started_at DATETIME,
+        finished_at DATETIME,
+        updated_at DATETIME
+    )
+'''
+
+_handlers = {}
+_executor = None
+_pending = 0
+_lock = threading.Lock()
+# 查找同指纹的任务与登记新任务需要一起完成，避免同时上传的相同文件各自建立任务
+_submit_lock = threading.Lock()
+
+
+class IngestJobError(Exception):
+    """任务执行失败（如文件格式错误），错误信息直接返回给前端"""
+
+
+class QueueFullError(Exception):
+    """排队任务过多"""
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _update_job(job_id, **fields):
+    """更新任务记录的若干字段"""
+    fields['updated_at'] = _now()
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    conn = get_db_connection()
+    try:
+        conn.execute(f'UPDATE IngestJob SET {assignments} WHERE id = ?', list(fields.values()) + [job_id])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class IngestJob:
+    """
+    执行中的任务，供处理函数汇报阶段和进度
+
+    进度更新按 PROGRESS_FLUSH_INTERVAL 节流后写入数据库，避免每块都提交一次。
+    """
+
+    def __init__(self, job_id, job_type, payload):
+        self.id = job_id
+        self.job_type = job_type
+        self.payload = payload
+        self.stage = None
+        self.rows_processed = 0
+        self._last_flush = 0.0
+
+    def set_stage(self, stage, rows_total=None):
+        """进入新阶段，行数从0开始计"""
+        self.stage = stage
+        self.rows_processed = 0
+        self._last_flush = time.monotonic()
+        fields = {'stage': stage, 'rows_processed': 0, 'stage_started_at': _now()}
+        if rows_total is not None:
+            fields['rows_total'] = rows_total
+        _update_job(self.id, **fields)
+
+    def set_summary(self, summary):
+        """保存处理完成前即可确定的统计（如写入前的新记录数、重复数），查询任务时返回"""
+        _update_job(self.id, summary=json.dumps(summary, ensure_ascii=False, default=str))
+
+    def set_progress(self, rows_processed):
+        """更新当前阶段已处理的行数"""
+        self.rows_processed = rows_processed
+        now = time.monotonic()
+        if now - self._last_flush >= PROGRESS_FLUSH_INTERVAL:
+            self._last_flush = now
+            _update_job(self.id, rows_processed=rows_processed)
+
+
+def ensure_ingest_job_table():
+    """创建 IngestJob 表（如不存在）"""
+    conn = get_db_connection()
+    try:
+        conn.execute(CREATE_INGEST_JOB_TABLE_SQL)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def register_job_handler(job_type, handler):
+    """
+    注册任务处理函数
+
+    Args:
+        job_type: 任务类型
+        handler: handler(job, payload)，返回结果字典；格式错误等预期失败抛出 IngestJobError
+    """
+    _handlers[job_type] = handler
+
+
+def job_file_path(original_filename):
+    """为上传文件分配任务目录中的保存路径"""
+    os.makedirs(INGEST_JOB_DIR, exist_ok=True)
+    suffix = os.path.splitext(original_filename)[1].lower()
+    return os.path.join(INGEST_JOB_DIR, f'{uuid.uuid4().hex}{suffix}')
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+        return _executor
+
+
+def _reserve_slot():
+    global _pending
+    with _lock:
+        if _pending >= INGEST_MAX_PENDING:
+            raise QueueFullError(f'当前有 {_pending} 个上传任务在处理，请稍后重试')
+        _pending += 1
+
+
+def _release_slot():
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+def _run_job(job_id, job_type, payload):
+    job = IngestJob(job_id, job_type, payload)
+    try:
+        _update_job(job_id, status=JOB_RUNNING, started_at=_now())
+        result = _handlers[job_type](job, payload)
+        _update_job(job_id, status=JOB_SUCCEEDED, stage='done', rows_processed=job.rows_processed,
+                    result=json.dumps(result, ensure_ascii=False, default=str), finished_at=_now())
+    except IngestJobError as e:
+        _update_job(job_id, status=JOB_FAILED, error=str(e), finished_at=_now())
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        _update_job(job_id, status=JOB_FAILED, error=f'处理文件时出错: {str(e)}', finished_at=_now())
+    finally:
+        _release_slot()
+        file_path = payload.get('file_path')
+        if file_path and os.path.exists(file_path):
+            os.unlink(file_path)
+
+
+def find_active_job(job_type, fingerprint):
+    """查找同类型、同文件指纹且正在排队或执行的任务，返回任务ID，没有时返回None"""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            'SELECT id FROM IngestJob WHERE job_type = ? AND fingerprint = ? AND status IN (?, ?) '
+            'ORDER BY created_at LIMIT 1',
+            (job_type, fingerprint, JOB_QUEUED, JOB_RUNNING)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row['id'] if row else None
+
+
+def submit_job(job_type, payload, filename=None, username=None, fingerprint=None):
+    """
+    登记任务并提交到后台线程池
+
+    Args:
+        job_type: 已注册的任务类型
+        payload: 处理函数需要的参数（可JSON序列化，file_path 为任务结束后删除的上传文件）
+        filename: 原始文件名
+        username: 提交任务的用户
+        fingerprint: 上传文件内容的指纹；同类型、同指纹的任务正在排队或执行时不新建任务
+
+    Returns:
+        (任务ID, 是否新建)：未新建时任务ID为正在执行的同指纹任务，调用方需自行删除上传文件
+
+    Raises:
+        QueueFullError: 排队任务过多
+    """
+    with _submit_lock:
+        if fingerprint:
+            active_job_id = find_active_job(job_type, fingerprint)
+            if active_job_id:
+                return active_job_id, False
+
+        _reserve_slot()
+        job_id = uuid.uuid4().hex
+        try:
+            now = _now()
+            conn = get_db_connection()
+            try:
+                conn.execute('''
+                    INSERT INTO IngestJob (id, job_type, filename, username, status, payload, fingerprint,
+                                           created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (job_id, job_type, filename, username, JOB_QUEUED,
+                      json.dumps(payload, ensure_ascii=False), fingerprint, now, now))
+                conn.commit()
+            finally:
+                conn.close()
+            _get_executor().submit(_run_job, job_id, job_type, payload)
+        except Exception:
+            _release_slot()
+            raise
+    return job_id, True
+
+
+def get_job(job_id):
+    """
+    查询任务状态
+
+    Returns:
+        任务信息字典（包含当前阶段的处理速度 rows_per_sec），任务不存在时返回None
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT * FROM IngestJob WHERE id = ?', (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+
+    job = dict(row)
+    job.pop('payload')
+    job.pop('fingerprint', None)
+    job['summary'] = json.loads(job['summary']) if job['summary'] else None
+    job['result'] = json.loads(job['result']) if job['result'] else None
+
+    # 当前阶段的处理速度（已结束的任务按结束时间计算）
+    rows_per_sec = None
+    if job['stage_started_at'] and job['rows_processed']:
+        start = datetime.strptime(job['stage_started_at'], '%Y-%m-%d %H:%M:%S')
+        end = datetime.strptime(job['finished_at'], '%Y-%m-%d %H:%M:%S') if job['finished_at'] else datetime.now()
+        elapsed = max((end - start).total_seconds(), 1)
+        rows_per_sec = round(job['rows_processed'] / elapsed, 1)
+    job['rows_per_sec'] = rows_per_sec
+    return job
+
+
+def recover_jobs():
+    """
+    服务启动时处理上次未完成的任务
+
+    上传文件仍在时重新排队（订单按 record_hash 去重、库存按商品名称+仓库更新，重复执行不会产生重复数据），
+    文件已不存在时标记为失败。
+    """
+    global _pending
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            'SELECT id, job_type, payload FROM IngestJob WHERE status IN (?, ?) ORDER BY created_at',
+            (JOB_QUEUED, JOB_RUNNING)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    for row in rows:
+        payload = json.loads(row['payload'] or '{}')
+        file_path = payload.get('file_path')
+        if row['job_type'] not in _handlers or not file_path or not os.path.exists(file_path):
+            _update_job(row['id'], status=JOB_FAILED, error='服务重启时任务中断，请重新上传', finished_at=_now())
+            continue
+        _update_job(row['id'], status=JOB_QUEUED, stage=None, rows_processed=0)
+        with _lock:
+            _pending += 1
+        _get_executor().submit(_run_job, row['id'], row['job_type'], payload)
+        print(f'重新排队上传任务: {row["id"]}')
+
+
+def init_ingest_jobs():
+    """创建任务表并恢复未完成的任务（应用启动时调用）"""
+    ensure_ingest_job_table()
+    recover_jobs()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+上传处理的日志与分阶段统计
+每次上传（请求或后台任务）使用一个 IngestTelemetry：
+- 各阶段（save、validate、parse、hash、dedupe、insert、commit 等）累计耗时、行数、字节数，以及阶段前后的常驻内存变化；
+- 逐行消息（如某行写入失败）按类别只记录前若干条，其余只计数；
+- 结束时关闭日志文件句柄，并按保留策略压缩、删除旧的调试日志。
+"""
+
+import glob
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+# 调试日志目录
+UPLOAD_LOG_DIR = 'logs'
+
+# 调试日志超过该天数后压缩为 .gz（默认1天）
+UPLOAD_LOG_COMPRESS_DAYS = float(os.environ.get('UPLOAD_LOG_COMPRESS_DAYS', 1))
+
+# 调试日志（含压缩文件）超过该天数后删除（默认30天）
+UPLOAD_LOG_RETENTION_DAYS = float(os.environ.get('UPLOAD_LOG_RETENTION_DAYS', 30))
+
+# 每类逐行消息最多写入日志的条数
+SAMPLE_LIMIT = 20
+
+# 两次日志清理之间的最小间隔（秒）
+ROTATION_INTERVAL = 3600
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+_open_logs = set()
+_last_rotation = 0.0
+_rotation_lock = threading.Lock()
+
+
+def get_rss_mb():
+    """
+    获取当前进程此刻的常驻内存（MB），无法获取时（非 Linux）返回None
+
+    读取 /proc/self/statm，而不是 getrusage 的 ru_maxrss：后者是进程启动以来的峰值，
+    早先某次大文件上传之后一直不变，无法反映某个阶段用了多少内存。
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+
+
+class IngestTelemetry:
+    """
+    一次上传的日志记录器和分阶段统计
+
+    同名阶段多次执行时（如逐块写入）累计耗时和行数。内存记录为阶段结束时的常驻内存（rss_mb），
+    以及单次执行中常驻内存的最大增长（rss_delta_mb，结束时减开始时；流水线中并行的阶段会互相计入）。
+    用完必须调用 close()（或用 with 语句），否则日志文件句柄不会释放。
+    """
+
+    def __init__(self, log_prefix='upload'):
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        # 同一秒内的多次上传使用不同的记录器和日志文件
+        suffix = uuid.uuid4().hex[:6]
+        self.name = f'{log_prefix}_{timestamp}_{suffix}'
+        self.log_filename = os.path.join(UPLOAD_LOG_DIR, f'{log_prefix}_debug_{timestamp}_{suffix}.log')
+        self.stages = {}
+        self._samples = {}
+        self._closed = False
+        # 流水线中各阶段可能在不同线程中同时执行
+        self._lock = threading.Lock()
+
+        self.logger = logging.getLogger(f'ingest.{self.name}')
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        formatter = logging.Formatter(LOG_FORMAT)
+
+        # 控制台处理器（输出到stdout）
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(formatter)
+        self.logger.addHandler(console_handler)
+
+        try:
+            os.makedirs(UPLOAD_LOG_DIR, exist_ok=True)
+            file_handler = logging.FileHandler(self.log_filename, encoding='utf-8')
+            file_handler.setLevel(logging.DEBUG)
+            file_handler.setFormatter(formatter)
+            self.logger.addHandler(file_handler)
+            _open_logs.add(os.path.abspath(self.log_filename))
+        except OSError as e:
+            # 日志文件创建失败时只输出到控制台
+            self.logger.warning(f'创建调试日志文件失败: {e}')
+            self.log_filename = None
+
+        self.logger.info(f'日志文件: {self.log_filename}')
+
+    @contextmanager
+    def stage(self, name, rows=0, bytes=None):
+        """
+        统计一个阶段的耗时，返回的记录可在阶段内补充 rows、bytes
+
+        Args:
+            name: 阶段名称
+            rows: 本次处理的行数（累计到该阶段）
+            bytes: 本次处理的字节数（累计到该阶段）
+        """
+        with self._lock:
+            record = self.stages.setdefault(name, {
+                'stage': name, 'duration_ms': 0.0, 'calls': 0, 'rows': 0, 'bytes': None,
+                'rss_mb': None, 'rss_delta_mb': None
+            })
+            record['calls'] += 1
+            record['rows'] += rows
+            if bytes is not None:
+                record['bytes'] = (record['bytes'] or 0) + bytes
+        start_rss = get_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            end_rss = get_rss_mb()
+            with self._lock:
+                record['duration_ms'] += elapsed_ms
+                record['rss_mb'] = end_rss
+                if start_rss is not None and end_rss is not None:
+                    delta = round(end_rss - start_rss, 1)
+                    if record['rss_delta_mb'] is None or delta > record['rss_delta_mb']:
+                        record['rss_delta_mb'] = delta
+
+    def sample(self, category, message, level='warning'):
+        """
+        记录逐行消息：每类只写入前 SAMPLE_LIMIT 条，其余在 close() 时汇总条数
+
+        Args:
+            category: 消息类别，如 'insert_error'
+            message: 消息内容
+            level: 日志级别 (debug, info, warning, error)
+        """
+        with self._lock:
+            count = self._samples.get(category, 0) + 1
+            self._samples[category] = count
+        if count <= SAMPLE_LIMIT:
+            getattr(self.logger, level)(message)
+
+    def report(self):
+        """各阶段统计（按首次执行顺序；流水线中并行执行的阶段耗时之和会大于总耗时）"""
+        with self._lock:
+            return [dict(record, duration_ms=round(record['duration_ms'], 1)) for record in self.stages.values()]
+
+    def log_report(self):
+        """把各阶段统计写入日志"""
+        for record in self.report():
+            self.logger.info(
+                f"[telemetry] 阶段 {record['stage']}: 耗时 {record['duration_ms']}ms, 次数 {record['calls']}, "
+                f"行数 {record['rows']}, 字节 {record['bytes']}, "
+                f"常驻内存 {record['rss_mb']}MB（单次最大增长 {record['rss_delta_mb']}MB）"
+            )
+
+    def close(self):
+        """汇总被省略的逐行消息，关闭日志处理器，并按需清理旧日志"""
+        if self._closed:
+            return
+        self._closed = True
+        self.log_report()
+        for category, count in self._samples.items():
+            if count > SAMPLE_LIMIT:
+                self.logger.warning(f'{category} 共 {count} 条，仅记录前 {SAMPLE_LIMIT} 条')
+
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+        # 记录器按名称缓存在 logging 模块中，每次上传的名称都不同，需要移除
+        logging.Logger.manager.loggerDict.pop(self.logger.name, None)
+        if self.log_filename:
+            _open_logs.discard(os.path.abspath(self.log_filename))
+
+        maybe_rotate_upload_logs()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def stage_timer(telemetry, name, rows=0, bytes=None):
+    """telemetry 为空时不统计的 telemetry.stage()"""
+    if telemetry is None:
+        return nullcontext()
+    return telemetry.stage(name, rows, bytes)
+
+
+def rotate_upload_logs(log_dir=None, compress_days=None, retention_days=None):
+    """
+    压缩和删除旧的调试日志
+
+    超过 compress_days 的 *_debug_*.log 压缩为 .log.gz，超过 retention_days 的日志（含压缩文件）删除，
+    正在写入的日志文件不处理。
+
+    Returns:
+        (压缩文件数, 删除文件数)
+    """
+    log_dir = log_dir or UPLOAD_LOG_DIR
+    compress_days = UPLOAD_LOG_COMPRESS_DAYS if compress_days is None else compress_days
+    retention_days = UPLOAD_LOG_RETENTION_DAYS if retention_days is None else retention_days
+    now = time.time()
+    compressed = 0
+    removed = 0
+
+    for path in glob.glob(os.path.join(log_dir, '*_debug_*.log*')):
+        if os.path.abspath(path) in _open_logs:
+            continue
+        try:
+            age_days = (now - os.path.getmtime(path)) / 86400
+            if age_days > retention_days:
+                os.unlink(path)
+                removed += 1
+            elif path.endswith('.log') and age_days > compress_days:
+                with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                # 压缩文件保留原日志的修改时间，保留期限仍从写日志时算起
+                os.utime(path + '.gz', (now, os.path.getmtime(path)))
+                os.unlink(path)
+                compressed += 1
+        except OSError as e:
+            print(f'清理调试日志失败 {path}: {e}')
+
+    return compressed, removed
+
+
+def maybe_rotate_upload_logs():
+    """距上次清理超过 ROTATION_INTERVAL 时清理旧日志"""
+    global _last_rotation
+    with _rotation_lock:
+        now = time.monotonic()
+        if _last_rotation and now - _last_rotation < ROTATION_INTERVAL:
+            return
+        _last_rotation = now
+    rotate_upload_logs()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+商品名称标准化
+订单导出中的商品名称带有颜色、尺码等后缀（如 --蓝马甲、-58、58CM、-XS），统计时需要去掉。
+正则表达式预先编译，结果按原始名称缓存：导出文件有几十万行，但不同的商品名称只有几千个。
+"""
+
+import re
+from functools import lru_cache
+
+import pandas as pd
+
+# 缓存的不同商品名称数上限
+PRODUCT_NAME_CACHE_SIZE = 65536
+
+# 按顺序依次去掉的后缀
+_SUFFIX_PATTERNS = [
+    # 移除 -- 后面的内容
+    re.compile(r'--.*'),
+    # 移除 - 后面跟着数字或字母的内容（尺码）
+    re.compile(r'-\s*\d+[A-Za-z]*'),
+    re.compile(r'-\s*[A-Za-z]+'),
+    # 移除末尾的数字+单位（如 58CM）
+    re.compile(r'\d+CM$'),
+    re.compile(r'\d+$'),
+]
+
+
+@lru_cache(maxsize=PRODUCT_NAME_CACHE_SIZE)
+def _normalize(name):
+    for pattern in _SUFFIX_PATTERNS:
+        name = pattern.sub('', name)
+    return name.strip()
+
+
+def normalize_product_name(name):
+    """标准化商品名称：移除颜色、尺码等后缀信息"""
+    return _normalize(str(name))
+
+
+def normalize_series(series):
+    """
+    标准化一列商品名称（每个不同的名称只处理一次，再按位置映射回各行）
+
+    Args:
+        series: 商品名称列（空值按 'nan' 处理，与 normalize_product_name 一致）
+
+    Returns:
+        标准化后的商品名称列，索引与 series 相同
+    """
+    codes, names = pd.factorize(series.astype(str))
+    normalized = pd.Index(names).map(_normalize)
+    return pd.Series(normalized.take(codes), index=series.index, name=series.name)
+
+
+@lru_cache(maxsize=PRODUCT_NAME_CACHE_SIZE)
+def extract_alias(product_name):
+    """
+    提取商品别名
+    去除-后面的颜色、尺码等信息
+    """
+    if '-' in product_name:
+        # 找到第一个-的位置，去除后面的内容
+        return product_name.split('-')[0].strip()
+    return product_name
@@ -0,0 +1,658 @@
+# -*- coding: utf-8 -*-
+"""
+流式读取上传文件
+Excel（.xlsx 使用 openpyxl read_only，.xls 使用 xlrd on_demand）和 CSV（chunksize）按固定行数分块读取，
+峰值内存由块大小决定，而不是文件大小。
+
+订单数据也可以是浏览器转换好的 CSV 或 JSON Lines（可 gzip 压缩），按行读取后与 Excel 走同一套解析流程。
+
+Excel 分两遍处理：
+1. scan()：逐行读取工作表，按块解析并推断每列类型，同时把原始行按块暂存到临时文件；
+2. iter_chunks()：从临时文件读回各块，按整表统一后的列类型重新解析。
+这样每块的列类型与 pd.read_excel 一次读取整表时完全一致（例如某列只在部分块中有空值时，
+整表会被推断为浮点列），保证 record_hash 与整表读取时相同。
+"""
+
+import codecs
+import csv
+import gzip
+import json
+import os
+import pickle
+import tempfile
+from datetime import datetime, time
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+# 每块行数（可通过环境变量 UPLOAD_STREAM_CHUNK_ROWS 调整）
+STREAM_CHUNK_ROWS = int(os.environ.get('UPLOAD_STREAM_CHUNK_ROWS', 5000))
+
+# CSV 候选编码（与 FileValidator.validate_csv_format 的尝试顺序一致）
+CSV_ENCODINGS = ['utf-8', 'gb18030', 'gbk']
+
+# 日期时间列转字符串的精度，由粗到细（与 pandas astype(str) 按整列选择格式的规则一致）
+DATETIME_RESOLUTIONS = ['date', 's', 'ms', 'us', 'ns']
+
+# 订单数据除 Excel 外支持的文本格式（浏览器预先转换后上传）
+TEXT_ROW_FORMATS = ('csv', 'ndjson')
+
+# gzip 文件头
+_GZIP_MAGIC = b'\x1f\x8b'
+
+# pandas 默认识别为布尔值的字符串
+_BOOL_STRINGS = frozenset(['True', 'TRUE', 'true', 'False', 'FALSE', 'false'])
+
+# CSV 可声明的列类型：类型 -> 说明
+CSV_COLUMN_TYPES = {
+    'datetime': '日期时间',
+    'bool': '布尔值',
+}
+
+_NS_PER_UNIT = {
+    'date': 86400 * 10 ** 9,
+    's': 10 ** 9,
+    'ms': 10 ** 6,
+    'us': 10 ** 3,
+}
+
+
+def _convert_openpyxl_cell(cell):
+    """单元格取值（与 pandas openpyxl 读取器的转换规则一致）"""
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+    if cell.value is None:
+        return ''
+    elif cell.data_type == TYPE_ERROR:
+        return np.nan
+    elif cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        if value == cell.value:
+            return value
+        return float(cell.value)
+    return cell.value
+
+
+def _skip_trailing_blank_rows(rows):
+    """行中末尾的空单元格去掉，末尾的空行丢弃，中间的空行保留（与 pandas 读取 Excel 时一致）"""
+    pending_empty_rows = 0
+    for values in rows:
+        values = list(values)
+        while values and values[-1] == '':
+            values.pop()
+        if not values:
+            pending_empty_rows += 1
+            continue
+        for _ in range(pending_empty_rows):
+            yield []
+        pending_empty_rows = 0
+        yield values
+
+
+def _iter_xlsx_rows(file_path):
+    """逐行读取 .xlsx 第一个工作表（read_only 模式，不把整个工作表载入内存）"""
+    from openpyxl import load_workbook
+
+    book = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = book.worksheets[0]
+        sheet.reset_dimensions()
+        yield from _skip_trailing_blank_rows([_convert_openpyxl_cell(cell) for cell in row] for row in sheet.rows)
+    finally:
+        book.close()
+
+
+def _iter_xls_rows(file_path):
+    """逐行读取 .xls 第一个工作表（xlrd on_demand 模式，只加载需要的工作表）"""
+    import xlrd
+    from xlrd import xldate
+
+    book = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        epoch1904 = book.datemode
+        sheet = book.sheet_by_index(0)
+
+        def parse_cell(value, cell_type):
+            # 与 pandas xlrd 读取器的转换规则一致
+            if cell_type == xlrd.XL_CELL_DATE:
+                try:
+                    value = xldate.xldate_as_datetime(value, epoch1904)
+                except OverflowError:
+                    return value
+                year = value.timetuple()[0:3]
+                if (not epoch1904 and year == (1899, 12, 31)) or (epoch1904 and year == (1904, 1, 1)):
+                    value = time(value.hour, value.minute, value.second, value.microsecond)
+            elif cell_type == xlrd.XL_CELL_ERROR:
+                value = np.nan
+            elif cell_type == xlrd.XL_CELL_BOOLEAN:
+                value = bool(value)
+            elif cell_type == xlrd.XL_CELL_NUMBER:
+                if np.isfinite(value):
+                    int_value = int(value)
+                    if int_value == value:
+                        value = int_value
+            return value
+
+        for i in range(sheet.nrows):
+            yield [parse_cell(value, cell_type) for value, cell_type in zip(sheet.row_values(i), sheet.row_types(i))]
+    finally:
+        book.release_resources()
+
+
+def _open_text(file_path, encoding='utf-8'):
+    """以文本方式打开文件，gzip 压缩的文件（按文件头判断）边读边解压"""
+    with open(file_path, 'rb') as f:
+        compressed = f.read(2) == _GZIP_MAGIC
+    if compressed:
+        return gzip.open(file_path, 'rt', encoding=encoding, newline='')
+    return open(file_path, encoding=encoding, newline='')
+
+
+def _convert_json_value(value):
+    """
+    JSON 值转换为与 Excel 单元格相同的取值：null 为空单元格，整数值的浮点数为 int（与数值单元格一致），
+    {"$date": "2025-01-01 10:00:00"} 为日期时间单元格
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, dict) and '$date' in value:
+        return datetime.fromisoformat(value['$date'])
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _iter_ndjson_rows(handle):
+    """
+    逐行读取 JSON Lines：每行为一个数组（第一行为表头）或一个对象（第一个对象的键为表头）
+    """
+    header = None
+    for line_no, line in enumerate(handle, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if isinstance(record, dict):
+            if header is None:
+                header = list(record.keys())
+                yield header
+            extra = [key for key in record if key not in header]
+            if extra:
+                raise ValueError(f'第 {line_no} 行包含表头中没有的列: {extra}')
+            yield [_convert_json_value(record.get(key)) for key in header]
+        elif isinstance(record, list):
+            if header is None:
+                header = [str(name) for name in record]
+                yield header
+                continue
+            yield [_convert_json_value(value) for value in record]
+        else:
+            raise ValueError(f'第 {line_no} 行不是 JSON 数组或对象')
+
+
+def _csv_datetime(value):
+    return datetime.fromisoformat(value.strip())
+
+
+def _csv_bool(value):
+    value = value.strip()
+    if value not in _BOOL_STRINGS:
+        raise ValueError(value)
+    return value.lower() == 'true'
+
+
+_CSV_CONVERTERS = {
+    'datetime': _csv_datetime,
+    'bool': _csv_bool,
+}
+
+
+def _convert_csv_rows(rows, column_types):
+    """
+    按声明的列类型把 CSV 文本转换为与 Excel 单元格相同的取值
+
+    Excel 中的日期时间、布尔单元格在 CSV 中只是文本，按文本推断类型时空值和布尔值转字符串的结果与 Excel 不同
+    （日期时间列的空值在 Excel 中为 NaT，含空值的布尔列在 Excel 中按数值处理），record_hash 也就不同。
+    声明类型的列中，非空值转换为 datetime / bool（与 Excel 单元格相同），空值仍为空单元格。
+
+    Args:
+        rows: CSV 行（第一行为表头）
+        column_types: 列名 -> 'datetime' 或 'bool'
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    yield header
+
+    missing = [name for name in column_types if name not in header]
+    if missing:
+        raise ValueError(f'表头中没有声明了类型的列: {missing}')
+    converters = [
+        (position, _CSV_CONVERTERS[column_types[name]], CSV_COLUMN_TYPES[column_types[name]])
+        for position, name in enumerate(header) if name in column_types
+    ]
+    for line_no, values in enumerate(rows, start=2):
+        for position, convert, type_name in converters:
+            if position < len(values) and values[position] != '':
+                try:
+                    values[position] = convert(values[position])
+                except ValueError:
+                    raise ValueError(f'第 {line_no} 行「{header[position]}」不是{type_name}: {values[position]}')
+        yield values
+
+
+def iter_text_rows(file_path, fmt, encoding='utf-8', column_types=None):
+    """
+    逐行读取 CSV 或 JSON Lines 文件（可 gzip 压缩），第一行为表头
+
+    CSV 的值都是字符串，与 Excel 文本单元格一样由解析器推断类型；Excel 中为日期时间、布尔单元格的列
+    需要通过 column_types 声明，否则 record_hash 与 Excel 上传不一致。
+    JSON Lines 保留数值、字符串的区别，日期时间单元格写为 {"$date": "..."}。
+
+    Args:
+        file_path: 文件路径
+        fmt: 'csv' 或 'ndjson'
+        encoding: 文本编码（默认 UTF-8，带 BOM 时自动去掉）
+        column_types: 只用于 CSV，列名 -> 'datetime' 或 'bool'（见 CSV_COLUMN_TYPES）
+    """
+    if encoding.lower().replace('-', '') == 'utf8':
+        encoding = 'utf-8-sig'
+    with _open_text(file_path, encoding) as handle:
+        if fmt == 'csv':
+            rows = _skip_trailing_blank_rows(csv.reader(handle))
+            yield from _convert_csv_rows(rows, column_types) if column_types else rows
+        elif fmt == 'ndjson':
+            yield from _skip_trailing_blank_rows(_iter_ndjson_rows(handle))
+        else:
+            raise ValueError(f'不支持的文件格式: {fmt}')
+
+
+def iter_excel_rows(file_path, fmt=None, column_types=None):
+    """
+    逐行返回第一个工作表的单元格值（第一行为表头）
+
+    Args:
+        file_path: 文件路径
+        fmt: 为 'csv' 或 'ndjson' 时按文本格式读取，否则按扩展名读取 Excel
+        column_types: CSV 声明的列类型，见 iter_text_rows
+    """
+    if fmt in TEXT_ROW_FORMATS:
+        return iter_text_rows(file_path, fmt, column_types=column_types)
+    if file_path.lower().endswith('.xls'):
+        return _iter_xls_rows(file_path)
+    return _iter_xlsx_rows(file_path)
+
+
+def _pad_rows(rows, width):
+    """把各行补齐到相同列数（与 pandas 读取整表时补齐到最大列宽一致）"""
+    return [row + [''] * (width - len(row)) if len(row) < width else row for row in rows]
+
+
+def _parse_rows(header, rows, width, dtype=None):
+    """用 pandas 读取 Excel 时相同的 TextParser 参数把原始行解析为 DataFrame"""
+    data = _pad_rows([header] + rows, width)
+    return TextParser(data, header=0, skip_blank_lines=False, dtype=dtype).read()
+
+
+def _datetime_resolution(series):
+    """日期时间列中非空值需要的最细精度（'date' 表示全部为零点）"""
+    values = series.dropna().to_numpy(dtype='datetime64[ns]').view('i8')
+    if len(values) == 0:
+        return None
+    for resolution in DATETIME_RESOLUTIONS[:-1]:
+        if not (values % _NS_PER_UNIT[resolution]).any():
+            return resolution
+    return 'ns'
+
+
+def format_datetime_series(series, resolution):
+    """
+    按指定精度把日期时间列转为字符串
+
+    pandas 的 astype(str) 会根据整列数据选择输出格式（全部为零点时只输出日期，有毫秒时所有值都带毫秒），
+    分块读取时由 ExcelChunkReader 统计整列精度后传入，结果与整表 astype(str) 一致。
+
+    Args:
+        series: datetime64 类型的列
+        resolution: 'date'、's'、'ms'、'us' 或 'ns'
+
+    Returns:
+        字符串列，空值为 'NaT'
+    """
+    if resolution == 'date':
+        result = series.dt.strftime('%Y-%m-%d')
+    elif resolution == 's':
+        result = series.dt.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        result = series.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+        if resolution == 'ms':
+            result = result.str[:-3]
+        elif resolution == 'ns':
+            result = result + series.dt.nanosecond.map('{:03d}'.format)
+    return result.where(series.notna(), 'NaT')
+
+
+class ExcelChunkReader:
+    """
+    Excel 分块读取器
+
+    用法：
+        reader = ExcelChunkReader(file_path)
+        reader.scan(on_chunk)          # 第一遍：推断类型、暂存原始行，on_chunk(df, row_offset) 可用于逐块校验
+        for chunk in reader.iter_chunks():
+            ...                        # 第二遍：按整表统一后的列类型返回各块
+        reader.close()
+    """
+
+    def __init__(self, file_path, chunk_rows=None, progress=None, fmt=None, column_types=None):
+        self.file_path = file_path
+        # 'csv'、'ndjson' 表示浏览器转换好的文本格式，为 None 时按扩展名读取 Excel
+        self.fmt = fmt
+        # CSV 中日期时间、布尔列的声明（见 iter_text_rows）
+        self.column_types = column_types
+        self.chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+        # 可选回调 progress(已处理行数)，两遍读取中每处理完一块调用一次
+        self.progress = progress
+        self.header = None
+        self.columns = []
+        self.total_rows = 0
+        self.chunk_count = 0
+        self.datetime_resolutions = {}
+        self._width = 0
+        self._min_width = float('inf')
+        self._spool_path = None
+        # 按列位置统计：各块推断出的类型、是否出现空值、日期时间精度
+        self._kinds = {}
+        self._has_na = set()
+        self._bool_positions = set()
+        self._resolutions = {}
+        self._column_kinds = {}
+
+    def scan(self, on_chunk=None):
+        """
+        第一遍读取：逐块解析并统计列类型，原始行暂存到临时文件
+
+        Args:
+            on_chunk: 可选回调 on_chunk(df, row_offset)，df 为按本块数据推断类型的 DataFrame，
+                      row_offset 为本块第一行之前的数据行数；返回 False 时停止读取
+
+        Returns:
+            数据行数
+        """
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.chunks') as spool:
+            self._spool_path = spool.name
+            rows = []
+            for values in iter_excel_rows(self.file_path, self.fmt, self.column_types):
+                if self.header is None:
+                    self.header = values
+                    self._width = len(values)
+                    continue
+                rows.append(values)
+                if len(rows) >= self.chunk_rows:
+                    chunk, rows = rows, []
+                    if self._scan_chunk(spool, chunk, on_chunk) is False:
+                        break
+            else:
+                if rows:
+                    self._scan_chunk(spool, rows, on_chunk)
+
+        if self.header is None:
+            # 空工作表
+            self.header = []
+            return 0
+        self._resolve_column_kinds()
+        self.columns = _parse_rows(self.header, [], self._width).columns.tolist()
+        self.datetime_resolutions = {
+            self.columns[position]: resolution
+            for position, resolution in self._resolutions.items()
+            if self._column_kinds.get(position) == 'M'
+        }
+        return self.total_rows
+
+    def _scan_chunk(self, spool, rows, on_chunk):
+        width = max(self._width, max(len(row) for row in rows))
+        self._width = width
+        self._min_width = min(self._min_width, width)
+        rows = _pad_rows(rows, width)
+        df = _parse_rows(self.header, rows, width)
+
+        # 含布尔值（或 'true'/'FALSE' 等布尔字符串）的列，pandas 的推断结果依赖整列数据，需要单独处理
+        for position, values in enumerate(zip(*rows)):
+            value_types = set(map(type, values))
+            if bool in value_types or (str in value_types and not _BOOL_STRINGS.isdisjoint(values)):
+                self._bool_positions.add(position)
+
+        for position in range(len(df.columns)):
+            series = df.iloc[:, position]
+            na_mask = series.isna()
+            if na_mask.any():
+                self._has_na.add(position)
+                if na_mask.all():
+                    # 整块为空的列不参与类型推断（与整表读取时一样不影响该列类型）
+                    continue
+            kind = series.dtype.kind
+            self._kinds.setdefault(position, set()).add(kind)
+            if kind == 'M':
+                resolution = _datetime_resolution(series)
+                current = self._resolutions.get(position)
+                if current is None or DATETIME_RESOLUTIONS.index(resolution) > DATETIME_RESOLUTIONS.index(current):
+                    self._resolutions[position] = resolution
+
+        result = on_chunk(df, self.total_rows) if on_chunk is not None else None
+
+        pickle.dump(rows, spool, protocol=pickle.HIGHEST_PROTOCOL)
+        self.total_rows += len(rows)
+        self.chunk_count += 1
+        if self.progress:
+            self.progress(self.total_rows)
+        return result
+
+    def _resolve_column_kinds(self):
+        """合并各块的列类型，得到整表读取时该列的类型"""
+        for position, kinds in self._kinds.items():
+            # 比该列更窄的块中，该列按空值处理
+            has_na = position in self._has_na or position >= self._min_width
+            if position in self._bool_positions:
+                # 布尔值与空值、数字混合时 pandas 的推断规则依赖整列数据，这类列在第二遍读取时整列解析
+                kind = 'column'
+            elif kinds <= {'i', 'u'}:
+                kind = 'f' if has_na else 'i'
+            elif kinds <= {'i', 'u', 'f'}:
+                kind = 'f'
+            elif len(kinds) == 1:
+                kind = next(iter(kinds))
+            else:
+                kind = 'O'
+            self._column_kinds[position] = kind
+
+    def _iter_spooled_rows(self):
+        with open(self._spool_path, 'rb') as spool:
+            while True:
+                try:
+                    yield pickle.load(spool)
+                except EOFError:
+                    return
+
+    def _parse_whole_columns(self, positions):
+        """单独解析整列数据（只保留这几列的值，用于类型依赖整列数据的少数列）"""
+        values = {position: [] for position in positions}
+        for rows in self._iter_spooled_rows():
+            for row in rows:
+                for position in positions:
+                    values[position].append([row[position] if position < len(row) else ''])
+        return {
+            position: TextParser([[self.header[position] if position < len(self.header) else '']] + column_values,
+                                 header=0, skip_blank_lines=False).read().iloc[:, 0]
+            for position, column_values in values.items()
+        }
+
+    def iter_chunks(self, row_filter=None):
+        """
+        第二遍读取：按整表统一后的列类型逐块返回 DataFrame（可重复调用）
+
+        Args:
+            row_filter: 可选回调 row_filter(chunk_no)，返回该块要保留的行的布尔数组（None 表示整块保留）；
+                        只解析保留的行，没有保留行的块直接跳过
+        """
+        columns = self.columns
+        object_dtypes = {
+            columns[position]: object
+            for position, kind in self._column_kinds.items() if kind == 'O'
+        }
+        whole_columns = self._parse_whole_columns(
+            [position for position, kind in self._column_kinds.items() if kind == 'column']
+        )
+
+        row_offset = 0
+        for chunk_no, rows in enumerate(self._iter_spooled_rows()):
+            chunk_len = len(rows)
+            positions = None
+            if row_filter is not None:
+                mask = row_filter(chunk_no)
+                if mask is not None:
+                    positions = np.flatnonzero(mask)
+                    rows = [rows[i] for i in positions]
+            if rows:
+                df = _parse_rows(self.header, rows, self._width, dtype=object_dtypes or None)
+                for position, kind in self._column_kinds.items():
+                    series = df.iloc[:, position]
+                    if kind == 'column':
+                        values = whole_columns[position].iloc[row_offset:row_offset + chunk_len].to_numpy()
+                        if positions is not None:
+                            values = values[positions]
+                        # 保持整列解析得到的类型（object 列中的日期时间值不能被重新推断为 datetime64）
+                        df.isetitem(position, pd.Series(values, index=df.index,
+                                                        dtype=whole_columns[position].dtype))
+                    elif kind == 'f' and series.dtype.kind != 'f':
+                        df.isetitem(position, series.astype('float64'))
+                    elif kind == 'M' and series.dtype.kind != 'M':
+                        df.isetitem(position, pd.to_datetime(series))
+                yield df
+            row_offset += chunk_len
+            if self.progress:
+                self.progress(row_offset)
+
+    def close(self):
+        """删除暂存的原始行"""
+        if self._spool_path and os.path.exists(self._spool_path):
+            os.unlink(self._spool_path)
+        self._spool_path = None
+
+
+def _read_projected_chunk(frames, columns, rows, dtype, on_chunk):
+    """解析只含需要列的一块并追加到 frames，返回 on_chunk 的返回值"""
+    row_offset = sum(len(df) for df in frames)
+    df = _parse_rows(columns, rows, len(columns), dtype=dtype)
+    frames.append(df)
+    if on_chunk is not None:
+        return on_chunk(df, row_offset)
+
+
+def read_excel_columns(file_path, columns, dtype=None, fmt=None, chunk_rows=None, on_chunk=None):
+    """
+    只读取需要的几列（单遍读取，不暂存原始行），用于只需少数列的快速分析
+
+    每行只取出需要的单元格，再按块用与 pd.read_excel 相同的 TextParser 参数解析，其他列既不解析也不保留；
+    各块拼接后数值列的类型与整表读取一致（某块有空值时整列为浮点数）。
+
+    Args:
+        file_path: 文件路径
+        columns: 需要的列名列表
+        dtype: 可选，列名到类型的映射（如 {'商品名称': object}），指定后不再推断该列类型
+        fmt: 'csv'、'ndjson' 或 None（按扩展名读取 Excel）
+        chunk_rows: 每块行数，默认 STREAM_CHUNK_ROWS
+        on_chunk: 可选回调 on_chunk(df, row_offset)，可用于逐块校验；返回 False 时停止读取
+
+    Returns:
+        DataFrame，列顺序与 columns 一致；文件缺少其中某列时只返回表头中存在的列且不读取数据行
+    """
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    rows = iter_excel_rows(file_path, fmt)
+    try:
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        # 列名与整表读取时一致（如重复列名加 .1 后缀）
+        names = _parse_rows(header, [], len(header)).columns.tolist()
+        positions = [names.index(col) for col in columns if col in names]
+        selected = [names[position] for position in positions]
+        if len(positions) < len(columns):
+            return pd.DataFrame(columns=selected)
+
+        frames = []
+        chunk = []
+        for values in rows:
+            chunk.append([values[position] if position < len(values) else '' for position in positions])
+            if len(chunk) >= chunk_rows:
+                if _read_projected_chunk(frames, selected, chunk, dtype, on_chunk) is False:
+                    break
+                chunk = []
+        else:
+            if chunk:
+                _read_projected_chunk(frames, selected, chunk, dtype, on_chunk)
+    finally:
+        rows.close()
+
+    if not frames:
+        return pd.DataFrame(columns=selected)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _open_binary(file_input):
+    """CSV 输入可以是路径或文件对象，统一返回二进制读取句柄和是否需要关闭"""
+    if isinstance(file_input, str):
+        return open(file_input, 'rb'), True
+    file_input.seek(0)
+    return getattr(file_input, 'stream', file_input), False
+
+
+def detect_csv_encoding(file_input, encodings=None, block_size=1024 * 1024):
+    """
+    按候选顺序检测 CSV 编码（增量解码整个文件，不把文件载入内存）
+
+    Returns:
+        第一个能完整解码文件的编码，都不能解码时返回 None
+    """
+    for encoding in encodings or CSV_ENCODINGS:
+        handle, should_close = _open_binary(file_input)
+        try:
+            decoder = codecs.getincrementaldecoder(encoding)()
+            while True:
+                block = handle.read(block_size)
+                if not block:
+                    decoder.decode(b'', final=True)
+                    return encoding
+                decoder.decode(block)
+        except UnicodeDecodeError:
+            continue
+        finally:
+            if should_close:
+                handle.close()
+    return None
+
+
+def iter_csv_chunks(file_input, encoding, chunk_rows=None, **read_csv_kwargs):
+    """
+    按固定行数分块读取 CSV
+
+    Args:
+        file_input: CSV 文件路径或文件对象
+        encoding: 文件编码（可先用 detect_csv_encoding 检测）
+        chunk_rows: 每块行数，默认 STREAM_CHUNK_ROWS
+        **read_csv_kwargs: 传给 pd.read_csv 的其他参数
+
+    Yields:
+        (DataFrame, 本块第一行之前的数据行数)
+    """
+    if not isinstance(file_input, str):
+        file_input.seek(0)
+    row_offset = 0
+    with pd.read_csv(file_input, encoding=encoding, chunksize=chunk_rows or STREAM_CHUNK_ROWS,
+                     **read_csv_kwargs) as reader:
+        for chunk in reader:
+            yield chunk, row_offset
+            row_offset += len(chunk)
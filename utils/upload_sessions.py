@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+可续传的分块上传
+前端先登记上传（文件名、大小），再按块号顺序逐块上传，每块直接追加到暂存文件并更新 SHA-256，
+全部上传后由接口把暂存文件交给后台上传任务。上传中断后，前端查询已收到的块数，从下一块继续上传。
+
+上传状态保存在暂存目录的 <upload_id>.json 中，服务重启后仍可继续；
+SHA-256 的中间状态只保存在内存中，重启后第一次用到时从暂存文件重新计算。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from utils.ingest_jobs import INGEST_JOB_DIR
+
+# 分块上传的暂存目录（与任务文件目录在同一文件系统，完成后直接移动）
+UPLOAD_SESSION_DIR = os.path.join(INGEST_JOB_DIR, 'partial')
+
+# 每块字节数（需小于 MAX_CONTENT_LENGTH，默认4MB）
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+
+# 未完成的分块上传保留的小时数，超过后删除（默认24小时）
+UPLOAD_SESSION_EXPIRE_HOURS = float(os.environ.get('UPLOAD_SESSION_EXPIRE_HOURS', 24))
+
+# 读取请求体时每次读取的字节数
+_READ_BLOCK_SIZE = 1024 * 1024
+
+# 各上传的 SHA-256 中间状态：{upload_id: (已计算的字节数, hashlib 对象)}
+_hashers = {}
+# 同一上传的块按顺序写入
+_session_locks = {}
+_locks_guard = threading.Lock()
+
+
+class UploadSessionError(Exception):
+    """分块上传请求无效（块号不连续、大小不符等），status_code 为返回给前端的状态码"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _meta_path(upload_id):
+    return os.path.join(UPLOAD_SESSION_DIR, f'{upload_id}.json')
+
+
+def _part_path(upload_id):
+    return os.path.join(UPLOAD_SESSION_DIR, f'{upload_id}.part')
+
+
+def _session_lock(upload_id):
+    with _locks_guard:
+        return _session_locks.setdefault(upload_id, threading.Lock())
+
+
+def _save_session(session):
+    tmp_path = _meta_path(session['upload_id']) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(session, f, ensure_ascii=False)
+    os.replace(tmp_path, _meta_path(session['upload_id']))
+
+
+def _discard_session(upload_id):
+    for path in (_meta_path(upload_id), _part_path(upload_id)):
+        if os.path.exists(path):
+            os.unlink(path)
+    _hashers.pop(upload_id, None)
+    with _locks_guard:
+        _session_locks.pop(upload_id, None)
+
+
+def _valid_upload_id(upload_id):
+    # 上传ID用于拼接文件路径，只接受 uuid4 十六进制字符串
+    return len(upload_id) == 32 and all(c in '0123456789abcdef' for c in upload_id)
+
+
+def _hasher_for(session):
+    """当前已收到内容的 SHA-256 中间状态（服务重启后从暂存文件重新计算）"""
+    upload_id = session['upload_id']
+    received = session['received_bytes']
+    cached = _hashers.get(upload_id)
+    if cached is not None and cached[0] == received:
+        return cached[1]
+
+    sha256 = hashlib.sha256()
+    with open(_part_path(upload_id), 'rb') as f:
+        remaining = received
+        while remaining:
+            block = f.read(min(_READ_BLOCK_SIZE, remaining))
+            if not block:
+                raise UploadSessionError('暂存文件不完整，请重新上传', 409)
+            sha256.update(block)
+            remaining -= len(block)
+    _hashers[upload_id] = (received, sha256)
+    return sha256
+
+
+def session_status(session):
+    """返回给前端的上传状态"""
+    return {
+        'upload_id': session['upload_id'],
+        'filename': session['filename'],
+        'target': session['target'],
+        'size': session['size'],
+        'chunk_size': session['chunk_size'],
+        'total_chunks': session['total_chunks'],
+        'received_chunks': session['received_chunks'],
+        'received_bytes': session['received_bytes'],
+    }
+
+
+def cleanup_expired_sessions():
+    """删除超过 UPLOAD_SESSION_EXPIRE_HOURS 未更新的未完成上传"""
+    if not os.path.isdir(UPLOAD_SESSION_DIR):
+        return
+    expire_before = time.time() - UPLOAD_SESSION_EXPIRE_HOURS * 3600
+    for name in os.listdir(UPLOAD_SESSION_DIR):
+        if not name.endswith('.json'):
+            continue
+        upload_id = name[:-len('.json')]
+        try:
+            if os.path.getmtime(os.path.join(UPLOAD_SESSION_DIR, name)) < expire_before:
+                _discard_session(upload_id)
+        except OSError as e:
+            print(f'清理过期分块上传失败 {upload_id}: {e}')
+
+
+def create_session(filename, size, target, username, options=None):
+    """
+    登记一个分块上传
+
+    Args:
+        filename: 原始文件名
+        size: 文件总字节数
+        target: 上传完成后交给的任务（见 api.upload.UPLOAD_TARGETS）
+        username: 上传用户
+        options: 任务选项（如 dry_run、force）
+
+    Returns:
+        上传状态字典
+    """
+    cleanup_expired_sessions()
+    os.makedirs(UPLOAD_SESSION_DIR, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    session = {
+        'upload_id': upload_id,
+        'filename': filename,
+        'size': size,
+        'target': target,
+        'username': username,
+        'options': options or {},
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'total_chunks': (size + UPLOAD_CHUNK_SIZE - 1) // UPLOAD_CHUNK_SIZE,
+        'received_chunks': 0,
+        'received_bytes': 0,
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    open(_part_path(upload_id), 'wb').close()
+    _save_session(session)
+    _hashers[upload_id] = (0, hashlib.sha256())
+    return session
+
+
+def get_session(upload_id):
+    """读取上传状态，不存在时返回None"""
+    if not _valid_upload_id(upload_id) or not os.path.exists(_meta_path(upload_id)):
+        return None
+    with open(_meta_path(upload_id), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_chunk(upload_id, chunk_no, stream):
+    """
+    把一块数据追加到暂存文件（边读请求体边写入并更新 SHA-256，不把整块载入内存）
+
+    块必须按顺序上传：已收到的块再次上传时直接返回（重试是安全的），跳过未收到的块时返回 409。
+
+    Args:
+        upload_id: 上传ID
+        chunk_no: 块号（从0开始）
+        stream: 请求体输入流
+
+    Returns:
+        上传状态字典
+    """
+    with _session_lock(upload_id):
+        session = get_session(upload_id)
+        if session is None:
+            raise UploadSessionError('上传不存在或已过期', 404)
+        if chunk_no < session['received_chunks']:
+            return session
+        if chunk_no > session['received_chunks'] or chunk_no >= session['total_chunks']:
+            raise UploadSessionError(f'块号不连续，下一块应为 {session["received_chunks"]}', 409)
+
+        offset = session['received_bytes']
+        expected = min(session['chunk_size'], session['size'] - offset)
+        # 在中间状态的副本上计算，本块不完整时不影响已收到的内容
+        sha256 = _hasher_for(session).copy()
+        written = 0
+        with open(_part_path(upload_id), 'r+b') as part:
+            part.seek(offset)
+            part.truncate()
+            while True:
+                block = stream.read(min(_READ_BLOCK_SIZE, expected + 1 - written))
+                if not block:
+                    break
+                written += len(block)
+                if written > expected:
+                    break
+                part.write(block)
+                sha256.update(block)
+            if written != expected:
+                part.truncate(offset)
+                raise UploadSessionError(f'第 {chunk_no} 块大小应为 {expected} 字节，实际收到 {written} 字节')
+
+        session['received_chunks'] += 1
+        session['received_bytes'] += written
+        _hashers[upload_id] = (session['received_bytes'], sha256)
+        _save_session(session)
+        return session
+
+
+def complete_session(upload_id, destination):
+    """
+    确认所有块都已收到，把暂存文件移动到 destination
+
+    Returns:
+        (上传状态字典, 文件内容的 SHA-256)
+    """
+    with _session_lock(upload_id):
+        session = get_session(upload_id)
+        if session is None:
+            raise UploadSessionError('上传不存在或已过期', 404)
+        if session['received_chunks'] != session['total_chunks']:
+            raise UploadSessionError(
+                f'上传未完成：已收到 {session["received_chunks"]}/{session["total_chunks"]} 块', 409
+            )
+        fingerprint = _hasher_for(session).hexdigest()
+        os.replace(_part_path(upload_id), destination)
+        _discard_session(upload_id)
+        return session, fingerprint
+
+
+def discard_session(upload_id):
+    """取消上传并删除暂存文件"""
+    with _session_lock(upload_id):
+        _discard_session(upload_id)
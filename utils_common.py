@@ -1,22 +1,10 @@
 # -*- coding: utf-8 -*-
-import re
 import os
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
-
-def normalize_product_name(name):
-    """标准化商品名称：移除颜色、尺码等后缀信息"""
-    name = str(name)
-    # 移除 -- 后面的内容
-    name = re.sub(r'--.*', '', name)
-    # 移除 - 后面跟着数字或字母的内容（尺码）
-    name = re.sub(r'-\s*\d+[A-Za-z]*', '', name)
-    name = re.sub(r'-\s*[A-Za-z]+', '', name)
-    # 移除末尾的数字+单位（如 58CM）
-    name = re.sub(r'\d+CM$', '', name)
-    name = re.sub(r'\d+$', '', name)
-    return name.strip()
+# 商品名称标准化已移至 utils.product_name，这里保留导入以保持兼容性
+from utils.product_name import normalize_product_name
 
 
 def register_chinese_font():